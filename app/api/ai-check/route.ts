@@ -28,22 +28,16 @@ export async function POST(request: NextRequest) {
       })
     }
 
-    // Convert file to base64 for processing
-    const bytes = await file.arrayBuffer()
-    const buffer = Buffer.from(bytes)
-    const base64Image = buffer.toString("base64")
+    // Forward the file as multipart, the service decodes the raw bytes directly
+    const serviceForm = new FormData()
+    serviceForm.append("image", file)
+    serviceForm.append("model_path", "models/gnet.h5")
 
     try {
       // Call Python AI detection service
       const response = await fetch(`${aiServiceUrl}/ai-check`, {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          image: base64Image,
-          model_path: "models/gnet.h5",
-        }),
+        body: serviceForm,
       })
 
       if (!response.ok) {
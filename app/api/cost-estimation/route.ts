@@ -40,7 +40,10 @@ export async function POST(request: NextRequest) {
     // Calculate cost for each detected damage
     const costBreakdown = detections.map((detection: any) => {
       const damageType = detection.class.toLowerCase().replace(" ", "_")
-      const severity = detection.confidence > 0.8 ? "severe" : detection.confidence > 0.6 ? "moderate" : "minor"
+      // Per-detection severity from the AI service, else a guess from detection confidence
+      const severity = ["minor", "moderate", "severe"].includes(detection.severity)
+        ? detection.severity
+        : detection.confidence > 0.8 ? "severe" : detection.confidence > 0.6 ? "moderate" : "minor"
 
       const damageInfo = COST_DATABASE.damage_types[damageType] || COST_DATABASE.damage_types["dent"]
 
@@ -52,22 +52,18 @@ export async function POST(request: NextRequest) {
       })
     }
 
-    // Convert file to base64 for processing
-    const bytes = await file.arrayBuffer()
-    const buffer = Buffer.from(bytes)
-    const base64Image = buffer.toString("base64")
+    // Forward the file as multipart, the service decodes the raw bytes directly
+    const serviceForm = new FormData()
+    serviceForm.append("image", file)
+    serviceForm.append("method", method)
+    // Severity per detected damage, classified on each box's crop
+    serviceForm.append("per_detection", "true")
 
     try {
       // Call complete analysis endpoint
       const response = await fetch(`${aiServiceUrl}/complete-analysis`, {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          image: base64Image,
-          method: method,
-        }),
+        body: serviceForm,
       })
 
       if (!response.ok) {
@@ -87,8 +83,16 @@ export async function POST(request: NextRequest) {
         )
       }
 
+      const regions = result.damage_regions?.regions || []
+      const detections = result.detection.detections.map((detection: any, index: number) => ({
+        ...detection,
+        severity: regions[index]?.severity,
+        severity_confidence: regions[index]?.severity_confidence,
+        damage_type: regions[index]?.damage_type,
+      }))
+
       return NextResponse.json({
-        detections: result.detection.detections,
+        detections: detections,
         confidence: result.detection.confidence,
         processing_time: result.total_processing_time,
         annotated_image: result.detection.annotated_image,
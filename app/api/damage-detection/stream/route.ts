@@ -0,0 +1,55 @@
+import type { NextRequest } from "next/server"
+
+// Relays the service's Server-Sent Events: one `stage` event per finished
+// model, then `summary` (or `error`). Closing the stream cancels the
+// stages the service has not run yet.
+export async function POST(request: NextRequest) {
+  const formData = await request.formData()
+  const file = formData.get("image") as File
+  const method = (formData.get("method") as string) || "yolo"
+
+  if (!file) {
+    return Response.json({ error: "No image provided" }, { status: 400 })
+  }
+
+  if (!["yolo", "roboflow"].includes(method)) {
+    return Response.json({ error: "Invalid detection method" }, { status: 400 })
+  }
+
+  const aiServiceUrl = process.env.AI_SERVICE_URL
+  if (!aiServiceUrl) {
+    return Response.json({ error: "AI service URL not configured" }, { status: 503 })
+  }
+
+  const serviceForm = new FormData()
+  serviceForm.append("image", file)
+  serviceForm.append("method", method)
+  serviceForm.append("per_detection", "true")
+
+  try {
+    const response = await fetch(`${aiServiceUrl}/complete-analysis/stream`, {
+      method: "POST",
+      body: serviceForm,
+      // Aborted when the browser disconnects, which closes the upstream stream
+      signal: request.signal,
+    })
+
+    if (!response.ok || !response.body) {
+      return Response.json(
+        { error: `Analysis service responded with status: ${response.status}` },
+        { status: response.status === 429 || response.status === 503 ? response.status : 502 },
+      )
+    }
+
+    return new Response(response.body, {
+      headers: {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        Connection: "keep-alive",
+      },
+    })
+  } catch (error) {
+    console.error("Streaming analysis error:", error)
+    return Response.json({ error: "Failed to stream damage analysis" }, { status: 502 })
+  }
+}
@@ -0,0 +1,251 @@
+"""Admission control: priority lanes, bounded model queues and deadlines.
+
+Requests are sorted into two lanes by endpoint. Single-model calls are
+"interactive". The full pipeline, the batch endpoints and video analysis
+are "bulk". Each lane has its own in-flight limit, and requests over it
+are rejected with 429 before their body is read, so a burst of pipeline
+calls cannot use up the capacity meant for cheap calls.
+
+Each model has a bounded wait queue in front of its inference slots. A
+freed slot goes to the interactive lane first, then to bulk, first-come,
+first-served within a lane. When the queue is full the call fails fast with 503. Both
+rejections carry a Retry-After header.
+
+Queued jobs (see `jobs`) run in a third, "background" lane. It has no
+in-flight limit of its own and no deadline, and its calls are served
+after both request lanes.
+
+Every request has a deadline: REQUEST_DEADLINE_MS from arrival, or less if
+the client sends `X-Request-Deadline-Ms` or `?deadline_ms=`. Work that is
+still queued when its deadline passes is dropped with 504 instead of being
+computed for a client that already gave up.
+
+Configuration (environment variables):
+    ADMISSION_MAX_INTERACTIVE  in-flight interactive requests before 429 (default 128)
+    ADMISSION_MAX_BULK         in-flight pipeline, batch and video requests before 429 (default 16)
+    ADMISSION_QUEUE_DEPTH      calls allowed to wait for one model (default 64)
+    ADMISSION_QUEUE_DEPTH_<M>  override for one model, e.g. ADMISSION_QUEUE_DEPTH_YOLO=16
+    REQUEST_DEADLINE_MS        default request deadline (default 30000, 0 = none)
+    RETRY_AFTER_SECONDS        Retry-After sent with 429 and 503 (default 1)
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+
+from metrics import ADMISSION_REJECTED
+
+# Lower index is served first. "background" is for queued jobs, see `background()`
+LANES = ("interactive", "bulk", "background")
+LANE_LIMITS = {
+    "interactive": int(os.getenv("ADMISSION_MAX_INTERACTIVE", "128")),
+    "bulk": int(os.getenv("ADMISSION_MAX_BULK", "16"))
+}
+DEFAULT_QUEUE_DEPTH = int(os.getenv("ADMISSION_QUEUE_DEPTH", "64"))
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "30000"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "1"))
+
+_lane: contextvars.ContextVar[str] = contextvars.ContextVar("admission_lane", default="interactive")
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("admission_deadline", default=None)
+_in_flight: Dict[str, int] = {lane: 0 for lane in LANES}
+
+
+class AdmissionError(HTTPException):
+    """Request refused or dropped by admission control"""
+
+    def __init__(self, status_code: int, detail: str, reason: str, retry_after: Optional[int] = None):
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        super().__init__(status_code=status_code, detail=detail, headers=headers)
+        ADMISSION_REJECTED.inc(reason)
+
+
+class LaneFull(AdmissionError):
+    def __init__(self, lane: str):
+        super().__init__(429, f"Too many {lane} requests in flight, retry later", "lane_full", RETRY_AFTER_SECONDS)
+
+
+class QueueFull(AdmissionError):
+    def __init__(self, model_name: str):
+        super().__init__(503, f"{model_name} queue is full, retry later", "queue_full", RETRY_AFTER_SECONDS)
+
+
+class DeadlineExceeded(AdmissionError):
+    def __init__(self, model_name: str):
+        super().__init__(504, f"Deadline exceeded while queued for {model_name}", "deadline")
+
+
+def queue_depth(model_name: str) -> int:
+    """Configured wait queue bound for `model_name`"""
+    override = os.getenv(f"ADMISSION_QUEUE_DEPTH_{model_name.upper()}")
+    return max(0, int(override)) if override else max(0, DEFAULT_QUEUE_DEPTH)
+
+
+def lane_for(path: str) -> str:
+    """Lane of an endpoint path"""
+    if path.startswith(("/complete-analysis", "/video-analysis")) or path.endswith("/batch"):
+        return "bulk"
+    return "interactive"
+
+
+def request_deadline_ms(header: Optional[str], query: Optional[str]) -> Optional[float]:
+    """Budget for this request: the default, tightened by the client's, None for no deadline"""
+    budgets = [REQUEST_DEADLINE_MS] if REQUEST_DEADLINE_MS > 0 else []
+    for value in (header, query):
+        try:
+            if value is not None and float(value) > 0:
+                budgets.append(float(value))
+        except ValueError:
+            continue
+    return min(budgets) if budgets else None
+
+
+def enter(path: str, deadline_ms: Optional[float]) -> Tuple[str, List[contextvars.Token]]:
+    """Admit a request into its lane, raises LaneFull when the lane is at its limit"""
+    lane = lane_for(path)
+    if _in_flight[lane] >= LANE_LIMITS[lane]:
+        raise LaneFull(lane)
+    _in_flight[lane] += 1
+    deadline = time.perf_counter() + deadline_ms / 1000 if deadline_ms is not None else None
+    return lane, [_lane.set(lane), _deadline.set(deadline)]
+
+
+def leave(lane: str, tokens: List[contextvars.Token]):
+    _in_flight[lane] -= 1
+    _deadline.reset(tokens[1])
+    _lane.reset(tokens[0])
+
+
+@contextmanager
+def background() -> Iterator[None]:
+    """Run job work at the lowest priority, with no deadline and outside the lane limits"""
+    tokens = [_lane.set("background"), _deadline.set(None)]
+    _in_flight["background"] += 1
+    try:
+        yield
+    finally:
+        _in_flight["background"] -= 1
+        _deadline.reset(tokens[1])
+        _lane.reset(tokens[0])
+
+
+def shared_context(priority: int) -> contextvars.Context:
+    """Fresh context for work done on behalf of several requests: the lane of the most urgent one, no deadline"""
+    context = contextvars.Context()
+    context.run(_lane.set, LANES[priority])
+    return context
+
+
+def current_priority() -> int:
+    """Queue priority of the current request, lower is served first"""
+    return LANES.index(_lane.get())
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before `deadline`, None without one"""
+    return None if deadline is None else deadline - time.perf_counter()
+
+
+def check_deadline(model_name: str, deadline: Optional[float] = None):
+    """Raise DeadlineExceeded if the current request's deadline has passed"""
+    left = remaining(deadline if deadline is not None else current_deadline())
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(model_name)
+
+
+class PrioritySlots:
+    """Semaphore whose waiters are served by priority, with a bounded wait queue"""
+
+    def __init__(self, model_name: str, capacity: int, depth: int):
+        self.model_name = model_name
+        self.free = capacity
+        self.depth = depth
+        self.waiting = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    async def acquire(self):
+        deadline = current_deadline()
+        check_deadline(self.model_name, deadline)
+        if self.free > 0 and self.waiting == 0:
+            self.free -= 1
+            return
+        if self.waiting >= self.depth:
+            raise QueueFull(self.model_name)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (current_priority(), next(self._order), future))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, remaining(deadline))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as the wait ended
+                self.release()
+            else:
+                future.cancel()
+                self.waiting -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise DeadlineExceeded(self.model_name)
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(None)
+                return
+        self.free += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc: Any):
+        self.release()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the lane limit and deadline of every POST request.
+
+    The lane slot and deadline are held until the response has been sent. A
+    streamed response keeps them while its body is generated.
+    """
+
+    def __init__(self, app: Any, unlimited_paths: Tuple[str, ...] = ()):
+        self.app = app
+        self.unlimited_paths = unlimited_paths
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or scope["method"] != "POST" or path.startswith(self.unlimited_paths):
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        deadline_ms = request_deadline_ms(request.headers.get("x-request-deadline-ms"),
+                                          request.query_params.get("deadline_ms"))
+        try:
+            lane, tokens = enter(path, deadline_ms)
+        except AdmissionError as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            leave(lane, tokens)
+
+
+def stats() -> Dict[str, Any]:
+    """In-flight requests per lane"""
+    return {"in_flight": dict(_in_flight), "limits": dict(LANE_LIMITS)}
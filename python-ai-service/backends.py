@@ -0,0 +1,254 @@
+"""Pluggable inference backends.
+
+Each model can run on its original framework (TensorFlow, PyTorch,
+transformers) or on ONNX Runtime from files produced by `export_onnx.py`.
+The ONNX wrappers expose the same call surface the service already uses
+(`predict` for Keras, `xyxy`/`names` results for YOLO, pipeline-style
+callables for the Hugging Face classifiers), so the stage code does not
+care which backend is active. With every model on ONNX a worker never
+imports TensorFlow or PyTorch.
+
+Configuration (environment variables):
+    MODEL_BACKEND          "framework" (default) or "onnx"
+    MODEL_BACKEND_<M>      override for one model, e.g. MODEL_BACKEND_YOLO=onnx
+    ONNX_MODEL_DIR         exported models (default models/onnx)
+    ONNX_QUANTIZED         1 to load the INT8 variants (<name>.int8.onnx)
+    ONNX_PROVIDERS         execution providers, e.g. OpenVINOExecutionProvider,CPUExecutionProvider
+    ONNX_INTRA_OP_THREADS  threads per session (0 = ONNX Runtime default)
+"""
+import json
+import logging
+import math
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "models/onnx")
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "0") == "1"
+
+# Models that have an ONNX export
+ONNX_MODELS = ("gnet", "yolo", "damage_severity", "car_brand", "damage_type")
+
+
+def model_backend(name: str) -> str:
+    """Configured backend for `name`: "framework" or "onnx" """
+    backend = os.getenv(f"MODEL_BACKEND_{name.upper()}") or os.getenv("MODEL_BACKEND", "framework")
+    return backend.lower() if name in ONNX_MODELS else "framework"
+
+
+def onnx_path(name: str, quantized: Optional[bool] = None) -> str:
+    """Path of the exported model, INT8 variant when quantized"""
+    quantized = ONNX_QUANTIZED if quantized is None else quantized
+    return os.path.join(ONNX_MODEL_DIR, f"{name}.int8.onnx" if quantized else f"{name}.onnx")
+
+
+def sidecar_path(name: str) -> str:
+    """Metadata written next to the export (labels, preprocessing)"""
+    return os.path.join(ONNX_MODEL_DIR, f"{name}.json")
+
+
+def create_session(path: str):
+    """ONNX Runtime session with the configured providers and threads"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    threads = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+    if threads > 0:
+        options.intra_op_num_threads = threads
+    available = ort.get_available_providers()
+    requested = [p.strip() for p in os.getenv("ONNX_PROVIDERS", "CPUExecutionProvider").split(",") if p.strip()]
+    providers = [p for p in requested if p in available] or ["CPUExecutionProvider"]
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+
+class OnnxKerasModel:
+    """ONNX stand-in for a Keras model, keeps the `predict` signature"""
+
+    def __init__(self, path: str):
+        self.session = create_session(path)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, image_batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        return self.session.run(None, {self.input_name: image_batch.astype(np.float32, copy=False)})[0]
+
+
+class OnnxYoloResults:
+    """The subset of YOLOv5 `Detections` the service reads"""
+
+    def __init__(self, xyxy: List[np.ndarray]):
+        self.xyxy = xyxy
+
+
+def letterbox_shape(shapes: Sequence[Tuple[int, ...]], size: int, stride: int) -> Tuple[int, int]:
+    """(height, width) a batch is letterboxed to, like YOLOv5's AutoShape
+
+    Each image is scaled to `size` on its long side, and the batch shares the
+    smallest stride-aligned rectangle that holds all of them, so a 4:3 photo
+    runs at 480x640 instead of 640x640.
+    """
+    scaled = [(int(height * size / max(height, width)), int(width * size / max(height, width)))
+              for height, width in (shape[:2] for shape in shapes)]
+    return tuple(math.ceil(max(side) / stride) * stride for side in zip(*scaled))
+
+
+def letterbox(image: np.ndarray, shape: Tuple[int, int]) -> tuple:
+    """Resize keeping aspect ratio and pad to (height, width) `shape`, as YOLOv5 does"""
+    height, width = image.shape[:2]
+    scale = min(shape[0] / height, shape[1] / width)
+    new_width, new_height = int(round(width * scale)), int(round(height * scale))
+    pad_x, pad_y = (shape[1] - new_width) / 2, (shape[0] - new_height) / 2
+    resized = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return padded, scale, (left, top)
+
+
+def yolo_postprocess(prediction: np.ndarray, conf_threshold: float, iou_threshold: float,
+                     max_detections: int = 1000) -> np.ndarray:
+    """Confidence filter and class-aware NMS on raw YOLOv5 output, returns (n, 6) xyxy/conf/cls"""
+    objectness = prediction[:, 4]
+    prediction = prediction[objectness > conf_threshold]
+    if not len(prediction):
+        return np.zeros((0, 6), dtype=np.float32)
+
+    class_scores = prediction[:, 5:] * prediction[:, 4:5]
+    classes = class_scores.argmax(axis=1)
+    confidences = class_scores[np.arange(len(classes)), classes]
+    keep = confidences > conf_threshold
+    prediction, classes, confidences = prediction[keep], classes[keep], confidences[keep]
+    if not len(prediction):
+        return np.zeros((0, 6), dtype=np.float32)
+
+    cx, cy, w, h = prediction[:, 0], prediction[:, 1], prediction[:, 2], prediction[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    # Offset boxes per class so one NMS pass never suppresses across classes
+    offset = classes[:, None].astype(np.float32) * 4096
+    shifted = boxes + offset
+    indices = cv2.dnn.NMSBoxes(
+        [[float(x1), float(y1), float(x2 - x1), float(y2 - y1)] for x1, y1, x2, y2 in shifted],
+        confidences.astype(float).tolist(), conf_threshold, iou_threshold, top_k=max_detections
+    )
+    indices = np.array(indices).reshape(-1)
+    return np.concatenate([
+        boxes[indices], confidences[indices, None], classes[indices, None].astype(np.float32)
+    ], axis=1).astype(np.float32)
+
+
+class OnnxYoloModel:
+    """ONNX stand-in for the YOLOv5 hub model: `model(images).xyxy` and `model.names`
+
+    Exports with dynamic height and width get the hub model's rectangular
+    letterbox. Older exports with a fixed input are padded to a square.
+    """
+
+    def __init__(self, path: str, metadata: Dict[str, Any]):
+        self.session = create_session(path)
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Symbolic or unknown dimensions are strings or None
+        self.dynamic = not all(isinstance(side, int) for side in model_input.shape[2:])
+        self.names = {int(k): v for k, v in metadata["names"].items()}
+        self.size = int(metadata.get("imgsz", 640))
+        self.stride = int(metadata.get("stride", 32))
+        self.conf = float(metadata.get("conf", 0.25))
+        self.iou = float(metadata.get("iou", 0.45))
+
+    def preprocess(self, images: List[np.ndarray], size: Optional[int] = None) -> tuple:
+        if self.dynamic:
+            shape = letterbox_shape([image.shape for image in images], size or self.size, self.stride)
+        else:
+            shape = (self.size, self.size)
+        batch, transforms = [], []
+        for image in images:
+            padded, scale, pad = letterbox(image, shape)
+            batch.append(padded)
+            transforms.append((scale, pad, image.shape[:2]))
+        tensor = np.stack(batch).transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+        return np.ascontiguousarray(tensor), transforms
+
+    def __call__(self, images: Union[np.ndarray, List[np.ndarray]], size: Optional[int] = None) -> OnnxYoloResults:
+        images = images if isinstance(images, list) else [images]
+        tensor, transforms = self.preprocess(images, size)
+        predictions = self.session.run(None, {self.input_name: tensor})[0]
+
+        xyxy = []
+        for prediction, (scale, (left, top), (height, width)) in zip(predictions, transforms):
+            boxes = yolo_postprocess(prediction, self.conf, self.iou)
+            boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - left) / scale).clip(0, width)
+            boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - top) / scale).clip(0, height)
+            xyxy.append(boxes)
+        return OnnxYoloResults(xyxy)
+
+
+class OnnxImageClassifier:
+    """ONNX stand-in for a transformers image-classification pipeline"""
+
+    def __init__(self, path: str, metadata: Dict[str, Any], top_k: int = 5):
+        self.session = create_session(path)
+        self.input_name = self.session.get_inputs()[0].name
+        self.labels = {int(k): v for k, v in metadata["id2label"].items()}
+        self.size = (int(metadata["width"]), int(metadata["height"]))
+        self.rescale = float(metadata.get("rescale_factor", 1 / 255))
+        self.mean = np.array(metadata.get("image_mean", [0.5, 0.5, 0.5]), dtype=np.float32)
+        self.std = np.array(metadata.get("image_std", [0.5, 0.5, 0.5]), dtype=np.float32)
+        self.top_k = top_k
+
+    def preprocess(self, images: List[Image.Image]) -> np.ndarray:
+        """Same resize/rescale/normalize as the ViT image processor"""
+        pixels = np.stack([
+            np.asarray(image.convert("RGB").resize(self.size, Image.BILINEAR), dtype=np.float32)
+            for image in images
+        ])
+        pixels = (pixels * self.rescale - self.mean) / self.std
+        return np.ascontiguousarray(pixels.transpose(0, 3, 1, 2))
+
+    def __call__(self, images: Union[Image.Image, List[Image.Image]], batch_size: Optional[int] = None, **kwargs):
+        single = not isinstance(images, list)
+        batch = [images] if single else images
+        logits = self.session.run(None, {self.input_name: self.preprocess(batch)})[0]
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities = exp / exp.sum(axis=1, keepdims=True)
+
+        results = []
+        for row in probabilities:
+            top = np.argsort(row)[::-1][:self.top_k]
+            results.append([{"label": self.labels[int(i)], "score": float(row[i])} for i in top])
+        return results[0] if single else results
+
+
+def load_onnx_model(name: str, quantized: Optional[bool] = None) -> Optional[Any]:
+    """Load the ONNX export of `name`, None when it has not been exported"""
+    path = onnx_path(name, quantized)
+    if not os.path.exists(path):
+        logger.warning(f"❌ ONNX model not found at {path}, run export_onnx.py first")
+        return None
+
+    metadata = {}
+    if os.path.exists(sidecar_path(name)):
+        with open(sidecar_path(name), "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+
+    if name in ("gnet", "damage_severity"):
+        model = OnnxKerasModel(path)
+    elif name == "yolo":
+        model = OnnxYoloModel(path, metadata)
+    else:
+        model = OnnxImageClassifier(path, metadata)
+    logger.info(f"✅ {name} loaded on ONNX Runtime from {path}")
+    return model
+
+
+def select_loader(name: str, framework_loader: Callable[[], Any]) -> Callable[[], Any]:
+    """Loader that honors the configured backend for `name`"""
+    def loader():
+        if model_backend(name) == "onnx":
+            return load_onnx_model(name)
+        return framework_loader()
+    return loader
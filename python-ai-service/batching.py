@@ -0,0 +1,161 @@
+"""Dynamic micro-batching for models that take fixed-size inputs.
+
+Concurrent requests to the same model are queued, merged into one stacked
+`predict` call and the rows of the result are routed back to each caller.
+A batch is dispatched as soon as it is full or the oldest request has
+waited `max_wait_ms`. While every model slot is busy requests keep
+queueing, so batches grow with load instead of piling up as singletons.
+
+The queue is bounded by the model's admission depth and ordered by
+priority lane. Requests whose deadline passes while queued are dropped
+before they reach a batch. The collector and the batches run in a context
+of their own, not in the one of the request that started them: a batch
+has no deadline and takes the lane of its most urgent request.
+
+Configuration (environment variables):
+    BATCH_MAX_SIZE         default largest batch per model (default 8)
+    BATCH_MAX_WAIT_MS      default wait for a batch to fill (default 5)
+    BATCH_MAX_SIZE_<M>     override for one model, e.g. BATCH_MAX_SIZE_GNET=16
+    BATCH_MAX_WAIT_MS_<M>  override for one model
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+from typing import Callable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from admission import (DeadlineExceeded, QueueFull, current_deadline, current_priority, queue_depth, remaining,
+                       shared_context)
+from inference import model_concurrency, run_inference
+from metrics import BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def batch_setting(name: str, model_name: str, default: float) -> float:
+    """Read `name` for `model_name`, falling back to the global value"""
+    value = os.getenv(f"{name}_{model_name.upper()}") or os.getenv(name)
+    return float(value) if value else default
+
+
+class MicroBatcher:
+    """Merge concurrent single-item predictions into batched model calls"""
+
+    def __init__(
+        self,
+        model_name: str,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
+        self.model_name = model_name
+        self.predict_fn = predict_fn
+        if max_batch_size is None:
+            max_batch_size = int(batch_setting("BATCH_MAX_SIZE", model_name, 8))
+        if max_wait_ms is None:
+            max_wait_ms = batch_setting("BATCH_MAX_WAIT_MS", model_name, 5)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queued = queue_depth(model_name)
+        self._order = itertools.count()
+        self._loop = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def submit(self, item: np.ndarray) -> np.ndarray:
+        """Predict a single (unbatched) input, returns its row of the output"""
+        self._ensure_worker()
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFull(self.model_name)
+        deadline = current_deadline()
+        future = self._loop.create_future()
+        self._queue.put_nowait((current_priority(), next(self._order), deadline, item, future))
+        try:
+            # A timed-out future is cancelled, so the collector skips it
+            return await asyncio.wait_for(future, remaining(deadline))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(self.model_name)
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting to be batched"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def close(self):
+        """Stop collecting batches, in-flight batches are left to finish"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        self._queue = None
+        self._slots = None
+        self._loop = None
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.PriorityQueue()
+            self._slots = asyncio.Semaphore(model_concurrency(self.model_name))
+            # create_task copies the running context, run it in a fresh one
+            self._worker = contextvars.Context().run(loop.create_task, self._collect())
+
+    async def _collect(self):
+        while True:
+            await self._slots.acquire()
+            batch = []
+            while not batch:
+                self._take(await self._queue.get(), batch)
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    self._take(self._queue.get_nowait(), batch)
+                    continue
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._take(await asyncio.wait_for(self._queue.get(), timeout), batch)
+                except asyncio.TimeoutError:
+                    break
+
+            priority = min(priority for priority, _, _ in batch)
+            task = shared_context(priority).run(self._loop.create_task, self._dispatch(batch, self._slots))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    def _take(self, entry: tuple, batch: List[Tuple[int, np.ndarray, asyncio.Future]]):
+        """Add a queued request to `batch` unless its caller gave up or its deadline passed"""
+        priority, _, deadline, item, future = entry
+        if future.done():
+            return
+        if deadline is not None and remaining(deadline) <= 0:
+            future.set_exception(DeadlineExceeded(self.model_name))
+            return
+        batch.append((priority, item, future))
+
+    async def _dispatch(self, batch: List[Tuple[int, np.ndarray, asyncio.Future]], slots: asyncio.Semaphore):
+        try:
+            BATCH_SIZE.observe(len(batch), self.model_name)
+            items = np.stack([item for _, item, _ in batch])
+            predictions = await run_inference(self.model_name, self.predict_fn, items)
+        except Exception as e:
+            logger.error(f"{self.model_name} batch of {len(batch)} failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            slots.release()
+
+        for (_, _, future), row in zip(batch, predictions):
+            if not future.done():
+                future.set_result(row)
@@ -0,0 +1,76 @@
+"""Annotation rendering benchmark for the detection endpoints.
+
+Times `format_yolo_detections` on a synthetic phone-sized photo for the
+previous behaviour (full-size copy, default JPEG quality), the downscaled
+preview, and annotation=none, and prints mean/p50 latency and payload size
+as JSON.
+
+    python benchmarks/bench_annotation.py --width 4032 --height 3024 --boxes 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import format_yolo_detections  # noqa: E402
+
+CASES = {
+    "full_size": {"annotation": "inline", "annotation_max_side": 0, "annotation_quality": 95},
+    "preview": {"annotation": "inline"},
+    "none": {"annotation": "none"}
+}
+
+
+def synthetic_photo(width: int, height: int) -> np.ndarray:
+    """Smooth gradient with noise, compresses roughly like a real photo"""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                     np.full((height, width), 128, np.float32)], axis=2)
+    return np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+
+
+def synthetic_boxes(width: int, height: int, count: int) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    x1 = rng.uniform(0, width * 0.8, count)
+    y1 = rng.uniform(0, height * 0.8, count)
+    return np.stack([x1, y1, x1 + width * 0.15, y1 + height * 0.15,
+                     rng.uniform(0.4, 0.95, count), rng.integers(0, 3, count)], axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--boxes", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    image = synthetic_photo(args.width, args.height)
+    boxes = synthetic_boxes(args.width, args.height, args.boxes)
+    names = {0: "dent", 1: "scratch", 2: "crack"}
+
+    report = {}
+    for case, options in CASES.items():
+        format_yolo_detections(image, boxes, names, 0.0, options)
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = format_yolo_detections(image, boxes, names, 0.0, options)
+            timings.append((time.perf_counter() - start) * 1000)
+        report[case] = {
+            "mean_ms": float(np.mean(timings)),
+            "p50_ms": float(np.percentile(timings, 50)),
+            "payload_bytes": len(result["annotated_image"] or "")
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
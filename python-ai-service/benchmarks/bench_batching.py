@@ -0,0 +1,104 @@
+"""Micro-batching benchmark for the 224x224 Keras models.
+
+Compares today's batch-of-one `predict` path with the MicroBatcher at
+several concurrency levels and prints throughput and p50/p99 latency as
+JSON. Without `--model` a stub with a fixed per-call overhead plus a
+per-image cost stands in for the network so it runs offline on CPU.
+
+    python benchmarks/bench_batching.py --concurrency 1 4 16 32
+    python benchmarks/bench_batching.py --model models/gnet.h5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher  # noqa: E402
+from inference import run_inference, shutdown_executor  # noqa: E402
+
+
+def stub_predict(call_overhead_ms: float, per_image_ms: float):
+    """Stand-in predict whose cost is dominated by per-call overhead"""
+    def predict(image_batch: np.ndarray) -> np.ndarray:
+        time.sleep((call_overhead_ms + per_image_ms * len(image_batch)) / 1000)
+        return np.full((len(image_batch), 1), 0.25, dtype=np.float32)
+    return predict
+
+
+def keras_predict(model_path: str):
+    """Real Keras model, same call as main.py"""
+    import tensorflow as tf
+    model = tf.keras.models.load_model(model_path)
+    return lambda image_batch: model.predict(image_batch, verbose=0)
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000) if latencies else 0.0
+
+
+async def drive(call, concurrency: int, requests: int):
+    """Run `requests` calls with `concurrency` clients, return stats"""
+    image = np.random.rand(224, 224, 3)
+    latencies = []
+    remaining = requests
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            await call(image)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "throughput_rps": requests / elapsed,
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+    }
+
+
+async def run(args):
+    predict = keras_predict(args.model) if args.model else stub_predict(args.call_overhead_ms, args.per_image_ms)
+    batcher = MicroBatcher("bench", predict, args.max_batch_size, args.max_wait_ms)
+
+    async def batch_of_one(image):
+        return (await run_inference("bench", predict, np.expand_dims(image, axis=0)))[0]
+
+    report = {"config": vars(args), "results": []}
+    for concurrency in args.concurrency:
+        report["results"].append({
+            "concurrency": concurrency,
+            "batch_of_one": await drive(batch_of_one, concurrency, args.requests),
+            "micro_batched": await drive(batcher.submit, concurrency, args.requests),
+        })
+    await batcher.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--model", help="Keras .h5 model, defaults to a stub")
+    parser.add_argument("--call-overhead-ms", type=float, default=15)
+    parser.add_argument("--per-image-ms", type=float, default=2)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    shutdown_executor()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
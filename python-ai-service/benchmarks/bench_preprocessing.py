@@ -0,0 +1,96 @@
+"""Per-request cost of preparing the classifier inputs.
+
+Compares the old preprocessing with the shared path in `preprocessing`.
+The old path does a full decode, cvtColor, resize to 224, then `/ 255.0`
+into float64, which Keras casts to float32. The new path decodes at
+reduced resolution, shares the resized view, and normalizes into a pooled
+float32 buffer. Both paths feed GNet, damage severity and the PIL image of
+the Hugging Face pipelines, as /complete-analysis does. Prints JSON with
+the time, the peak Python-tracked allocation per request and the largest
+pixel difference of the Keras input.
+
+    python benchmarks/bench_preprocessing.py --sizes 4032x3024 1920x1080 --repeat 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import synthetic_jpeg  # noqa: E402
+from preprocessing import KERAS_INPUT, ImageContext, keras_buffers  # noqa: E402
+
+
+def old_path(data: bytes) -> np.ndarray:
+    """Preprocessing before the shared module, per model"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    inputs = None
+    for _ in ("gnet", "damage_severity"):
+        normalized = cv2.resize(rgb, (224, 224)) / 255.0
+        inputs = np.expand_dims(normalized, 0).astype(np.float32)  # the cast done by Keras
+    Image.fromarray(rgb)  # Hugging Face pipelines
+    return inputs[0]
+
+
+def new_path(data: bytes) -> np.ndarray:
+    context = ImageContext.from_bytes(data)
+    result = None
+    for _ in ("gnet", "damage_severity"):
+        batch = np.stack([context.resized_rgb(KERAS_INPUT.size)])
+        with keras_buffers.normalized(batch) as inputs:
+            result = inputs[0].copy()
+    context.pil
+    return result
+
+
+def measure(fn, data: bytes, repeat: int):
+    fn(data)  # warm-up, fills the buffer pool
+    times, peaks = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        times.append((time.perf_counter() - start) * 1000)
+    for _ in range(min(repeat, 5)):
+        tracemalloc.start()
+        fn(data)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"ms_median": statistics.median(times), "ms_p95": float(np.percentile(times, 95)),
+            "peak_alloc_mb": max(peaks) / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=["4032x3024", "1920x1080", "640x480"])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    report = {"cpus": os.cpu_count(), "results": {}}
+    for size in args.sizes:
+        width, height = (int(v) for v in size.lower().split("x"))
+        data = synthetic_jpeg(width, height, 0)
+        old, new = measure(old_path, data, args.repeat), measure(new_path, data, args.repeat)
+        allocations_before = keras_buffers.allocations
+        new_path(data)
+        report["results"][size] = {
+            "old": old,
+            "new": new,
+            "speedup": old["ms_median"] / new["ms_median"],
+            "buffer_allocations_per_request": keras_buffers.allocations - allocations_before,
+            "keras_input_max_abs_diff": float(np.abs(old_path(data) - new_path(data)).max())
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Per-image latency of the Mask R-CNN damage segmenter.
+
+Compares the notebook path, which builds a new config and DefaultPredictor
+(reloading the weights) for every image, with the cached `DamageSegmenter`
+called one image at a time and in batches. Prints JSON. Requires
+detectron2. Without the CarDD weights the COCO model-zoo checkpoint is
+used, which has the same architecture and cost.
+
+    python benchmarks/bench_segmentation.py --weights models/damage_maskrcnn.pth --images 8 --batch-size 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from damage_segmentation import SEGMENTATION_CLASSES, SEGMENTATION_CONFIG, DamageSegmenter  # noqa: E402
+
+
+def rebuild_per_call(weights: str, num_classes: int):
+    """The notebook's detect_damage: new config and predictor for each image"""
+    import torch
+    from detectron2 import model_zoo
+    from detectron2.config import get_cfg
+    from detectron2.engine import DefaultPredictor
+
+    def predict(image: np.ndarray):
+        cfg = get_cfg()
+        cfg.merge_from_file(model_zoo.get_config_file(SEGMENTATION_CONFIG))
+        cfg.MODEL.ROI_HEADS.NUM_CLASSES = num_classes
+        cfg.MODEL.WEIGHTS = weights
+        cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.5
+        cfg.MODEL.DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+        return DefaultPredictor(cfg)(image)
+    return predict
+
+
+def per_image_ms(fn, images, chunk: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(images), chunk):
+        fn(images[i:i + chunk])
+    return (time.perf_counter() - start) * 1000 / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--weights", default="models/damage_maskrcnn.pth")
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    args = parser.parse_args()
+
+    class_names = SEGMENTATION_CLASSES
+    weights = args.weights
+    if not os.path.exists(weights):
+        from detectron2 import model_zoo
+        weights = model_zoo.get_checkpoint_url(SEGMENTATION_CONFIG)
+        class_names = [str(i) for i in range(80)]
+
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8) for _ in range(args.images)]
+
+    rebuild = rebuild_per_call(weights, len(class_names))
+    build_start = time.perf_counter()
+    segmenter = DamageSegmenter(weights, class_names)
+    build_ms = (time.perf_counter() - build_start) * 1000
+    segmenter.predict(images[:1])  # warm-up
+
+    report = {
+        "images": args.images,
+        "segmenter_build_ms": build_ms,
+        "rebuild_per_call_ms_per_image": per_image_ms(lambda batch: rebuild(batch[0]), images, 1),
+        "cached_ms_per_image": per_image_ms(segmenter.predict, images, 1),
+        f"cached_batch{args.batch_size}_ms_per_image": per_image_ms(segmenter.predict, images, args.batch_size)
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
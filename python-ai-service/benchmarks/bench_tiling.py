@@ -0,0 +1,229 @@
+"""Recall and latency of tiled YOLO inference against full-frame resizing.
+
+Generates high-resolution photos with painted damage: thin scratches a few
+pixels wide and large dents, with their ground-truth boxes. Then it runs
+three modes:
+
+* full frame at the model size (640), what /yolo-detect does by default
+* full frame upscaled to the same compute budget as the tiled run, i.e.
+  the side whose square matches the pixels of all tiles plus the full frame
+* tiled, through `tiling.tiled_predict`
+
+For each mode it reports recall at IoU 0.5 for small and large damage,
+precision and the median latency.
+
+With `--weights` the real YOLOv5 model is used (torch hub, or the ONNX
+backend for a .onnx file). Without weights the detector is
+`ResolutionLimitedDetector`. It letterboxes every input to the model size
+like YOLO does, finds the painted damage by colour, and costs
+`--ms-per-mpix` per megapixel of model input, about YOLOv5s on a CPU. A
+scratch shrunk below a couple of pixels is blended into the paint by the
+downscale and missed, which is the failure tiling fixes. The stand-in
+doesn't model how a real network degrades on objects far from its
+training scale, so for final numbers run it with the weights.
+
+Several tile sizes can be compared in one run. Tiles larger than the model
+size are letterboxed down by the model, which gives cheaper tilings between
+the two full-frame extremes.
+
+    python benchmarks/bench_tiling.py --size 4032x3024 --images 5 --tile-size 640,1280 --overlap 0.2
+    python benchmarks/bench_tiling.py --weights models/best.pt
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tiling import tile_views, tiled_predict  # noqa: E402
+
+SCRATCH_COLOR = (40, 40, 210)
+DENT_COLOR = (210, 120, 30)
+SMALL_MAX_SIDE = 96  # ground truth with a longer side up to this is "small"
+
+
+class DetectorResults:
+    def __init__(self, xyxy: List[np.ndarray]):
+        self.xyxy = xyxy
+
+
+class ResolutionLimitedDetector:
+    """Stand-in YOLO that only resolves damage at least `min_side` model-input pixels across"""
+
+    names = {0: "scratch", 1: "dent"}
+
+    def __init__(self, size: int = 640, min_side: int = 2, ms_per_mpix: float = 220.0):
+        self.size = size
+        self.min_side = min_side
+        self.ms_per_mpix = ms_per_mpix
+
+    def __call__(self, images: List[np.ndarray], size: Optional[int] = None) -> DetectorResults:
+        size = size or self.size
+        start = time.perf_counter()
+        xyxy = [self.detect(image, size) for image in images]
+        # Network cost of the batch, less the time the colour search already took
+        cost = self.ms_per_mpix * len(images) * size * size / 1e6 / 1000
+        time.sleep(max(0.0, cost - (time.perf_counter() - start)))
+        return DetectorResults(xyxy)
+
+    def detect(self, image: np.ndarray, size: int) -> np.ndarray:
+        height, width = image.shape[:2]
+        scale = min(size / height, size / width)
+        resized = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                             interpolation=cv2.INTER_AREA)
+        rows = []
+        for cls, color in enumerate((SCRATCH_COLOR, DENT_COLOR)):
+            target = np.array(color, dtype=np.int16)
+            mask = (np.abs(resized.astype(np.int16) - target).max(axis=2) < 40).astype(np.uint8)
+            count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            for x, y, w, h, _ in stats[1:count]:
+                if min(w, h) >= self.min_side:
+                    rows.append([x / scale, y / scale, (x + w) / scale, (y + h) / scale, 0.8, cls])
+        return np.array(rows, dtype=np.float32).reshape(-1, 6)
+
+
+class YoloDetector:
+    """The service's YOLO model, from a .pt file through torch hub or a .onnx file through the backend"""
+
+    def __init__(self, weights: str):
+        if weights.endswith(".onnx"):
+            from backends import OnnxYoloModel, read_metadata
+            self.model = OnnxYoloModel(weights, read_metadata(weights))
+        else:
+            import torch
+            self.model = torch.hub.load("ultralytics/yolov5", "custom", path=weights)
+        self.names = self.model.names
+
+    def __call__(self, images: List[np.ndarray], size: Optional[int] = None):
+        return self.model(images, size=size) if size else self.model(images)
+
+
+def synthetic_photo(width: int, height: int, scratches: int, dents: int,
+                    rng: np.random.Generator) -> Tuple[np.ndarray, List[Tuple[int, List[int]]]]:
+    """Painted panel with thin scratches and large dents, and its (class, box) ground truth"""
+    gradient = np.linspace(90, 170, width, dtype=np.float32)[None, :, None]
+    image = np.clip(gradient + rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+    truth = []
+    for _ in range(dents):
+        w, h = (int(v) for v in rng.integers(250, 600, 2))
+        x, y = int(rng.integers(0, width - w)), int(rng.integers(0, height - h))
+        cv2.ellipse(image, (x + w // 2, y + h // 2), (w // 2, h // 2), 0, 0, 360, DENT_COLOR, -1)
+        truth.append((1, [x, y, x + w, y + h]))
+    for _ in range(scratches):
+        length, thickness = int(rng.integers(25, 90)), int(rng.integers(3, 7))
+        w, h = (length, thickness) if rng.random() < 0.5 else (thickness, length)
+        x, y = int(rng.integers(0, width - w)), int(rng.integers(0, height - h))
+        cv2.rectangle(image, (x, y), (x + w - 1, y + h - 1), SCRATCH_COLOR, -1)
+        truth.append((0, [x, y, x + w, y + h]))
+    return image, truth
+
+
+def iou(a: List[float], b: List[float]) -> float:
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection)
+
+
+def score(truth: List[Tuple[int, List[int]]], boxes: np.ndarray, threshold: float = 0.5) -> Dict[str, int]:
+    """Greedy one-to-one matching of predictions to ground truth of the same class"""
+    counts = {"small": 0, "small_found": 0, "large": 0, "large_found": 0, "predicted": len(boxes), "matched": 0}
+    used = set()
+    for cls, box in truth:
+        kind = "small" if max(box[2] - box[0], box[3] - box[1]) <= SMALL_MAX_SIDE else "large"
+        counts[kind] += 1
+        best, best_iou = None, threshold
+        for i, row in enumerate(boxes):
+            if i not in used and int(row[5]) == cls:
+                overlap = iou(box, row[:4].tolist())
+                if overlap >= best_iou:
+                    best, best_iou = i, overlap
+        if best is not None:
+            used.add(best)
+            counts[f"{kind}_found"] += 1
+            counts["matched"] += 1
+    return counts
+
+
+def run_mode(name: str, detect, photos, repeat: int) -> Dict[str, Any]:
+    totals: Dict[str, int] = {}
+    times = []
+    for image, truth in photos:
+        boxes = detect(image)
+        for key, value in score(truth, boxes).items():
+            totals[key] = totals.get(key, 0) + value
+        for _ in range(repeat):
+            start = time.perf_counter()
+            detect(image)
+            times.append((time.perf_counter() - start) * 1000)
+    return {
+        "mode": name,
+        "recall_small": totals["small_found"] / max(totals["small"], 1),
+        "recall_large": totals["large_found"] / max(totals["large"], 1),
+        "precision": totals["matched"] / max(totals["predicted"], 1),
+        "ms_median": statistics.median(times)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="4032x3024", help="photo size")
+    parser.add_argument("--images", type=int, default=5)
+    parser.add_argument("--scratches", type=int, default=30, help="small damages per photo")
+    parser.add_argument("--dents", type=int, default=3, help="large damages per photo")
+    parser.add_argument("--tile-size", default="640,1280", help="comma-separated tile sizes")
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--model-size", type=int, default=640, help="model input size")
+    parser.add_argument("--weights", help="YOLOv5 .pt or .onnx weights instead of the stand-in detector")
+    parser.add_argument("--ms-per-mpix", type=float, default=220.0, help="stand-in cost per megapixel of input")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per photo and mode")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    rng = np.random.default_rng(args.seed)
+    photos = [synthetic_photo(width, height, args.scratches, args.dents, rng) for _ in range(args.images)]
+    model = YoloDetector(args.weights) if args.weights else ResolutionLimitedDetector(args.model_size,
+                                                                                       ms_per_mpix=args.ms_per_mpix)
+
+    def predict(inputs: List[np.ndarray], size: Optional[int] = None) -> List[np.ndarray]:
+        return [b.cpu().numpy() if hasattr(b, "cpu") else b for b in model(inputs, size).xyxy]
+
+    modes = [(f"full_frame@{args.model_size}", lambda image: predict([image])[0])]
+    tilings = []
+    for tile_size in (int(v) for v in args.tile_size.split(",")):
+        views, _ = tile_views(photos[0][0], tile_size, args.overlap)
+        assert all(np.shares_memory(view, photos[0][0]) for view in views)
+        inputs = len(views) + (1 if len(views) > 1 else 0)
+        # Same number of model-input pixels as all the tiles plus the full frame, rounded to the stride
+        budget_size = int(math.ceil(args.model_size * math.sqrt(inputs) / 32) * 32)
+        tilings.append({"tile_size": tile_size, "tiles_per_photo": len(views), "model_inputs": inputs,
+                        "equal_budget_size": budget_size})
+        modes.append((f"full_frame@{budget_size}",
+                      lambda image, size=budget_size: predict([image], size)[0]))
+        modes.append((f"tiled@{tile_size}",
+                      lambda image, settings=(tile_size, args.overlap): tiled_predict(predict, [image], settings)[0]))
+
+    results = [run_mode(name, detect, photos, args.repeat) for name, detect in modes]
+    report = {
+        "photo_size": args.size,
+        "detector": args.weights or "ResolutionLimitedDetector",
+        "overlap": args.overlap,
+        "tilings": tilings,
+        "results": results
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
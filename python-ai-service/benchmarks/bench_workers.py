@@ -0,0 +1,159 @@
+"""Throughput and memory of the multi-worker serving mode.
+
+For each worker count, starts `serving.py` on a local port with stub
+models carrying `--weight-mb` of weights each and drives it over HTTP. It
+reports aggregate throughput, latency, and the RSS and PSS of the parent
+and the workers. PSS counts each shared page once across the processes,
+so it shows how much of the weights the workers share instead of
+duplicating. Linux only (reads /proc).
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --weight-mb 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def child_pids(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def serve_stubs(weight_mb: float):
+    """Server process: the service with stub models, run through serving.serve"""
+    import main
+    import serving
+    import stub_models
+    stub_models.install(main.models, weight_mb=weight_mb)
+    serving.serve(main, host="127.0.0.1")
+
+
+async def drive(port: int, endpoint: str, image: bytes, concurrency: int, requests: int) -> Dict[str, Any]:
+    import httpx
+    from load_test import percentiles
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    next_index = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+        async def worker():
+            for _ in next_index:
+                start = time.perf_counter()
+                response = await client.post(endpoint, content=image, headers={"content-type": "image/jpeg"})
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+    return {"throughput_rps": requests / wall, "latency_ms": percentiles(latencies), "errors": errors}
+
+
+def run_level(workers: int, args, image: bytes) -> Dict[str, Any]:
+    import httpx
+    from model_registry import process_memory
+
+    port = free_port()
+    env = {
+        **os.environ,
+        "SERVE_WORKERS": str(workers),
+        "SERVE_PORT": str(port),
+        "SERVE_REPORT_SECONDS": "0",
+        "MODEL_LOADING": "eager",
+        "RESULT_CACHE_MAX_BYTES": "0",
+        "ADMISSION_MAX_BULK": "100000",
+        "ADMISSION_MAX_INTERACTIVE": "100000",
+    }
+    server = subprocess.Popen([sys.executable, __file__, "--serve", "--weight-mb", str(args.weight_mb)],
+                              cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + args.startup_timeout
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline or server.poll() is not None:
+                raise RuntimeError(f"server with {workers} workers did not start")
+            time.sleep(0.2)
+        # Every worker answers /health once it has started
+        while workers > 1 and len(child_pids(server.pid)) < workers:
+            time.sleep(0.2)
+        time.sleep(1)
+
+        asyncio.run(drive(port, args.endpoint, image, args.concurrency, args.concurrency))  # warm-up
+        result = asyncio.run(drive(port, args.endpoint, image, args.concurrency, args.requests))
+
+        pids = child_pids(server.pid) if workers > 1 else []
+        parent = process_memory(str(server.pid))
+        per_worker = [process_memory(str(pid)) for pid in pids]
+        processes = [parent] + per_worker
+        result.update({
+            "workers": workers,
+            "total_rss_mb": sum(m["rss"] for m in processes) / 2**20,
+            "total_pss_mb": sum(m["pss"] for m in processes) / 2**20,
+            "parent_pss_mb": parent["pss"] / 2**20,
+            "worker_pss_mb": [m["pss"] / 2**20 for m in per_worker],
+            "worker_shared_mb": [m["shared"] / 2**20 for m in per_worker]
+        })
+        return result
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--weight-mb", type=float, default=200, help="stub weights per model")
+    parser.add_argument("--endpoint", default="/complete-analysis?annotation=none")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_stubs(args.weight_mb)
+        return
+
+    from load_test import synthetic_jpeg
+    image = synthetic_jpeg(1280, 960, 0)
+    report = {"cpus": os.cpu_count(), "weight_mb_per_model": args.weight_mb, "results": []}
+    for workers in args.workers:
+        level = run_level(workers, args, image)
+        report["results"].append(level)
+        print(f"{workers} workers: {level['throughput_rps']:.1f} req/s, total pss {level['total_pss_mb']:.0f} MB, "
+              f"rss {level['total_rss_mb']:.0f} MB", file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
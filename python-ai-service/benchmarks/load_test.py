@@ -0,0 +1,239 @@
+"""In-process load test for the inference service.
+
+Starts the FastAPI app in this process, with stub models by default so it
+runs offline on CPU, and drives each endpoint through the ASGI interface
+at several concurrency levels and image sizes. For every combination it
+reports throughput, client latency percentiles, errors, the per-stage
+server time taken from the responses, and peak RSS. The report is JSON.
+`--baseline` compares a run with an earlier report and exits non-zero on
+regressions.
+
+    python benchmarks/load_test.py --concurrency 1 8 32 --sizes 640x480 1920x1080 --output run.json
+    python benchmarks/load_test.py --baseline run.json --tolerance 0.15
+    python benchmarks/load_test.py --real-models --endpoints /yolo-detect
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_ENDPOINTS = ["/ai-check", "/yolo-detect", "/damage-severity", "/brand-detection", "/damage-type",
+                     "/complete-analysis"]
+
+
+def synthetic_jpeg(width: int, height: int, seed: int) -> bytes:
+    """Photo-like JPEG: a smooth gradient plus noise"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                     np.full((height, width), float(rng.integers(0, 255)), np.float32)], axis=2)
+    pixels = np.clip(base + rng.normal(0, 10, base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        "mean": float(np.mean(values)),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(np.max(values))
+    }
+
+
+def stage_times(payload: Dict[str, Any]) -> Dict[str, float]:
+    """Server-side seconds per stage reported in a response body"""
+    times = {}
+    if isinstance(payload.get("processing_time"), (int, float)):
+        times["server"] = payload["processing_time"]
+    if isinstance(payload.get("total_processing_time"), (int, float)):
+        times["server"] = payload["total_processing_time"]
+    for name, value in payload.items():
+        if isinstance(value, dict) and isinstance(value.get("processing_time"), (int, float)):
+            times[name] = value["processing_time"]
+    return times
+
+
+class RssSampler:
+    """Tracks the peak resident set size while a level runs"""
+
+    def __init__(self, interval: float = 0.02):
+        from model_registry import process_rss_bytes
+        self.read = process_rss_bytes
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, self.read())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = self.read()
+        self._task = asyncio.ensure_future(self._sample())
+
+    async def stop(self) -> int:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        return max(self.peak, self.read())
+
+
+async def run_level(client, endpoint: str, images: List[bytes], concurrency: int, requests: int,
+                    query: Dict[str, str]) -> Dict[str, Any]:
+    """Send `requests` calls to `endpoint` with `concurrency` in flight"""
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    next_index = iter(range(requests))
+
+    async def worker():
+        for i in next_index:
+            start = time.perf_counter()
+            response = await client.post(endpoint, params=query, content=images[i % len(images)],
+                                         headers={"content-type": "image/jpeg"})
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+                continue
+            for name, seconds in stage_times(response.json()).items():
+                stages.setdefault(name, []).append(seconds * 1000)
+
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - start
+    peak_rss = await sampler.stop()
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": requests / wall,
+        "latency_ms": percentiles(latencies),
+        "stages_ms": {name: percentiles(values) for name, values in sorted(stages.items())},
+        "peak_rss_mb": peak_rss / 2**20
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of p95 latency or throughput beyond `tolerance` relative to a baseline report"""
+    regressions = []
+    for endpoint, sizes in report["results"].items():
+        for size, levels in sizes.items():
+            for concurrency, current in levels.items():
+                previous = baseline.get("results", {}).get(endpoint, {}).get(size, {}).get(concurrency)
+                if not previous or not previous.get("latency_ms") or not current.get("latency_ms"):
+                    continue
+                label = f"{endpoint} {size} c={concurrency}"
+                p95, base_p95 = current["latency_ms"]["p95"], previous["latency_ms"]["p95"]
+                if p95 > base_p95 * (1 + tolerance):
+                    regressions.append(f"{label}: p95 {base_p95:.1f} -> {p95:.1f} ms")
+                rps, base_rps = current["throughput_rps"], previous["throughput_rps"]
+                if rps < base_rps * (1 - tolerance):
+                    regressions.append(f"{label}: throughput {base_rps:.1f} -> {rps:.1f} req/s")
+    return regressions
+
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+
+    import main as service
+    if not args.real_models:
+        import stub_models
+        stub_models.install(service.models)
+
+    sizes = [tuple(int(v) for v in size.lower().split("x")) for size in args.sizes]
+    pools = {
+        f"{width}x{height}": [synthetic_jpeg(width, height, seed) for seed in range(args.distinct_images)]
+        for width, height in sizes
+    }
+    query = dict(pair.split("=", 1) for pair in args.query)
+
+    await service.startup_event()
+    results: Dict[str, Any] = {}
+    try:
+        transport = httpx.ASGITransport(app=service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for endpoint in args.endpoints:
+                for size, images in pools.items():
+                    # Warm-up: lazy model loads, first-call allocations
+                    await client.post(endpoint, params=query, content=images[0], headers={"content-type": "image/jpeg"})
+                    for concurrency in args.concurrency:
+                        requests = max(args.requests, concurrency * 2)
+                        level = await run_level(client, endpoint, images, concurrency, requests, query)
+                        results.setdefault(endpoint, {}).setdefault(size, {})[str(concurrency)] = level
+                        print(f"{endpoint} {size} c={concurrency}: {level['throughput_rps']:.1f} req/s, "
+                              f"p95 {level['latency_ms'].get('p95', 0):.1f} ms", file=sys.stderr)
+    finally:
+        await service.shutdown_event()
+
+    return {
+        "config": {
+            "endpoints": args.endpoints,
+            "sizes": args.sizes,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "query": query,
+            "models": "real" if args.real_models else "stub",
+            "result_cache": args.cache,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count()
+        },
+        "results": results,
+        # ru_maxrss is kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1920x1080"])
+    parser.add_argument("--requests", type=int, default=64, help="requests per endpoint, size and concurrency")
+    parser.add_argument("--distinct-images", type=int, default=8)
+    parser.add_argument("--query", nargs="*", default=[], help="extra options, e.g. annotation=none")
+    parser.add_argument("--real-models", action="store_true", help="load the real models instead of stubs")
+    parser.add_argument("--cache", action="store_true", help="keep the result cache on (off by default)")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ["RESULT_CACHE_MAX_BYTES"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
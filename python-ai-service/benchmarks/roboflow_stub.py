@@ -0,0 +1,107 @@
+"""Local stand-in for the Roboflow hosted detection API.
+
+Answers `POST /<model>/<version>` with canned predictions scaled to the
+posted image, after an optional artificial latency, so the Roboflow path
+can be exercised and benchmarked offline. The first `--failures` requests
+are answered 503, to exercise the client's retries. The server's `stats`
+count requests and the peak number in flight.
+
+    python benchmarks/roboflow_stub.py --port 9001 --latency-ms 80
+    ROBOFLOW_API_URL=http://127.0.0.1:9001 python main.py
+"""
+import argparse
+import base64
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+
+def make_handler(latency_ms: float, failures: int = 0):
+    stats = {"requests": 0, "in_flight": 0, "peak_in_flight": 0}
+    lock = threading.Lock()
+
+    class RoboflowStubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+        counters = stats
+
+        def setup(self):
+            super().setup()
+            # Headers and body go out in separate writes, don't let Nagle hold the body
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                stats["requests"] += 1
+                number = stats["requests"]
+                stats["in_flight"] += 1
+                stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+            try:
+                self._answer(body, fail=number <= failures)
+            finally:
+                with lock:
+                    stats["in_flight"] -= 1
+
+        def _answer(self, body: bytes, fail: bool):
+            time.sleep(latency_ms / 1000)
+            if fail:
+                self._reply(503, {"message": "Service unavailable"})
+                return
+            image = cv2.imdecode(np.frombuffer(base64.b64decode(body), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                self._reply(400, {"message": "Could not decode image"})
+                return
+
+            height, width = image.shape[:2]
+            self._reply(200, {
+                "predictions": [
+                    {"x": width * 0.3, "y": height * 0.4, "width": width * 0.2, "height": height * 0.2,
+                     "class": "dent", "confidence": 0.88},
+                    {"x": width * 0.7, "y": height * 0.6, "width": width * 0.1, "height": height * 0.3,
+                     "class": "scratch", "confidence": 0.64}
+                ],
+                "image": {"width": width, "height": height}
+            })
+
+        def _reply(self, status: int, payload: dict):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return RoboflowStubHandler
+
+
+def serve_in_thread(port: int = 0, latency_ms: float = 0, failures: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the stub on a background thread, returns the server and its base URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency_ms, failures))
+    server.stats = server.RequestHandlerClass.counters
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--failures", type=int, default=0, help="answer the first N requests with 503")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.latency_ms, args.failures))
+    print(f"Roboflow stand-in listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
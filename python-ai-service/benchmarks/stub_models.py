@@ -0,0 +1,99 @@
+"""Stand-in models with the call surface of the real ones.
+
+Each stub sleeps for a fixed per-call cost plus a per-image cost, then
+returns outputs of the right shape. This lets the service be benchmarked
+offline on CPU without the weights or the frameworks. Sleeping releases
+the GIL like the native kernels of the real models do. `weight_mb` gives
+each stub a block of random "weights" so memory sharing between workers
+can be measured.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# (per-call ms, per-image ms), roughly the CPU shape of the real models
+DEFAULT_LATENCY_MS: Dict[str, Tuple[float, float]] = {
+    "gnet": (8.0, 2.0),
+    "damage_severity": (8.0, 2.0),
+    "yolo": (25.0, 12.0),
+    "car_brand": (15.0, 6.0),
+    "damage_type": (15.0, 6.0)
+}
+
+
+def _sleep(latency: Tuple[float, float], images: int):
+    time.sleep((latency[0] + latency[1] * images) / 1000)
+
+
+class StubKerasModel:
+    """`predict` over a (N, 224, 224, 3) batch"""
+
+    def __init__(self, outputs: List[float], latency: Tuple[float, float]):
+        self.outputs = np.array(outputs, dtype=np.float32)
+        self.latency = latency
+
+    def predict(self, image_batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        _sleep(self.latency, len(image_batch))
+        return np.tile(self.outputs, (len(image_batch), 1))
+
+
+class StubYoloResults:
+    def __init__(self, xyxy: List[np.ndarray]):
+        self.xyxy = xyxy
+
+
+class StubYoloModel:
+    """`model(images).xyxy` with two boxes per image, one below the confidence threshold"""
+
+    names = {0: "dent", 1: "scratch"}
+
+    def __init__(self, latency: Tuple[float, float]):
+        self.latency = latency
+
+    def __call__(self, images: Union[np.ndarray, List[np.ndarray]], size: Optional[int] = None) -> StubYoloResults:
+        images = images if isinstance(images, list) else [images]
+        _sleep(self.latency, len(images))
+        xyxy = []
+        for image in images:
+            height, width = image.shape[:2]
+            xyxy.append(np.array([
+                [width * 0.1, height * 0.1, width * 0.4, height * 0.5, 0.9, 0],
+                [width * 0.5, height * 0.5, width * 0.9, height * 0.9, 0.2, 1]
+            ], dtype=np.float32))
+        return StubYoloResults(xyxy)
+
+
+class StubImageClassifier:
+    """Pipeline-style classifier returning fixed top-k labels"""
+
+    def __init__(self, labels: List[Tuple[str, float]], latency: Tuple[float, float]):
+        self.top = [{"label": label, "score": score} for label, score in labels]
+        self.latency = latency
+
+    def __call__(self, images: Any, batch_size: Optional[int] = None, **kwargs):
+        if isinstance(images, list):
+            _sleep(self.latency, len(images))
+            return [list(self.top) for _ in images]
+        _sleep(self.latency, 1)
+        return list(self.top)
+
+
+def _with_weights(stub: Any, weight_mb: float) -> Any:
+    if weight_mb > 0:
+        stub.weights = np.random.default_rng(0).random(int(weight_mb * 2**20) // 4, dtype=np.float32)
+    return stub
+
+
+def install(registry, latency_ms: Optional[Dict[str, Tuple[float, float]]] = None, weight_mb: float = 0):
+    """Register the stubs in place of the real loaders"""
+    latency = {**DEFAULT_LATENCY_MS, **(latency_ms or {})}
+    stubs = {
+        "gnet": StubKerasModel([0.2], latency["gnet"]),
+        "damage_severity": StubKerasModel([0.2, 0.7, 0.1], latency["damage_severity"]),
+        "yolo": StubYoloModel(latency["yolo"]),
+        "car_brand": StubImageClassifier([("BMW", 0.81), ("Audi", 0.09)], latency["car_brand"]),
+        "damage_type": StubImageClassifier([("dent", 0.62), ("scratch", 0.25)], latency["damage_type"])
+    }
+    for name, stub in stubs.items():
+        registry.register(name, lambda stub=stub: _with_weights(stub, weight_mb))
@@ -0,0 +1,129 @@
+"""Mask R-CNN damage-part segmentation served with detectron2.
+
+The notebook version (`notebooks/Damaged_parts/test_maskrcnn.py`) rebuilt
+the config and a `DefaultPredictor`, reloading the weights, for every
+image. `DamageSegmenter` builds the model once and runs several images
+through one forward pass. Masks can be returned as COCO-style uncompressed
+RLE or as polygons. The encoders only need NumPy and OpenCV, so importing
+this module does not pull in torch. detectron2 is imported when a
+segmenter is built.
+
+Configuration (environment variables):
+    SEGMENTATION_CONFIG           detectron2 model-zoo config (default COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml)
+    SEGMENTATION_CLASSES          comma-separated class names, in training order (default the six CarDD classes)
+    SEGMENTATION_SCORE_THRESHOLD  minimum instance score (default 0.5)
+    SEGMENTATION_BATCH_SIZE       images per forward pass on the batch endpoint (default 4)
+    SEGMENTATION_MASK_FORMAT      default mask encoding: rle, polygon or none (default rle)
+    SEGMENTATION_DEVICE           "cpu" or "cuda" (default cuda when available)
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+from fastapi import HTTPException
+
+SEGMENTATION_CONFIG = os.getenv("SEGMENTATION_CONFIG", "COCO-InstanceSegmentation/mask_rcnn_R_50_FPN_3x.yaml")
+SEGMENTATION_CLASSES = [
+    name.strip() for name in
+    os.getenv("SEGMENTATION_CLASSES", "dent,scratch,crack,glass shatter,lamp broken,tire flat").split(",")
+    if name.strip()
+]
+SEGMENTATION_SCORE_THRESHOLD = float(os.getenv("SEGMENTATION_SCORE_THRESHOLD", "0.5"))
+SEGMENTATION_BATCH_SIZE = int(os.getenv("SEGMENTATION_BATCH_SIZE", "4"))
+MASK_FORMATS = ("rle", "polygon", "none")
+DEFAULT_MASK_FORMAT = os.getenv("SEGMENTATION_MASK_FORMAT", "rle").lower()
+
+
+def mask_format(options: Dict[str, Any]) -> str:
+    """Mask encoding requested by the `masks` option"""
+    value = str(options.get("masks") or DEFAULT_MASK_FORMAT).lower()
+    if value not in MASK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"masks must be one of {', '.join(MASK_FORMATS)}")
+    return value
+
+
+def mask_to_rle(mask: np.ndarray) -> Dict[str, Any]:
+    """COCO uncompressed RLE: column-major run lengths, starting with a run of zeros"""
+    flat = mask.T.ravel().astype(np.int8)
+    changes = np.flatnonzero(np.diff(flat, prepend=0, append=0))
+    changes = changes[changes < flat.size]
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": counts.tolist()}
+
+
+def mask_to_polygons(mask: np.ndarray, tolerance: float = 1.0) -> List[List[int]]:
+    """Outer contours of a mask as flat [x1, y1, x2, y2, ...] point lists"""
+    contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    polygons = []
+    for contour in contours:
+        contour = cv2.approxPolyDP(contour, tolerance, True)
+        if len(contour) >= 3:
+            polygons.append(contour.reshape(-1).astype(int).tolist())
+    return polygons
+
+
+class DamageSegmenter:
+    """Mask R-CNN built once and reused, with batched inference"""
+
+    def __init__(self, weights_path: str, class_names: Optional[List[str]] = None,
+                 score_threshold: float = SEGMENTATION_SCORE_THRESHOLD,
+                 config_file: str = SEGMENTATION_CONFIG, device: Optional[str] = None,
+                 batch_size: int = SEGMENTATION_BATCH_SIZE):
+        import torch
+        from detectron2 import model_zoo
+        from detectron2.checkpoint import DetectionCheckpointer
+        from detectron2.config import get_cfg
+        from detectron2.data import transforms as T
+        from detectron2.modeling import build_model
+
+        self.class_names = class_names or SEGMENTATION_CLASSES
+        self.batch_size = max(1, batch_size)
+
+        cfg = get_cfg()
+        cfg.merge_from_file(model_zoo.get_config_file(config_file))
+        cfg.MODEL.ROI_HEADS.NUM_CLASSES = len(self.class_names)
+        cfg.MODEL.WEIGHTS = weights_path
+        cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = score_threshold
+        cfg.MODEL.DEVICE = device or os.getenv("SEGMENTATION_DEVICE") or (
+            "cuda" if torch.cuda.is_available() else "cpu"
+        )
+        cfg.freeze()
+
+        # What DefaultPredictor does, minus its one-image-per-call interface
+        self.model = build_model(cfg)
+        self.model.eval()
+        DetectionCheckpointer(self.model).load(cfg.MODEL.WEIGHTS)
+        self.resize = T.ResizeShortestEdge([cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST], cfg.INPUT.MAX_SIZE_TEST)
+        self.input_format = cfg.INPUT.FORMAT
+
+    def predict(self, images: List[np.ndarray]) -> List[Dict[str, np.ndarray]]:
+        """Segment BGR images in one forward pass.
+
+        Returns per image the `boxes` (xyxy), `scores`, `classes` and boolean
+        `masks` of every instance, as NumPy arrays in original pixel coordinates.
+        """
+        import torch
+
+        inputs = []
+        for image in images:
+            if self.input_format == "RGB":
+                image = image[:, :, ::-1]
+            height, width = image.shape[:2]
+            resized = self.resize.get_transform(image).apply_image(image)
+            tensor = torch.as_tensor(resized.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": tensor, "height": height, "width": width})
+
+        with torch.inference_mode():
+            outputs = self.model(inputs)
+
+        results = []
+        for output in outputs:
+            instances = output["instances"].to("cpu")
+            results.append({
+                "boxes": instances.pred_boxes.tensor.numpy(),
+                "scores": instances.scores.numpy(),
+                "classes": instances.pred_classes.numpy(),
+                "masks": instances.pred_masks.numpy()
+            })
+        return results
@@ -0,0 +1,296 @@
+"""Export the service's models to ONNX and compare them with the originals.
+
+For every selected model this loads the framework model with the same
+loader the service uses, exports it to `ONNX_MODEL_DIR` (plus a JSON
+sidecar with labels and preprocessing), optionally writes an INT8
+dynamically quantized variant, then reports:
+
+* accuracy parity on sample images (max output difference, top-1 / decision
+  agreement, and box recall for YOLO)
+* batch-of-one latency (mean, p50, p95) and load-time RSS for the framework
+  model and each ONNX variant
+
+    python export_onnx.py                       # all models, FP32
+    python export_onnx.py --models gnet yolo --int8 --images samples/
+
+Serve the exports with MODEL_BACKEND=onnx (and ONNX_QUANTIZED=1 for INT8).
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import backends
+import main as service
+from model_registry import process_rss_bytes
+
+logger = logging.getLogger("export_onnx")
+
+KERAS_MODELS = {"gnet": service.load_gnet_model, "damage_severity": service.load_damage_severity_model}
+HF_MODELS = {"car_brand": service.load_car_brand_model, "damage_type": service.load_damage_type_model}
+ALL_MODELS = ["gnet", "damage_severity", "yolo", "car_brand", "damage_type"]
+
+
+def load_sample_images(image_dir: str, count: int) -> List[np.ndarray]:
+    """BGR sample images from a directory, or synthetic ones when none is given"""
+    paths = sorted(glob.glob(os.path.join(image_dir, "*"))) if image_dir else []
+    images = [cv2.imread(path) for path in paths]
+    images = [image for image in images if image is not None][:count]
+    if images:
+        return images
+
+    logger.warning("No sample images given, parity is measured on synthetic images")
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        image = np.full((480, 640, 3), rng.integers(60, 200, 3), dtype=np.uint8)
+        for _ in range(6):
+            x, y = rng.integers(0, 560), rng.integers(0, 400)
+            cv2.rectangle(image, (int(x), int(y)), (int(x + rng.integers(20, 80)), int(y + rng.integers(20, 80))),
+                          tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+        images.append(cv2.GaussianBlur(image, (5, 5), 0))
+    return images
+
+
+def latency_stats(fn: Callable[[Any], Any], inputs: List[Any], runs: int) -> Dict[str, float]:
+    """Batch-of-one latency over `runs` calls, after one warm-up call"""
+    fn(inputs[0])
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": float(np.mean(timings)),
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95))
+    }
+
+
+def load_measured(loader: Callable[[], Any]) -> tuple:
+    """Load a model, returning it with its load time and RSS growth"""
+    rss_before = process_rss_bytes()
+    start = time.perf_counter()
+    model = loader()
+    return model, {"load_s": time.perf_counter() - start, "rss_delta_mb": (process_rss_bytes() - rss_before) / 2**20}
+
+
+def quantize(path: str) -> str:
+    """Write the INT8 dynamically quantized variant of an export"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized_path = path.replace(".onnx", ".int8.onnx")
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+def export_keras(name: str, model: Any, opset: int):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=backends.onnx_path(name, False))
+
+
+def export_yolo(model_path: str, opset: int, imgsz: int) -> Any:
+    import torch
+
+    model = torch.hub.load('ultralytics/yolov5', 'custom', path=model_path, autoshape=False)
+    model.eval()
+    for module in model.modules():
+        if module.__class__.__name__ == "Detect":
+            module.inplace = False
+            module.export = True
+            module.dynamic = True
+    dummy = torch.zeros(1, 3, imgsz, imgsz)
+    torch.onnx.export(
+        model, dummy, backends.onnx_path("yolo", False), opset_version=opset,
+        input_names=["images"], output_names=["output0"],
+        # Dynamic height and width, so the backend can letterbox to a rectangle like the hub model
+        dynamic_axes={"images": {0: "batch", 2: "height", 3: "width"}, "output0": {0: "batch", 1: "anchors"}}
+    )
+    names = model.names if isinstance(model.names, dict) else dict(enumerate(model.names))
+    with open(backends.sidecar_path("yolo"), "w", encoding="utf-8") as f:
+        json.dump({"names": {str(k): v for k, v in names.items()}, "imgsz": imgsz, "stride": int(np.max(np.asarray(model.stride))),
+                   "conf": 0.25, "iou": 0.45}, f, indent=2)
+
+
+def export_hf(name: str, classifier: Any, opset: int):
+    import torch
+
+    processor = getattr(classifier, "image_processor", None) or classifier.feature_extractor
+    size = processor.size
+    height = size.get("height", size.get("shortest_edge")) if isinstance(size, dict) else size
+    width = size.get("width", size.get("shortest_edge")) if isinstance(size, dict) else size
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model(pixel_values=pixel_values).logits
+
+    wrapper = LogitsOnly(classifier.model).eval()
+    torch.onnx.export(
+        wrapper, torch.zeros(1, 3, height, width), backends.onnx_path(name, False), opset_version=opset,
+        input_names=["pixel_values"], output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}}
+    )
+    with open(backends.sidecar_path(name), "w", encoding="utf-8") as f:
+        json.dump({
+            "id2label": {str(k): v for k, v in classifier.model.config.id2label.items()},
+            "height": height,
+            "width": width,
+            "rescale_factor": getattr(processor, "rescale_factor", 1 / 255),
+            "image_mean": list(processor.image_mean),
+            "image_std": list(processor.image_std)
+        }, f, indent=2)
+
+
+def keras_inputs(images: List[np.ndarray]) -> List[np.ndarray]:
+    """Batch-of-one inputs preprocessed exactly like the service"""
+    return [
+        np.expand_dims(cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (224, 224)) / 255.0, 0).astype(np.float32)
+        for image in images
+    ]
+
+
+def box_recall(reference: np.ndarray, candidate: np.ndarray, iou_threshold: float = 0.5) -> float:
+    """Share of reference boxes matched by a same-class candidate box"""
+    if not len(reference):
+        return 1.0
+    matched = 0
+    for box in reference:
+        same_class = candidate[candidate[:, 5] == box[5]]
+        if not len(same_class):
+            continue
+        x1 = np.maximum(box[0], same_class[:, 0])
+        y1 = np.maximum(box[1], same_class[:, 1])
+        x2 = np.minimum(box[2], same_class[:, 2])
+        y2 = np.minimum(box[3], same_class[:, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        union = (box[2] - box[0]) * (box[3] - box[1]) + \
+            (same_class[:, 2] - same_class[:, 0]) * (same_class[:, 3] - same_class[:, 1]) - inter
+        matched += bool((inter / np.maximum(union, 1e-9) >= iou_threshold).any())
+    return matched / len(reference)
+
+
+def compare_keras(name: str, original: Any, candidate: Any, images: List[np.ndarray]) -> Dict[str, Any]:
+    inputs = keras_inputs(images)
+    reference = np.concatenate([original.predict(x, verbose=0) for x in inputs])
+    outputs = np.concatenate([candidate.predict(x) for x in inputs])
+    if reference.shape[1] == 1:
+        agreement = np.mean((reference[:, 0] > service.AI_THRESHOLD) == (outputs[:, 0] > service.AI_THRESHOLD))
+    else:
+        agreement = np.mean(reference.argmax(axis=1) == outputs.argmax(axis=1))
+    return {"max_abs_diff": float(np.abs(reference - outputs).max()), "decision_agreement": float(agreement)}
+
+
+def compare_yolo(original: Any, candidate: Any, images: List[np.ndarray]) -> Dict[str, Any]:
+    recalls, counts = [], []
+    for image in images:
+        reference = service.yolo_boxes(original(image).xyxy[0])
+        boxes = candidate(image).xyxy[0]
+        recalls.append(box_recall(reference, boxes))
+        counts.append((len(reference), len(boxes)))
+    return {"box_recall": float(np.mean(recalls)), "detections_original_vs_onnx": counts}
+
+
+def compare_hf(original: Any, candidate: Any, images: List[np.ndarray]) -> Dict[str, Any]:
+    pil_images = [Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)) for image in images]
+    reference = [original(image)[0] for image in pil_images]
+    outputs = [candidate(image)[0] for image in pil_images]
+    return {
+        "top1_agreement": float(np.mean([r["label"] == o["label"] for r, o in zip(reference, outputs)])),
+        "top1_score_max_abs_diff": float(max(abs(r["score"] - o["score"]) for r, o in zip(reference, outputs)))
+    }
+
+
+def process_model(name: str, args, images: List[np.ndarray]) -> Dict[str, Any]:
+    """Export one model and measure every variant against the original"""
+    if name in KERAS_MODELS:
+        original, load = load_measured(KERAS_MODELS[name])
+    elif name == "yolo":
+        original, load = load_measured(service.load_yolo_model)
+    else:
+        original, load = load_measured(HF_MODELS[name])
+    if original is None:
+        return {"error": "original model could not be loaded"}
+
+    if name in KERAS_MODELS:
+        export_keras(name, original, args.opset)
+        inputs, call, compare = keras_inputs(images), (lambda m, x: m.predict(x)), compare_keras
+    elif name == "yolo":
+        export_yolo(service.MODEL_FILES["yolo"], args.opset, args.imgsz)
+        inputs, call, compare = images, (lambda m, x: m(x)), (lambda _, o, c, i: compare_yolo(o, c, i))
+    else:
+        export_hf(name, original, args.opset)
+        pil_images = [Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)) for image in images]
+        inputs, call, compare = pil_images, (lambda m, x: m(x)), (lambda _, o, c, i: compare_hf(o, c, i))
+
+    paths = {"fp32": backends.onnx_path(name, False)}
+    if args.int8:
+        paths["int8"] = quantize(paths["fp32"])
+
+    report = {
+        "framework": {
+            **load,
+            "latency": latency_stats(
+                (lambda x: original.predict(x, verbose=0)) if name in KERAS_MODELS else (lambda x: original(x)),
+                inputs, args.runs
+            )
+        }
+    }
+    for variant, path in paths.items():
+        candidate, variant_load = load_measured(lambda: backends.load_onnx_model(name, variant == "int8"))
+        report[f"onnx_{variant}"] = {
+            **variant_load,
+            "file_mb": os.path.getsize(path) / 2**20,
+            "latency": latency_stats(lambda x: call(candidate, x), inputs, args.runs),
+            "parity": compare(name, original, candidate, images)
+        }
+        speedup = report["framework"]["latency"]["mean_ms"] / report[f"onnx_{variant}"]["latency"]["mean_ms"]
+        report[f"onnx_{variant}"]["speedup"] = speedup
+        logger.info(f"📊 {name} {variant}: {speedup:.2f}x, parity {report[f'onnx_{variant}']['parity']}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--models", nargs="+", choices=ALL_MODELS, default=ALL_MODELS)
+    parser.add_argument("--int8", action="store_true", help="also write INT8 dynamically quantized variants")
+    parser.add_argument("--images", help="directory of sample photos for the parity check")
+    parser.add_argument("--samples", type=int, default=16)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--report", default=os.path.join(backends.ONNX_MODEL_DIR, "report.json"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(backends.ONNX_MODEL_DIR, exist_ok=True)
+    images = load_sample_images(args.images, args.samples)
+
+    report = {}
+    for name in args.models:
+        try:
+            report[name] = process_model(name, args, images)
+        except Exception as e:
+            logger.error(f"❌ {name} export failed: {e}")
+            report[name] = {"error": str(e)}
+
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Bounded executor for blocking model inference.
+
+Every model call (Keras `predict`, YOLO forward, Hugging Face pipelines,
+Roboflow HTTP) blocks, so handlers hand it to a shared pool instead of
+running it on the event loop. Per-model slots cap how many calls to the
+same model are in flight so TensorFlow and PyTorch don't oversubscribe the
+cores. Calls waiting for a slot form a bounded queue served by priority
+lane, see `admission`.
+
+Thread-pool calls run in a copy of the caller's context so per-request
+instrumentation follows them. The time a call waits for its model slot
+and a pool thread is recorded as the model's `queue_wait` phase.
+
+The pool is threads: the stages read the loaded models, the annotation
+store, metrics and the request's admission context, none of which cross a
+process boundary. Use SERVE_WORKERS (see `serving`) to spread requests
+over processes.
+
+Configuration (environment variables):
+    INFERENCE_WORKERS      pool size, defaults to max(4, CPU count)
+    MODEL_CONCURRENCY      default in-flight limit per model (default 1)
+    MODEL_CONCURRENCY_<M>  override for one model, e.g. MODEL_CONCURRENCY_YOLO=2
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from admission import PrioritySlots, check_deadline, queue_depth
+from metrics import record
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(4, os.cpu_count() or 1))))
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "1"))
+
+_executor: Optional[Executor] = None
+_model_limits: Dict[str, PrioritySlots] = {}
+
+
+def model_concurrency(model_name: str) -> int:
+    """Configured in-flight limit for `model_name`"""
+    override = os.getenv(f"MODEL_CONCURRENCY_{model_name.upper()}")
+    return max(1, int(override)) if override else max(1, DEFAULT_MODEL_CONCURRENCY)
+
+
+def start_executor() -> Executor:
+    """Create the inference pool (idempotent)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=INFERENCE_WORKERS, thread_name_prefix="inference"
+        )
+        logger.info(f"⚙️ Inference executor: {INFERENCE_WORKERS} threads")
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the inference pool, waiting for running calls"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    _model_limits.clear()
+
+
+def _model_limit(model_name: str) -> PrioritySlots:
+    if model_name not in _model_limits:
+        _model_limits[model_name] = PrioritySlots(model_name, model_concurrency(model_name), queue_depth(model_name))
+    return _model_limits[model_name]
+
+
+def queued_calls() -> Dict[str, int]:
+    """Calls waiting for a slot, per model"""
+    return {name: limit.waiting for name, limit in _model_limits.items()}
+
+
+def _queued_call(model_name: str, queued_at: float, fn: Callable[..., Any], *args: Any) -> Any:
+    record(model_name, "queue_wait", time.perf_counter() - queued_at)
+    # Also covers the wait for a pool thread
+    check_deadline(model_name)
+    return fn(*args)
+
+
+async def run_inference(model_name: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """Run blocking `fn(*args)` on the pool, bounded by `model_name`'s limit.
+
+    Raises QueueFull when too many calls already wait for the model and
+    DeadlineExceeded when the request's deadline passes before a slot frees.
+    """
+    queued_at = time.perf_counter()
+    async with _model_limit(model_name):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(start_executor(), context.run, _queued_call, model_name, queued_at, fn, *args)
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run blocking `fn(*args)` on the pool without a model limit"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(start_executor(), contextvars.copy_context().run, fn, *args)
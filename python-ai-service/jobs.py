@@ -0,0 +1,547 @@
+"""Asynchronous jobs for large claims and bulk re-scoring.
+
+`POST /jobs` stores the images and returns a job id at once. The job is
+then processed in the background, and clients poll `GET /jobs/{id}` or
+subscribe to `GET /jobs/{id}/events`. Jobs live in a `JobQueue`. The
+default `SQLiteJobQueue` keeps job state in a SQLite database and the
+images as content-addressed files next to it, so it needs no external
+service and queued work survives a restart. JOB_BACKEND can name another
+`JobQueue` subclass ("package.module:Class"), for example one backed by
+Redis.
+
+Each image of a job is a queue item. `JobWorkers` claim items for one task
+and option set at a time, across jobs, so images of several small jobs
+share one model batch. A claim is a lease: items whose worker dies are
+handed out again once JOB_LEASE_SECONDS pass, and an image that keeps
+failing is given up after JOB_MAX_ATTEMPTS. Every worker process of the
+service runs its own job workers on the same database. Job work runs in
+the "background" admission lane, so interactive and bulk requests are
+served first by every model.
+
+Submissions are idempotent. A job's key is the hash of its task, options
+and image hashes, or the client's `Idempotency-Key` header. Submitting the
+same key again returns the existing job. A new job whose images were
+already processed with the same task and options reuses those results
+instead of recomputing them. Finished jobs are deleted
+JOB_RESULT_TTL_SECONDS after they finish, and stored images are deleted
+once no unfinished item needs them.
+
+Configuration (environment variables):
+    JOB_BACKEND             "sqlite" (default) or "module:Class" of a JobQueue subclass
+    JOB_DIR                 directory of the database and the stored images (default jobs/ next to this module)
+    JOB_WORKERS             job workers per service process (default 1, 0 = accept jobs only)
+    JOB_BATCH_SIZE          images per claim and model batch (default 8)
+    JOB_MAX_IMAGES          images per job (default 1000)
+    JOB_LEASE_SECONDS       claimed images not finished by then are handed out again (default 300)
+    JOB_MAX_ATTEMPTS        tries per image before it is marked failed (default 3)
+    JOB_RESULT_TTL_SECONDS  how long finished jobs are kept (default 604800, 7 days)
+    JOB_CLEANUP_SECONDS     interval of the expiry sweep (default 300)
+    JOB_POLL_SECONDS        idle workers check the queue this often (default 1)
+"""
+import asyncio
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import admission
+from inference import run_blocking
+from preprocessing import ImageContext
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("JOB_BACKEND", "sqlite")
+# Under the service directory by default, not wherever the process was started from
+JOB_DIR = os.getenv("JOB_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs")
+WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+BATCH_SIZE = max(1, int(os.getenv("JOB_BATCH_SIZE", "8")))
+MAX_IMAGES = int(os.getenv("JOB_MAX_IMAGES", "1000"))
+LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+MAX_ATTEMPTS = max(1, int(os.getenv("JOB_MAX_ATTEMPTS", "3")))
+RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", str(7 * 24 * 3600)))
+CLEANUP_SECONDS = float(os.getenv("JOB_CLEANUP_SECONDS", "300"))
+POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+# Unfinished and finished item states
+PENDING_STATES = ("queued", "running")
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+# A task turns a batch of images into one result per image
+Task = Callable[[List[ImageContext]], Awaitable[List[Dict[str, Any]]]]
+
+
+def options_key(options: Dict[str, Any]) -> str:
+    """Canonical JSON of a job's options, jobs with equal keys can share batches"""
+    return json.dumps(options, sort_keys=True, separators=(",", ":"))
+
+
+def idempotency_key(task: str, options: Dict[str, Any], image_hashes: List[str]) -> str:
+    """Key of a submission: same task, options and images give the same key"""
+    material = json.dumps([task, options_key(options), image_hashes])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class Claim:
+    """Items leased to one worker, all with the same task and options"""
+
+    def __init__(self, worker: str, task: str, options: Dict[str, Any], items: List[Tuple[str, int, str]]):
+        self.worker = worker
+        self.task = task
+        self.options = options
+        self.items = items  # (job id, position, image hash)
+
+
+class JobQueue(ABC):
+    """Interface of a job queue backend, JOB_BACKEND classes implement every method"""
+
+    @abstractmethod
+    def put_image(self, image_hash: str, data: bytes):
+        """Store an image before the job that references it is submitted"""
+
+    @abstractmethod
+    def read_image(self, image_hash: str) -> Optional[bytes]:
+        """Stored bytes of an image, None once it was deleted"""
+
+    @abstractmethod
+    def submit(self, task: str, options: Dict[str, Any], image_hashes: List[str],
+               key: str) -> Tuple[Dict[str, Any], bool]:
+        """Create a job, or return the live job with the same key. Returns (job, created)"""
+
+    @abstractmethod
+    def get(self, job_id: str, results: bool = True) -> Optional[Dict[str, Any]]:
+        """Job status and progress, with its per-image results unless `results` is False"""
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancel the job's unfinished items, results of running ones are discarded"""
+
+    @abstractmethod
+    def claim(self, worker: str, limit: int) -> Optional[Claim]:
+        """Lease up to `limit` compatible queued items, None when the queue is empty"""
+
+    @abstractmethod
+    def complete(self, claim: Claim, results: List[Optional[Dict[str, Any]]], errors: List[Optional[str]]):
+        """Record the outcome of each claimed item, a failed item is retried until MAX_ATTEMPTS.
+
+        Items no longer leased to the claim's worker (lease expired, job
+        cancelled) are left alone.
+        """
+
+    @abstractmethod
+    def release(self, claim: Claim):
+        """Give leased items back to the queue, e.g. on shutdown"""
+
+    @abstractmethod
+    def cleanup(self) -> int:
+        """Delete expired jobs and images nothing needs anymore, returns the number of jobs deleted"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Jobs and images per status"""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    task TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    image_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    claimed_at REAL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, position)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items(status, claimed_at);
+CREATE INDEX IF NOT EXISTS items_image ON items(image_hash, status);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs(expires_at);
+"""
+
+
+class SQLiteJobQueue(JobQueue):
+    """Jobs in a SQLite database, images as files under `<directory>/images`"""
+
+    def __init__(self, directory: str = JOB_DIR, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, ttl_seconds: float = RESULT_TTL_SECONDS):
+        self.directory = directory
+        self.path = os.path.join(directory, "jobs.db")
+        self.image_dir = os.path.join(directory, "images")
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.ttl_seconds = ttl_seconds
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # Opened lazily and per process, the serving parent forks after import
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(self.image_dir, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(SCHEMA)
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run `fn` in a write transaction, serialized with the other processes"""
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(db)
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return result
+
+    def _image_path(self, image_hash: str) -> str:
+        return os.path.join(self.image_dir, image_hash[:2], image_hash)
+
+    def put_image(self, image_hash: str, data: bytes):
+        path = self._image_path(image_hash)
+        if os.path.exists(path):
+            os.utime(path)  # Fresh again, so the sweep doesn't take it before the job is in
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+
+    def read_image(self, image_hash: str) -> Optional[bytes]:
+        try:
+            with open(self._image_path(image_hash), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def submit(self, task: str, options: Dict[str, Any], image_hashes: List[str],
+               key: str) -> Tuple[Dict[str, Any], bool]:
+        options_json = options_key(options)
+
+        def insert(db: sqlite3.Connection):
+            existing = db.execute("SELECT id, status FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+            if existing is not None:
+                if existing["status"] not in ("failed", "cancelled"):
+                    return existing["id"], False
+                # Resubmitting a failed or cancelled job runs it again
+                db.execute("DELETE FROM jobs WHERE id = ?", (existing["id"],))
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            db.execute("INSERT INTO jobs (id, idempotency_key, task, options, status, total, created_at) "
+                       "VALUES (?, ?, ?, ?, 'queued', ?, ?)", (job_id, key, task, options_json, len(image_hashes), now))
+            for position, image_hash in enumerate(image_hashes):
+                # Images already processed with the same task and options are not computed again
+                previous = db.execute(
+                    "SELECT items.result FROM items JOIN jobs ON jobs.id = items.job_id "
+                    "WHERE items.image_hash = ? AND items.status = 'done' AND jobs.task = ? AND jobs.options = ? "
+                    "LIMIT 1", (image_hash, task, options_json)).fetchone()
+                if previous is not None:
+                    db.execute("INSERT INTO items (job_id, position, image_hash, status, result) "
+                               "VALUES (?, ?, ?, 'done', ?)", (job_id, position, image_hash, previous["result"]))
+                else:
+                    db.execute("INSERT INTO items (job_id, position, image_hash, status) VALUES (?, ?, ?, 'queued')",
+                               (job_id, position, image_hash))
+            self._refresh_jobs(db, [job_id], now)
+            return job_id, True
+
+        job_id, created = self._transaction(insert)
+        return self.get(job_id, results=False), created
+
+    def get(self, job_id: str, results: bool = True) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            db = self._db()
+            job = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status",
+                                     (job_id,)).fetchall())
+            items = db.execute("SELECT position, image_hash, status, result, error FROM items WHERE job_id = ? "
+                               "ORDER BY position", (job_id,)).fetchall() if results else []
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "task": job["task"],
+            "options": json.loads(job["options"]),
+            "images": job["total"],
+            "progress": {state: counts.get(state, 0) for state in PENDING_STATES + FINISHED_STATES},
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "expires_at": job["expires_at"],
+            **({"results": [
+                {
+                    "image_hash": item["image_hash"],
+                    "status": item["status"],
+                    "result": json.loads(item["result"]) if item["result"] else None,
+                    "error": item["error"]
+                }
+                for item in items
+            ]} if results else {})
+        }
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        def cancel_items(db: sqlite3.Connection) -> bool:
+            if db.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is None:
+                return False
+            db.execute("UPDATE items SET status = 'cancelled' WHERE job_id = ? AND status IN ('queued', 'running')",
+                       (job_id,))
+            self._refresh_jobs(db, [job_id], time.time())
+            return True
+
+        return self.get(job_id, results=False) if self._transaction(cancel_items) else None
+
+    def claim(self, worker: str, limit: int) -> Optional[Claim]:
+        def lease(db: sqlite3.Connection) -> Optional[Claim]:
+            now = time.time()
+            expired = now - self.lease_seconds
+            # Items whose worker died too often are given up
+            stuck = db.execute("SELECT DISTINCT job_id FROM items WHERE status = 'running' AND claimed_at < ? "
+                               "AND attempts >= ?", (expired, self.max_attempts)).fetchall()
+            if stuck:
+                db.execute("UPDATE items SET status = 'failed', error = 'Worker lost too many times' "
+                           "WHERE status = 'running' AND claimed_at < ? AND attempts >= ?",
+                           (expired, self.max_attempts))
+                self._refresh_jobs(db, [row["job_id"] for row in stuck], now)
+
+            available = ("(items.status = 'queued' OR (items.status = 'running' AND items.claimed_at < ?))")
+            first = db.execute(f"SELECT jobs.task, jobs.options FROM items JOIN jobs ON jobs.id = items.job_id "
+                               f"WHERE {available} ORDER BY jobs.created_at, items.position LIMIT 1",
+                               (expired,)).fetchone()
+            if first is None:
+                return None
+            rows = db.execute(f"SELECT items.job_id, items.position, items.image_hash FROM items "
+                              f"JOIN jobs ON jobs.id = items.job_id WHERE {available} "
+                              f"AND jobs.task = ? AND jobs.options = ? ORDER BY jobs.created_at, items.position "
+                              f"LIMIT ?", (expired, first["task"], first["options"], limit)).fetchall()
+            db.executemany("UPDATE items SET status = 'running', worker = ?, claimed_at = ?, attempts = attempts + 1 "
+                           "WHERE job_id = ? AND position = ?",
+                           [(worker, now, row["job_id"], row["position"]) for row in rows])
+            self._refresh_jobs(db, {row["job_id"] for row in rows}, now)
+            return Claim(worker, first["task"], json.loads(first["options"]),
+                         [(row["job_id"], row["position"], row["image_hash"]) for row in rows])
+
+        return self._transaction(lease)
+
+    def complete(self, claim: Claim, results: List[Optional[Dict[str, Any]]], errors: List[Optional[str]]):
+        def record(db: sqlite3.Connection):
+            for (job_id, position, _), result, error in zip(claim.items, results, errors):
+                if error is None:
+                    db.execute("UPDATE items SET status = 'done', result = ?, error = NULL "
+                               "WHERE job_id = ? AND position = ? AND status = 'running' AND worker = ?",
+                               (json.dumps(result), job_id, position, claim.worker))
+                else:
+                    db.execute("UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                               "error = ? WHERE job_id = ? AND position = ? AND status = 'running' AND worker = ?",
+                               (self.max_attempts, error, job_id, position, claim.worker))
+            self._refresh_jobs(db, {job_id for job_id, _, _ in claim.items}, time.time())
+
+        self._transaction(record)
+
+    def release(self, claim: Claim):
+        def requeue(db: sqlite3.Connection):
+            db.executemany("UPDATE items SET status = 'queued', attempts = MAX(attempts - 1, 0) "
+                           "WHERE job_id = ? AND position = ? AND status = 'running' AND worker = ?",
+                           [(job_id, position, claim.worker) for job_id, position, _ in claim.items])
+            self._refresh_jobs(db, {job_id for job_id, _, _ in claim.items}, time.time())
+
+        self._transaction(requeue)
+
+    def _refresh_jobs(self, db: sqlite3.Connection, job_ids, now: float):
+        """Derive each job's status from its items"""
+        for job_id in job_ids:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status",
+                                     (job_id,)).fetchall())
+            if counts.get("queued", 0) + counts.get("running", 0) > 0:
+                started = counts.get("running", 0) + sum(counts.get(state, 0) for state in FINISHED_STATES) > 0
+                db.execute("UPDATE jobs SET status = ?, started_at = COALESCE(started_at, ?) WHERE id = ?",
+                           ("running" if started else "queued", now if started else None, job_id))
+                continue
+            if counts.get("done", 0):
+                status = "done"
+            elif counts.get("cancelled", 0):
+                status = "cancelled"
+            else:
+                status = "failed"
+            db.execute("UPDATE jobs SET status = ?, finished_at = COALESCE(finished_at, ?), "
+                       "expires_at = COALESCE(expires_at, ?) WHERE id = ?",
+                       (status, now, now + self.ttl_seconds, job_id))
+
+    def cleanup(self) -> int:
+        now = time.time()
+        deleted = self._transaction(
+            lambda db: db.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,)).rowcount)
+        with self._lock:
+            needed = {row[0] for row in self._db().execute(
+                "SELECT DISTINCT image_hash FROM items WHERE status IN ('queued', 'running')")}
+        # Images stored in the last minute may belong to a submission still in progress
+        for root, _, files in os.walk(self.image_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if name not in needed and now - os.path.getmtime(path) > 60:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            db = self._db()
+            jobs = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            items = dict(db.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+        return {"backend": type(self).__name__, "jobs": jobs, "images": items}
+
+
+def create_job_queue() -> JobQueue:
+    """Job queue from JOB_BACKEND"""
+    if BACKEND == "sqlite":
+        return SQLiteJobQueue()
+    module_name, _, class_name = BACKEND.partition(":")
+    queue_class = getattr(importlib.import_module(module_name), class_name)
+    logger.info(f"📮 Job backend: {BACKEND}")
+    return queue_class()
+
+
+class JobWorkers:
+    """Background tasks that claim queued images and run them through their task in batches"""
+
+    def __init__(self, queue: JobQueue, tasks: Dict[str, Task], workers: int = WORKERS, batch_size: int = BATCH_SIZE):
+        self.queue = queue
+        self.tasks = tasks
+        self.workers = workers
+        self.batch_size = batch_size
+        self.processed = 0
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(f"{os.getpid()}-{index}")) for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._sweep()))
+        logger.info(f"📮 {self.workers} job workers started")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers, called after a submission"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _work(self, worker: str):
+        while True:
+            try:
+                claim = await run_blocking(self.queue.claim, worker, self.batch_size)
+            except Exception as e:
+                logger.error(f"❌ Job claim failed: {e}")
+                claim = None
+            if claim is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(claim)
+            except admission.AdmissionError as e:
+                # Model queues are full of request traffic, back off without using up an attempt
+                logger.warning(f"⏳ Job batch deferred: {e.detail}")
+                try:
+                    await run_blocking(self.queue.release, claim)
+                except Exception as e:
+                    logger.error(f"❌ Job release failed: {e}")
+                await asyncio.sleep(POLL_SECONDS)
+            except asyncio.CancelledError:
+                await run_blocking(self.queue.release, claim)
+                raise
+            except Exception as e:
+                # e.g. a locked database. The worker keeps going, the lease hands the images out again
+                logger.error(f"❌ Job batch ({claim.task}) failed: {e}, retried when its lease expires")
+                await asyncio.sleep(POLL_SECONDS)
+
+    async def _process(self, claim: Claim):
+        count = len(claim.items)
+        results: List[Optional[Dict[str, Any]]] = [None] * count
+        errors: List[Optional[str]] = [None] * count
+
+        task = self.tasks.get(claim.task)
+        contexts: Dict[str, ImageContext] = {}  # the same image is computed once per batch
+        for i, (_, _, image_hash) in enumerate(claim.items):
+            if task is None:
+                errors[i] = f"Unknown task {claim.task}"
+            elif image_hash not in contexts:
+                data = await run_blocking(self.queue.read_image, image_hash)
+                try:
+                    if data is None:
+                        raise ValueError("image is no longer stored")
+                    contexts[image_hash] = await run_blocking(ImageContext.from_bytes, data, dict(claim.options))
+                except Exception as e:
+                    errors[i] = f"Invalid image: {str(e)}"
+
+        hashes = list(contexts)
+        if hashes:
+            start_time = time.perf_counter()
+            try:
+                with admission.background():
+                    outputs = dict(zip(hashes, await task([contexts[h] for h in hashes])))
+                for i, (_, _, image_hash) in enumerate(claim.items):
+                    if image_hash in outputs:
+                        results[i] = outputs[image_hash]
+            except (asyncio.CancelledError, admission.AdmissionError):
+                raise
+            except Exception as e:
+                detail = getattr(e, "detail", None) or str(e)
+                logger.error(f"❌ Job batch of {len(hashes)} images ({claim.task}) failed: {detail}")
+                for i, (_, _, image_hash) in enumerate(claim.items):
+                    if image_hash in contexts:
+                        errors[i] = detail
+            logger.info(f"📮 {claim.task}: {len(hashes)} images in {time.perf_counter() - start_time:.2f}s")
+
+        await run_blocking(self.queue.complete, claim, results, errors)
+        self.processed += count
+
+    async def _sweep(self):
+        while True:
+            try:
+                deleted = await run_blocking(self.queue.cleanup)
+                if deleted:
+                    logger.info(f"🧹 Deleted {deleted} expired jobs")
+            except Exception as e:
+                logger.error(f"❌ Job cleanup failed: {e}")
+            await asyncio.sleep(CLEANUP_SECONDS)
@@ -1,19 +1,41 @@
-from fastapi import FastAPI, HTTPException
+if __name__ == "__main__":
+    # Started as a script: the thread counts must be in the environment
+    # before numpy, OpenCV and the frameworks below size their pools
+    import serving
+    serving.set_thread_env(serving.threads_per_worker(serving.worker_count()))
+
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 import base64
 import cv2
 import numpy as np
-import torch
-import tensorflow as tf
 from PIL import Image
-import io
 import time
+import json
 import os
-from typing import List, Dict, Any
-from roboflow import Roboflow
-from transformers import AutoImageProcessor, AutoModelForImageClassification, pipeline
+import sys
+from typing import List, Dict, Any, Optional, Callable, Awaitable
 import logging
+import asyncio
+from functools import partial
+
+import admission
+from inference import queued_calls, run_blocking, run_inference, start_executor, shutdown_executor
+from batching import MicroBatcher
+from image_io import AnnotationStore, annotation_settings, encode_jpeg, parse_image_request, render_annotations
+from backends import model_backend, onnx_path, select_loader
+from damage_segmentation import SEGMENTATION_SCORE_THRESHOLD, mask_format, mask_to_polygons, mask_to_rle
+from pipeline import EARLY_EXIT, Stage, StageGraph
+from preprocessing import KERAS_INPUT, REDUCED_DECODE, REDUCED_MIN_SIDE, ImageContext, keras_buffers
+import metrics
+from metrics import phase
+from model_registry import LOADING_MODE, ModelRegistry, process_memory, process_rss_bytes
+from result_cache import create_result_cache, file_fingerprint, make_key
+import jobs
+import video
+from tiling import tiled_predict, tiling_settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,441 +52,1568 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global model variables
-yolo_model = None
-gnet_model = None
-damage_severity_model = None
-roboflow_model = None
-car_brand_pipeline = None
-damage_type_pipeline = None
+# Paths that bypass the lane limits, so probes and scrapes work under load
+UNLIMITED_PATHS = ("/health", "/metrics", "/cache", "/annotations/", "/debug/")
+
+# Lane limits and deadlines, inside the request metrics so rejections are counted
+app.add_middleware(admission.AdmissionMiddleware, unlimited_paths=UNLIMITED_PATHS)
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+# Largest photo set accepted by the batch endpoints
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", "32"))
+
+# Model files and hub ids, their version is part of every result cache key
+MODEL_FILES = {
+    "gnet": "models/gnet.h5",
+    "yolo": "models/best.pt",
+    "damage_severity": "models/car-damage-model.h5",
+    "damage_segmentation": "models/damage_maskrcnn.pth"
+}
+MODEL_IDS = {
+    "roboflow": os.getenv("ROBOFLOW_MODEL", "car-damage-coco-v9i/1"),
+    "car_brand": "dima806/car_brands_image_detection",
+    "damage_type": "beingamit99/car_damage_detection"
+}
+
+# Thresholds applied to the model outputs (also part of the cache key)
+AI_THRESHOLD = 0.5
+YOLO_CONFIDENCE_THRESHOLD = 0.3
+ROBOFLOW_CONFIDENCE = 30
+ROBOFLOW_OVERLAP = 50
+DAMAGE_TYPE_MIN_SCORE = 0.1
+
+# Margin added around each detection box before per-region classification, as a fraction of its size
+CROP_PADDING = float(os.getenv("CROP_PADDING", "0.1"))
+
+result_cache = create_result_cache()
+annotation_store = AnnotationStore(int(os.getenv("ANNOTATION_STORE_MAX_ITEMS", "256")))
+model_versions: Dict[str, str] = {}
+
+# TensorFlow, PyTorch and the hub clients are imported inside the loaders so
+# a worker only pays for the frameworks of the models it actually loads
 
 def load_gnet_model():
     """Load GNet model for AI-or-not detection"""
-    global gnet_model
     try:
-        model_path = "models/gnet.h5"
+        import tensorflow as tf
+        model_path = MODEL_FILES["gnet"]
         if os.path.exists(model_path):
             gnet_model = tf.keras.models.load_model(model_path)
             logger.info("✅ GNet AI detection model loaded successfully")
-        else:
-            logger.warning(f"❌ GNet model not found at {model_path}")
+            return gnet_model
+        logger.warning(f"❌ GNet model not found at {model_path}")
     except Exception as e:
         logger.error(f"❌ Error loading GNet model: {e}")
+    return None
 
 def load_yolo_model():
     """Load YOLO model for object detection"""
-    global yolo_model
     try:
-        model_path = "models/best.pt"
+        import torch
+        model_path = MODEL_FILES["yolo"]
         if os.path.exists(model_path):
             yolo_model = torch.hub.load('ultralytics/yolov5', 'custom', path=model_path)
             logger.info("✅ YOLO model loaded successfully")
-        else:
-            logger.warning(f"❌ YOLO model not found at {model_path}")
+            return yolo_model
+        logger.warning(f"❌ YOLO model not found at {model_path}")
     except Exception as e:
         logger.error(f"❌ Error loading YOLO model: {e}")
+    return None
 
 def load_damage_severity_model():
     """Load car damage severity model"""
-    global damage_severity_model
     try:
-        model_path = "models/car-damage-model.h5"
+        import tensorflow as tf
+        model_path = MODEL_FILES["damage_severity"]
         if os.path.exists(model_path):
             damage_severity_model = tf.keras.models.load_model(model_path)
             logger.info("✅ Car damage severity model loaded successfully")
-        else:
-            logger.warning(f"❌ Damage severity model not found at {model_path}")
+            return damage_severity_model
+        logger.warning(f"❌ Damage severity model not found at {model_path}")
     except Exception as e:
         logger.error(f"❌ Error loading damage severity model: {e}")
+    return None
 
 def load_roboflow_model():
-    """Load Roboflow model for car damage detection"""
-    global roboflow_model
+    """Create the pooled Roboflow client for car damage detection"""
     try:
-        api_key = os.getenv("ROBOFLOW_API_KEY", "EJdF3gB2PwrQDNlVhauC")
-        rf = Roboflow(api_key=api_key)
-        project = rf.workspace().project("car-damage-coco-v9i")
-        roboflow_model = project.version(1).model
-        logger.info("✅ Roboflow model loaded successfully")
+        from roboflow_client import RoboflowClient
+        roboflow_model = RoboflowClient.from_env()
+        logger.info("✅ Roboflow client ready")
+        return roboflow_model
     except Exception as e:
         logger.error(f"❌ Error loading Roboflow model: {e}")
+    return None
 
 def load_car_brand_model():
     """Load car brand detection model from Hugging Face"""
-    global car_brand_pipeline
     try:
+        from transformers import AutoImageProcessor, AutoModelForImageClassification, pipeline
         processor = AutoImageProcessor.from_pretrained("dima806/car_brands_image_detection")
         model = AutoModelForImageClassification.from_pretrained("dima806/car_brands_image_detection")
         car_brand_pipeline = pipeline("image-classification", model=model, feature_extractor=processor)
         logger.info("✅ Car brand detection model loaded successfully")
+        return car_brand_pipeline
     except Exception as e:
         logger.error(f"❌ Error loading car brand model: {e}")
+    return None
 
 def load_damage_type_model():
     """Load damage type detection model from Hugging Face"""
-    global damage_type_pipeline
     try:
+        from transformers import AutoImageProcessor, AutoModelForImageClassification, pipeline
         processor = AutoImageProcessor.from_pretrained("beingamit99/car_damage_detection")
         model = AutoModelForImageClassification.from_pretrained("beingamit99/car_damage_detection")
         damage_type_pipeline = pipeline("image-classification", model=model, feature_extractor=processor)
         logger.info("✅ Damage type detection model loaded successfully")
+        return damage_type_pipeline
     except Exception as e:
         logger.error(f"❌ Error loading damage type model: {e}")
+    return None
+
+def load_damage_segmentation_model():
+    """Load the Mask R-CNN damaged parts segmenter (detectron2)"""
+    try:
+        model_path = MODEL_FILES["damage_segmentation"]
+        if os.path.exists(model_path):
+            from damage_segmentation import DamageSegmenter
+            segmenter = DamageSegmenter(model_path)
+            logger.info("✅ Damage segmentation model loaded successfully")
+            return segmenter
+        logger.warning(f"❌ Damage segmentation model not found at {model_path}")
+    except Exception as e:
+        logger.error(f"❌ Error loading damage segmentation model: {e}")
+    return None
+
+# Each loader honors MODEL_BACKEND, ONNX exports replace the framework models
+models = ModelRegistry()
+models.register("gnet", select_loader("gnet", load_gnet_model))
+models.register("yolo", select_loader("yolo", load_yolo_model))
+models.register("damage_severity", select_loader("damage_severity", load_damage_severity_model))
+models.register("roboflow", load_roboflow_model, close=lambda client: client.close())
+models.register("car_brand", select_loader("car_brand", load_car_brand_model))
+models.register("damage_type", select_loader("damage_type", load_damage_type_model))
+models.register("damage_segmentation", load_damage_segmentation_model)
+
+async def evict_idle_models():
+    """Periodically unload models that have not been used within the idle TTL"""
+    while True:
+        await asyncio.sleep(max(1.0, min(models.idle_ttl / 2, 60.0)))
+        await run_blocking(models.evict_idle)
 
 @app.on_event("startup")
 async def startup_event():
-    """Load all models on startup"""
+    """Load the configured models on startup"""
     logger.info("🚀 Starting AI AutoExpert Service...")
     
     # Create models directory if it doesn't exist
     os.makedirs("models", exist_ok=True)
     
-    # Load all models
-    load_gnet_model()
-    load_yolo_model()
-    load_damage_severity_model()
-    load_roboflow_model()
-    load_car_brand_model()
-    load_damage_type_model()
+    # Eager mode loads every model, lazy mode only the preload subset; the
+    # rest load on their first request
+    startup_models = models.startup_models()
+    logger.info(f"📦 Loading models ({LOADING_MODE}): {', '.join(startup_models) or 'none'}")
+    await asyncio.get_running_loop().run_in_executor(None, models.load_all, startup_models)
+
+    # Blocking inference runs on this pool instead of the event loop
+    start_executor()
+
+    if jobs.WORKERS > 0:
+        job_workers.start()
+
+    if models.idle_ttl > 0:
+        app.state.idle_eviction = asyncio.create_task(evict_idle_models())
     
     logger.info("🎉 AI AutoExpert Service started successfully!")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the job workers, the batchers and the inference executor"""
+    idle_eviction = getattr(app.state, "idle_eviction", None)
+    if idle_eviction is not None:
+        idle_eviction.cancel()
+    # Jobs still running go back to the queue
+    await job_workers.stop()
+    await gnet_batcher.close()
+    await damage_severity_batcher.close()
+    shutdown_executor()
+
 def decode_base64_image(base64_string: str) -> np.ndarray:
     """Decode base64 image to numpy array"""
-    image_data = base64.b64decode(base64_string)
-    image = Image.open(io.BytesIO(image_data))
-    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    return ImageContext.from_base64(base64_string).bgr
+
+def image_context_from_bytes(image_data: bytes, options: Dict[str, Any]) -> ImageContext:
+    """Wrap uploaded bytes in an ImageContext, rejecting non-images with a 400"""
+    try:
+        return ImageContext.from_bytes(image_data, options)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+
+async def read_request_image(request: Request) -> ImageContext:
+    """Read the single image of a JSON, multipart or raw-bytes request"""
+    with phase("request", "parse"):
+        options, images = await parse_image_request(request)
+    if not images:
+        raise HTTPException(status_code=400, detail="No image provided")
+    return await run_blocking(image_context_from_bytes, images[0], options)
+
+async def read_request_images(request: Request) -> List[ImageContext]:
+    """Read every image of a batch request"""
+    with phase("request", "parse"):
+        options, images = await parse_image_request(request)
+    if not images:
+        raise HTTPException(status_code=400, detail="No images provided")
+    if len(images) > MAX_BATCH_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Too many images, the limit is {MAX_BATCH_IMAGES}")
+    return await asyncio.gather(*[
+        run_blocking(image_context_from_bytes, image, options) for image in images
+    ])
 
 def encode_image_to_base64(image: np.ndarray) -> str:
     """Encode numpy array image to base64"""
     _, buffer = cv2.imencode('.jpg', image)
     return base64.b64encode(buffer).decode('utf-8')
 
-def pil_to_cv2(pil_image: Image.Image) -> np.ndarray:
-    """Convert PIL image to OpenCV format"""
-    return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+def annotation_payload(image: np.ndarray, detections: List[Dict[str, Any]], color: tuple,
+                       options: Dict[str, Any], outlines: Optional[List[List[List[int]]]] = None) -> Dict[str, Any]:
+    """Annotated preview inline as base64, as a link with annotation=url, or skipped with annotation=none"""
+    mode, max_side, quality = annotation_settings(options)
+    if mode == "none":
+        return {"annotated_image": None}
 
-@app.post("/ai-check")
-async def check_ai_generated(request: Dict[str, Any]):
-    """Check if image is AI-generated using GNet model"""
+    with phase("annotation", "render"):
+        preview = render_annotations(image, detections, color, max_side, outlines)
+    with phase("annotation", "encode"):
+        jpeg = encode_jpeg(preview, quality)
+    if mode == "url":
+        annotation_id = annotation_store.put(jpeg)
+        return {"annotated_image": None, "annotated_image_url": f"/annotations/{annotation_id}"}
+    return {"annotated_image": base64.b64encode(jpeg).decode('utf-8')}
+
+def keras_input(context: ImageContext) -> np.ndarray:
+    """224x224 uint8 RGB, the input of both Keras models before normalization"""
+    return context.resized_rgb(KERAS_INPUT.size)
+
+def stack_for_keras(contexts: List[ImageContext]) -> np.ndarray:
+    """Stack the Keras inputs of several images into one batch"""
+    return np.stack([keras_input(context) for context in contexts])
+
+def gnet_predict(image_batch: np.ndarray) -> np.ndarray:
+    """Batched GNet forward pass over uint8 images, scaled to [0, 1] in a reused float32 buffer"""
+    with keras_buffers.normalized(image_batch) as inputs, phase("gnet", "inference"):
+        return models.get("gnet").predict(inputs, verbose=0)
+
+def damage_severity_predict(image_batch: np.ndarray) -> np.ndarray:
+    """Batched damage severity forward pass over uint8 images"""
+    with keras_buffers.normalized(image_batch) as inputs, phase("damage_severity", "inference"):
+        return models.get("damage_severity").predict(inputs, verbose=0)
+
+# Concurrent requests to the 224x224 Keras models are merged into one predict call
+gnet_batcher = MicroBatcher("gnet", gnet_predict)
+damage_severity_batcher = MicroBatcher("damage_severity", damage_severity_predict)
+
+def format_ai_check(prediction: float, processing_time: float) -> Dict[str, Any]:
+    """Build the /ai-check response from a GNet score"""
+    # Interpret prediction (adjust threshold based on your model)
+    is_ai = prediction > AI_THRESHOLD
+    confidence = prediction if is_ai else 1 - prediction
+
+    return {
+        "is_ai_generated": bool(is_ai),
+        "confidence": float(confidence),
+        "processing_time": processing_time,
+        "model_used": "gnet.h5"
+    }
+
+def yolo_boxes(boxes: Any) -> np.ndarray:
+    """xyxy/conf/cls rows as NumPy, from a torch tensor or an ONNX backend array"""
+    return boxes.cpu().numpy() if hasattr(boxes, "cpu") else boxes
+
+def yolo_detections(boxes: np.ndarray, class_names: Any) -> List[Dict[str, Any]]:
+    """YOLO xyxy boxes above the confidence threshold as detection dicts"""
+    detections = []
+
+    for *box, conf, cls in boxes:
+        if conf > YOLO_CONFIDENCE_THRESHOLD:  # Confidence threshold
+            x1, y1, x2, y2 = map(int, box)
+            class_name = class_names[int(cls)]
+
+            detections.append({
+                "class": class_name,
+                "confidence": float(conf),
+                "bbox": [x1, y1, x2, y2]
+            })
+    return detections
+
+def yolo_predict(yolo_model: Any, images: List[np.ndarray], options: Dict[str, Any]) -> List[np.ndarray]:
+    """YOLO xyxy/conf/cls rows per image, from the full frames or, with tiling on, from overlapping tiles"""
+    def predict(inputs: List[np.ndarray]) -> List[np.ndarray]:
+        return [yolo_boxes(boxes) for boxes in yolo_model(inputs).xyxy]
+
+    settings = tiling_settings(options)
+    if settings is None:
+        return predict(images)
+    return tiled_predict(predict, images, settings, YOLO_CONFIDENCE_THRESHOLD)
+
+def format_yolo_detections(image: np.ndarray, boxes: np.ndarray, class_names: Any, processing_time: float,
+                           options: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the /yolo-detect response from YOLO xyxy boxes"""
+    detections = yolo_detections(boxes, class_names)
+
+    avg_confidence = np.mean([d["confidence"] for d in detections]) if detections else 0
+
+    return {
+        "detections": detections,
+        "confidence": float(avg_confidence),
+        "processing_time": processing_time,
+        **annotation_payload(image, detections, (0, 255, 0), options),
+        "model_used": "best.pt"
+    }
+
+def format_segmentation(image: np.ndarray, instances: Dict[str, np.ndarray], class_names: List[str],
+                        processing_time: float, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the /damage-segmentation response from Mask R-CNN instances"""
+    masks = mask_format(options)
+    draw = annotation_settings(options)[0] != "none"
+    detections, outlines = [], []
+
+    for box, score, cls, mask in zip(instances["boxes"], instances["scores"], instances["classes"], instances["masks"]):
+        x1, y1, x2, y2 = map(int, box)
+        detection = {
+            "class": class_names[int(cls)] if int(cls) < len(class_names) else str(int(cls)),
+            "confidence": float(score),
+            "bbox": [x1, y1, x2, y2],
+            "area": int(mask.sum())
+        }
+        polygons = mask_to_polygons(mask) if masks == "polygon" or draw else None
+        if masks == "rle":
+            detection["mask"] = mask_to_rle(mask)
+        elif masks == "polygon":
+            detection["mask"] = polygons
+        detections.append(detection)
+        outlines.append(polygons)
+
+    avg_confidence = np.mean([d["confidence"] for d in detections]) if detections else 0
+
+    return {
+        "detections": detections,
+        "confidence": float(avg_confidence),
+        "mask_format": masks,
+        "processing_time": processing_time,
+        **annotation_payload(image, detections, (0, 0, 255), options, outlines),
+        "model_used": os.path.basename(MODEL_FILES["damage_segmentation"])
+    }
+
+def format_severity(predictions: np.ndarray, processing_time: float) -> Dict[str, Any]:
+    """Build the /damage-severity response from the class probabilities"""
+    # Define severity classes (adjust based on your model)
+    severity_classes = ["minor", "moderate", "severe"]
+
+    # Get the predicted severity
+    severity_index = np.argmax(predictions)
+    severity = severity_classes[severity_index] if severity_index < len(severity_classes) else "unknown"
+    confidence = float(predictions[severity_index])
+
+    return {
+        "severity": severity,
+        "confidence": confidence,
+        "all_predictions": {
+            severity_classes[i]: float(predictions[i])
+            for i in range(min(len(severity_classes), len(predictions)))
+        },
+        "processing_time": processing_time,
+        "model_used": "car-damage-model.h5"
+    }
+
+def format_brand(results: List[Dict[str, Any]], processing_time: float) -> Dict[str, Any]:
+    """Build the /brand-detection response from pipeline output"""
+    # Get top prediction
+    top_result = results[0] if results else {"label": "unknown", "score": 0.0}
+
+    return {
+        "brand": top_result["label"],
+        "confidence": top_result["score"],
+        "all_predictions": [
+            {"brand": r["label"], "confidence": r["score"]}
+            for r in results[:5]  # Top 5 predictions
+        ],
+        "processing_time": processing_time,
+        "model_used": "dima806/car_brands_image_detection"
+    }
+
+def format_damage_type(results: List[Dict[str, Any]], processing_time: float) -> Dict[str, Any]:
+    """Build the /damage-type response from pipeline output"""
+    # Filter results with confidence > 0.1
+    filtered_results = [r for r in results if r["score"] > DAMAGE_TYPE_MIN_SCORE]
+
+    return {
+        "damage_types": [
+            {"type": r["label"], "confidence": r["score"]}
+            for r in filtered_results
+        ],
+        "primary_damage": filtered_results[0]["label"] if filtered_results else "no_damage",
+        "processing_time": processing_time,
+        "model_used": "beingamit99/car_damage_detection"
+    }
+
+async def run_ai_check(context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run GNet AI-or-not detection on a decoded image"""
+    gnet_model = await run_blocking(models.get, "gnet")
     if gnet_model is None:
         raise HTTPException(status_code=500, detail="GNet model not loaded")
-    
+
     try:
-        start_time = time.time()
-        
-        # Decode image
-        image = decode_base64_image(request["image"])
-        
+        start_time = start_time or time.perf_counter()
+
         # Preprocess for GNet (adjust size based on your model requirements)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image_resized = cv2.resize(image_rgb, (224, 224))  # Adjust size if needed
-        image_normalized = image_resized / 255.0
-        image_batch = np.expand_dims(image_normalized, axis=0)
-        
-        # Predict
-        prediction = gnet_model.predict(image_batch, verbose=0)[0][0]
-        
-        # Interpret prediction (adjust threshold based on your model)
-        is_ai = prediction > 0.5
-        confidence = prediction if is_ai else 1 - prediction
-        
-        processing_time = time.time() - start_time
-        
-        return {
-            "is_ai_generated": bool(is_ai),
-            "confidence": float(confidence),
-            "processing_time": processing_time,
-            "model_used": "gnet.h5"
-        }
-        
+        image_input = await run_blocking(keras_input, context)
+
+        # Predict, batched with other in-flight requests
+        with phase("gnet", "batch_wait"):
+            prediction = (await gnet_batcher.submit(image_input))[0]
+
+        return format_ai_check(prediction, time.perf_counter() - start_time)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"AI detection error: {e}")
         raise HTTPException(status_code=500, detail=f"AI detection failed: {str(e)}")
 
-@app.post("/yolo-detect")
-async def yolo_detection(request: Dict[str, Any]):
-    """Detect car damage using YOLO model"""
+def run_yolo_detection(context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run YOLO damage detection on a decoded image"""
+    yolo_model = models.get("yolo")
     if yolo_model is None:
         raise HTTPException(status_code=500, detail="YOLO model not loaded")
-    
+
     try:
-        start_time = time.time()
-        
-        # Decode image
-        image = decode_base64_image(request["image"])
-        
+        start_time = start_time or time.perf_counter()
+        image = context.bgr
+
         # Run YOLO detection
-        results = yolo_model(image)
-        
-        # Parse results
-        detections = []
-        annotated_image = image.copy()
-        
-        for *box, conf, cls in results.xyxy[0].cpu().numpy():
-            if conf > 0.3:  # Confidence threshold
-                x1, y1, x2, y2 = map(int, box)
-                class_name = yolo_model.names[int(cls)]
-                
-                detections.append({
-                    "class": class_name,
-                    "confidence": float(conf),
-                    "bbox": [x1, y1, x2, y2]
-                })
-                
-                # Draw bounding box
-                cv2.rectangle(annotated_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                cv2.putText(annotated_image, f"{class_name}: {conf:.2f}", 
-                           (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        processing_time = time.time() - start_time
-        avg_confidence = np.mean([d["confidence"] for d in detections]) if detections else 0
-        
-        return {
-            "detections": detections,
-            "confidence": float(avg_confidence),
-            "processing_time": processing_time,
-            "annotated_image": encode_image_to_base64(annotated_image),
-            "model_used": "best.pt"
-        }
-        
+        with phase("yolo", "inference"):
+            boxes = yolo_predict(yolo_model, [image], context.options)[0]
+
+        with phase("yolo", "postprocess"):
+            return format_yolo_detections(image, boxes, yolo_model.names,
+                                          time.perf_counter() - start_time, context.options)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"YOLO detection error: {e}")
         raise HTTPException(status_code=500, detail=f"YOLO detection failed: {str(e)}")
 
-@app.post("/roboflow-detect")
-async def roboflow_detection(request: Dict[str, Any]):
-    """Detect car damage using Roboflow model"""
+def encode_for_roboflow(image: np.ndarray) -> bytes:
+    """JPEG of the decoded image, in memory: the decoded pixels are what the boxes refer to"""
+    with phase("roboflow", "encode"):
+        _, buffer = cv2.imencode('.jpg', image)
+    return buffer.tobytes()
+
+def format_roboflow_detections(image: np.ndarray, predictions: List[Dict[str, Any]], processing_time: float,
+                               options: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the /roboflow-detect response from Roboflow's center/size predictions"""
+    detections = []
+
+    for pred in predictions:
+        x1 = int(pred["x"] - pred["width"]/2)
+        y1 = int(pred["y"] - pred["height"]/2)
+        x2 = int(pred["x"] + pred["width"]/2)
+        y2 = int(pred["y"] + pred["height"]/2)
+
+        detections.append({
+            "class": pred["class"],
+            "confidence": pred["confidence"],
+            "bbox": [x1, y1, x2, y2]
+        })
+
+    avg_confidence = np.mean([d["confidence"] for d in detections]) if detections else 0
+
+    return {
+        "detections": detections,
+        "confidence": float(avg_confidence),
+        "processing_time": processing_time,
+        **annotation_payload(image, detections, (255, 0, 0), options),
+        "model_used": "roboflow"
+    }
+
+def run_roboflow_detection(context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run Roboflow damage detection on a decoded image"""
+    roboflow_model = models.get("roboflow")
     if roboflow_model is None:
         raise HTTPException(status_code=500, detail="Roboflow model not loaded")
-    
+
     try:
-        start_time = time.time()
-        
-        # Decode image
-        image = decode_base64_image(request["image"])
-        
-        # Save temporary image for Roboflow
-        temp_path = "temp_image.jpg"
-        cv2.imwrite(temp_path, image)
-        
+        start_time = start_time or time.perf_counter()
+        image = context.bgr
+        image_bytes = encode_for_roboflow(image)
+
         # Run Roboflow prediction
-        prediction = roboflow_model.predict(temp_path, confidence=30, overlap=50)
-        
-        # Parse results
-        detections = []
-        annotated_image = image.copy()
-        
-        for pred in prediction.predictions:
-            x1 = int(pred.x - pred.width/2)
-            y1 = int(pred.y - pred.height/2)
-            x2 = int(pred.x + pred.width/2)
-            y2 = int(pred.y + pred.height/2)
-            
-            detections.append({
-                "class": pred.class_name,
-                "confidence": pred.confidence,
-                "bbox": [x1, y1, x2, y2]
-            })
-            
-            # Draw bounding box
-            cv2.rectangle(annotated_image, (x1, y1), (x2, y2), (255, 0, 0), 2)
-            cv2.putText(annotated_image, f"{pred.class_name}: {pred.confidence:.2f}", 
-                       (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
-        
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
-        processing_time = time.time() - start_time
-        avg_confidence = np.mean([d["confidence"] for d in detections]) if detections else 0
-        
-        return {
-            "detections": detections,
-            "confidence": float(avg_confidence),
-            "processing_time": processing_time,
-            "annotated_image": encode_image_to_base64(annotated_image),
-            "model_used": "roboflow"
-        }
-        
+        with phase("roboflow", "inference"):
+            predictions = roboflow_model.predict(image_bytes, confidence=ROBOFLOW_CONFIDENCE, overlap=ROBOFLOW_OVERLAP)
+
+        return format_roboflow_detections(image, predictions, time.perf_counter() - start_time, context.options)
+
     except Exception as e:
         logger.error(f"Roboflow detection error: {e}")
         raise HTTPException(status_code=500, detail=f"Roboflow detection failed: {str(e)}")
 
-@app.post("/damage-severity")
-async def damage_severity_analysis(request: Dict[str, Any]):
-    """Analyze damage severity using car-damage-model.h5"""
+def run_damage_segmentation(context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run Mask R-CNN damaged parts segmentation on a decoded image"""
+    segmenter = models.get("damage_segmentation")
+    if segmenter is None:
+        raise HTTPException(status_code=500, detail="Damage segmentation model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        image = context.bgr
+        with phase("damage_segmentation", "inference"):
+            instances = segmenter.predict([image])[0]
+        with phase("damage_segmentation", "postprocess"):
+            return format_segmentation(image, instances, segmenter.class_names,
+                                       time.perf_counter() - start_time, context.options)
+
+    except Exception as e:
+        logger.error(f"Damage segmentation error: {e}")
+        raise HTTPException(status_code=500, detail=f"Damage segmentation failed: {str(e)}")
+
+async def run_damage_severity(context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run damage severity classification on a decoded image"""
+    damage_severity_model = await run_blocking(models.get, "damage_severity")
     if damage_severity_model is None:
         raise HTTPException(status_code=500, detail="Damage severity model not loaded")
-    
+
     try:
-        start_time = time.time()
-        
-        # Decode image
-        image = decode_base64_image(request["image"])
-        
+        start_time = start_time or time.perf_counter()
+
         # Preprocess for damage severity model
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image_resized = cv2.resize(image_rgb, (224, 224))  # Adjust based on your model
-        image_normalized = image_resized / 255.0
-        image_batch = np.expand_dims(image_normalized, axis=0)
-        
-        # Predict severity
-        predictions = damage_severity_model.predict(image_batch, verbose=0)[0]
-        
-        # Define severity classes (adjust based on your model)
-        severity_classes = ["minor", "moderate", "severe"]
-        
-        # Get the predicted severity
-        severity_index = np.argmax(predictions)
-        severity = severity_classes[severity_index] if severity_index < len(severity_classes) else "unknown"
-        confidence = float(predictions[severity_index])
-        
-        processing_time = time.time() - start_time
-        
-        return {
-            "severity": severity,
-            "confidence": confidence,
-            "all_predictions": {
-                severity_classes[i]: float(predictions[i]) 
-                for i in range(min(len(severity_classes), len(predictions)))
-            },
-            "processing_time": processing_time,
-            "model_used": "car-damage-model.h5"
-        }
-        
+        image_input = await run_blocking(keras_input, context)
+
+        # Predict severity, batched with other in-flight requests
+        with phase("damage_severity", "batch_wait"):
+            predictions = await damage_severity_batcher.submit(image_input)
+
+        return format_severity(predictions, time.perf_counter() - start_time)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Damage severity analysis error: {e}")
         raise HTTPException(status_code=500, detail=f"Damage severity analysis failed: {str(e)}")
 
-@app.post("/brand-detection")
-async def brand_detection(request: Dict[str, Any]):
-    """Detect car brand using Hugging Face model"""
+def run_brand_detection(context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run car brand classification on a decoded image"""
+    car_brand_pipeline = models.get("car_brand")
     if car_brand_pipeline is None:
         raise HTTPException(status_code=500, detail="Car brand model not loaded")
-    
+
     try:
-        start_time = time.time()
-        
-        # Decode image
-        image = decode_base64_image(request["image"])
-        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        
+        start_time = start_time or time.perf_counter()
+
         # Run brand detection
-        results = car_brand_pipeline(pil_image)
-        
-        # Get top prediction
-        top_result = results[0] if results else {"label": "unknown", "score": 0.0}
-        
-        processing_time = time.time() - start_time
-        
-        return {
-            "brand": top_result["label"],
-            "confidence": top_result["score"],
-            "all_predictions": [
-                {"brand": r["label"], "confidence": r["score"]} 
-                for r in results[:5]  # Top 5 predictions
-            ],
-            "processing_time": processing_time,
-            "model_used": "dima806/car_brands_image_detection"
-        }
-        
+        image = context.pil
+        with phase("car_brand", "inference"):
+            results = car_brand_pipeline(image)
+
+        return format_brand(results, time.perf_counter() - start_time)
+
     except Exception as e:
         logger.error(f"Brand detection error: {e}")
         raise HTTPException(status_code=500, detail=f"Brand detection failed: {str(e)}")
 
-@app.post("/damage-type")
-async def damage_type_detection(request: Dict[str, Any]):
-    """Detect damage type using Hugging Face model"""
+def run_damage_type(context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run damage type classification on a decoded image"""
+    damage_type_pipeline = models.get("damage_type")
     if damage_type_pipeline is None:
         raise HTTPException(status_code=500, detail="Damage type model not loaded")
-    
+
     try:
-        start_time = time.time()
-        
-        # Decode image
-        image = decode_base64_image(request["image"])
-        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        
+        start_time = start_time or time.perf_counter()
+
         # Run damage type detection
-        results = damage_type_pipeline(pil_image)
-        
-        # Filter results with confidence > 0.1
-        filtered_results = [r for r in results if r["score"] > 0.1]
-        
-        processing_time = time.time() - start_time
-        
-        return {
-            "damage_types": [
-                {"type": r["label"], "confidence": r["score"]} 
-                for r in filtered_results
-            ],
-            "primary_damage": filtered_results[0]["label"] if filtered_results else "no_damage",
-            "processing_time": processing_time,
-            "model_used": "beingamit99/car_damage_detection"
-        }
-        
+        image = context.pil
+        with phase("damage_type", "inference"):
+            results = damage_type_pipeline(image)
+
+        return format_damage_type(results, time.perf_counter() - start_time)
+
     except Exception as e:
         logger.error(f"Damage type detection error: {e}")
         raise HTTPException(status_code=500, detail=f"Damage type detection failed: {str(e)}")
 
+# Parameters that change a model's output, part of its cache key
+# Classifier inputs depend on the reduced decode setting
+DECODE_PARAMS = {"reduced_decode": REDUCED_MIN_SIDE if REDUCED_DECODE else None}
+CACHE_PARAMS = {
+    "gnet": {"threshold": AI_THRESHOLD, **DECODE_PARAMS},
+    "yolo": {"confidence": YOLO_CONFIDENCE_THRESHOLD},
+    "roboflow": {"confidence": ROBOFLOW_CONFIDENCE, "overlap": ROBOFLOW_OVERLAP},
+    "damage_severity": {**DECODE_PARAMS},
+    "car_brand": {"top_k": 5, **DECODE_PARAMS},
+    "damage_type": {"min_score": DAMAGE_TYPE_MIN_SCORE, **DECODE_PARAMS},
+    "damage_segmentation": {"score_threshold": SEGMENTATION_SCORE_THRESHOLD}
+}
+
+# Models whose results carry an annotated image, its settings are part of their cache key
+ANNOTATED_MODELS = ("yolo", "roboflow", "damage_segmentation")
+
+# Blocking single-image stages, run on the inference executor
+EXECUTOR_STAGES = {
+    "yolo": run_yolo_detection,
+    "roboflow": run_roboflow_detection,
+    "car_brand": run_brand_detection,
+    "damage_type": run_damage_type,
+    "damage_segmentation": run_damage_segmentation
+}
+
+def active_model_file(model: str) -> Optional[str]:
+    """Weights file `model` is served from on its configured backend"""
+    if model_backend(model) == "onnx":
+        return onnx_path(model)
+    return MODEL_FILES.get(model)
+
+def model_version(model: str) -> str:
+    """Current version of `model`: a weights fingerprint for local files, the hub id otherwise"""
+    path = active_model_file(model)
+    if path is None:
+        return MODEL_IDS.get(model, model)
+
+    version = f"{model_backend(model)}:{file_fingerprint(path) or 'missing'}"
+    previous = model_versions.get(model)
+    if previous is not None and previous != version:
+        logger.warning(f"♻️ {model} weights changed on disk, reloading and invalidating its cached results")
+        result_cache.invalidate(model)
+        models.unload(model)
+    model_versions[model] = version
+    return version
+
+def cache_params(model: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Everything that changes `model`'s result for a request with `options`"""
+    params = dict(CACHE_PARAMS.get(model, {}))
+    if model in ANNOTATED_MODELS:
+        params["annotation"] = annotation_settings(options)
+    if model == "damage_segmentation":
+        params["masks"] = mask_format(options)
+    if model == "yolo":
+        params["tiling"] = tiling_settings(options)
+    return params
+
+def cache_lookup(model: str, context: ImageContext) -> tuple:
+    """Cache key of `model`'s result for this image and the cached result, None on a miss"""
+    key = make_key(context.image_hash, model, model_version(model), cache_params(model, context.options))
+    return key, result_cache.get(key)
+
+async def run_cached(model: str, context: ImageContext,
+                     compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Serve `model`'s result for this image from the cache, computing it on a miss"""
+    # Annotation links expire with the annotation store, so they are never cached
+    if context.image_hash is None or not result_cache.enabled or context.options.get("annotation") == "url":
+        return await compute()
+
+    # The weights fingerprint, a reload on change and a disk read all block
+    key, cached = await run_blocking(cache_lookup, model, context)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    result = await compute()
+    await run_blocking(result_cache.put, key, model, result)
+    return result
+
+async def run_stage(model: str, context: ImageContext, start_time: Optional[float] = None) -> Dict[str, Any]:
+    """Run one model on a decoded image, repeats are served from the result cache"""
+    async def compute():
+        if model == "gnet":
+            return await run_ai_check(context, start_time)
+        if model == "damage_severity":
+            return await run_damage_severity(context, start_time)
+        return await run_inference(model, EXECUTOR_STAGES[model], context, start_time)
+
+    return await run_cached(model, context, compute)
+
+# Batch variants run each model once over the whole photo set. The
+# processing_time reported per image is the batch time divided by its size.
+
+async def run_ai_check_batch(contexts: List[ImageContext], start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run GNet over a stacked batch of images"""
+    gnet_model = await run_blocking(models.get, "gnet")
+    if gnet_model is None:
+        raise HTTPException(status_code=500, detail="GNet model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        image_batch = await run_blocking(stack_for_keras, contexts)
+        predictions = await run_inference("gnet", gnet_predict, image_batch)
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        return [format_ai_check(p[0], per_image_time) for p in predictions]
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch AI detection error: {e}")
+        raise HTTPException(status_code=500, detail=f"AI detection failed: {str(e)}")
+
+def run_yolo_detection_batch(contexts: List[ImageContext], start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run YOLO over a list of images in one forward pass"""
+    yolo_model = models.get("yolo")
+    if yolo_model is None:
+        raise HTTPException(status_code=500, detail="YOLO model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        # Photos with the same tiling settings share a forward pass
+        groups: Dict[Any, List[int]] = {}
+        for i, context in enumerate(contexts):
+            groups.setdefault(tiling_settings(context.options), []).append(i)
+        results: List[np.ndarray] = [np.zeros((0, 6), np.float32)] * len(contexts)
+        with phase("yolo", "inference"):
+            for indices in groups.values():
+                boxes = yolo_predict(yolo_model, [contexts[i].bgr for i in indices], contexts[indices[0]].options)
+                for i, image_boxes in zip(indices, boxes):
+                    results[i] = image_boxes
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        return [
+            format_yolo_detections(context.bgr, boxes, yolo_model.names, per_image_time, context.options)
+            for context, boxes in zip(contexts, results)
+        ]
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch YOLO detection error: {e}")
+        raise HTTPException(status_code=500, detail=f"YOLO detection failed: {str(e)}")
+
+def run_yolo_frames(frames: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+    """Run YOLO over video frames in one forward pass, detections only"""
+    yolo_model = models.get("yolo")
+    if yolo_model is None:
+        raise HTTPException(status_code=500, detail="YOLO model not loaded")
+
+    with phase("yolo", "inference"):
+        results = yolo_model(frames)
+    with phase("yolo", "postprocess"):
+        return [yolo_detections(yolo_boxes(boxes), yolo_model.names) for boxes in results.xyxy]
+
+def run_damage_segmentation_batch(contexts: List[ImageContext], start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run Mask R-CNN over a list of images, several images per forward pass"""
+    segmenter = models.get("damage_segmentation")
+    if segmenter is None:
+        raise HTTPException(status_code=500, detail="Damage segmentation model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        instances = []
+        for i in range(0, len(contexts), segmenter.batch_size):
+            images = [context.bgr for context in contexts[i:i + segmenter.batch_size]]
+            with phase("damage_segmentation", "inference"):
+                instances.extend(segmenter.predict(images))
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        return [
+            format_segmentation(context.bgr, image_instances, segmenter.class_names, per_image_time, context.options)
+            for context, image_instances in zip(contexts, instances)
+        ]
+
+    except Exception as e:
+        logger.error(f"Batch damage segmentation error: {e}")
+        raise HTTPException(status_code=500, detail=f"Damage segmentation failed: {str(e)}")
+
+def run_roboflow_detection_batch(contexts: List[ImageContext], start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run Roboflow on each image concurrently, the hosted API has no batch call"""
+    roboflow_model = models.get("roboflow")
+    if roboflow_model is None:
+        raise HTTPException(status_code=500, detail="Roboflow model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        images = [encode_for_roboflow(context.bgr) for context in contexts]
+        # Concurrent calls on the client's pool, up to its in-flight cap
+        with phase("roboflow", "inference"):
+            predictions = roboflow_model.predict_many(images, confidence=ROBOFLOW_CONFIDENCE,
+                                                      overlap=ROBOFLOW_OVERLAP)
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        return [
+            format_roboflow_detections(context.bgr, image_predictions, per_image_time, context.options)
+            for context, image_predictions in zip(contexts, predictions)
+        ]
+
+    except Exception as e:
+        logger.error(f"Batch Roboflow detection error: {e}")
+        raise HTTPException(status_code=500, detail=f"Roboflow detection failed: {str(e)}")
+
+async def run_damage_severity_batch(contexts: List[ImageContext], start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run the severity model over a stacked batch of images"""
+    damage_severity_model = await run_blocking(models.get, "damage_severity")
+    if damage_severity_model is None:
+        raise HTTPException(status_code=500, detail="Damage severity model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        image_batch = await run_blocking(stack_for_keras, contexts)
+        predictions = await run_inference("damage_severity", damage_severity_predict, image_batch)
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        return [format_severity(p, per_image_time) for p in predictions]
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch damage severity analysis error: {e}")
+        raise HTTPException(status_code=500, detail=f"Damage severity analysis failed: {str(e)}")
+
+def run_brand_detection_batch(contexts: List[ImageContext], start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run the brand pipeline over a list of images in one call"""
+    car_brand_pipeline = models.get("car_brand")
+    if car_brand_pipeline is None:
+        raise HTTPException(status_code=500, detail="Car brand model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        images = [context.pil for context in contexts]
+        with phase("car_brand", "inference"):
+            results = car_brand_pipeline(images, batch_size=len(contexts))
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        return [format_brand(r, per_image_time) for r in results]
+
+    except Exception as e:
+        logger.error(f"Batch brand detection error: {e}")
+        raise HTTPException(status_code=500, detail=f"Brand detection failed: {str(e)}")
+
+def run_damage_type_batch(contexts: List[ImageContext], start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run the damage type pipeline over a list of images in one call"""
+    damage_type_pipeline = models.get("damage_type")
+    if damage_type_pipeline is None:
+        raise HTTPException(status_code=500, detail="Damage type model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        images = [context.pil for context in contexts]
+        with phase("damage_type", "inference"):
+            results = damage_type_pipeline(images, batch_size=len(contexts))
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        return [format_damage_type(r, per_image_time) for r in results]
+
+    except Exception as e:
+        logger.error(f"Batch damage type detection error: {e}")
+        raise HTTPException(status_code=500, detail=f"Damage type detection failed: {str(e)}")
+
+def crop_regions(context: ImageContext, detections: List[Dict[str, Any]]) -> List[np.ndarray]:
+    """Model-input sized RGB crops of the detection boxes, sliced from the BGR decode without a full-frame copy"""
+    image = context.bgr
+    height, width = image.shape[:2]
+    crops = []
+    for detection in detections:
+        x1, y1, x2, y2 = detection["bbox"]
+        pad_x, pad_y = (x2 - x1) * CROP_PADDING, (y2 - y1) * CROP_PADDING
+        x1, y1 = min(max(0, int(x1 - pad_x)), width - 1), min(max(0, int(y1 - pad_y)), height - 1)
+        x2, y2 = max(min(width, int(x2 + pad_x)), x1 + 1), max(min(height, int(y2 + pad_y)), y1 + 1)
+        # Only the resized crop is converted to RGB
+        crops.append(cv2.cvtColor(cv2.resize(image[y1:y2, x1:x2], KERAS_INPUT.size), cv2.COLOR_BGR2RGB))
+    return crops
+
+def classify_damage_crops(crops: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+    """Damage type pipeline over every crop in one call"""
+    damage_type_pipeline = models.get("damage_type")
+    with phase("damage_type", "inference"):
+        return damage_type_pipeline([Image.fromarray(crop) for crop in crops], batch_size=len(crops))
+
+def format_regions(detections: List[Dict[str, Any]], severities: List[Dict[str, Any]],
+                   damage_types: List[Dict[str, Any]], processing_time: float) -> Dict[str, Any]:
+    """Build the per-detection severity and damage type result"""
+    return {
+        "regions": [
+            {
+                "detection_index": i,
+                "class": detection["class"],
+                "bbox": detection["bbox"],
+                "severity": severity["severity"],
+                "severity_confidence": severity["confidence"],
+                "damage_type": damage_type["primary_damage"],
+                "damage_type_confidence": damage_type["damage_types"][0]["confidence"] if damage_type["damage_types"] else 0.0
+            }
+            for i, (detection, severity, damage_type) in enumerate(zip(detections, severities, damage_types))
+        ],
+        "processing_time": processing_time
+    }
+
+async def run_damage_regions_batch(contexts: List[ImageContext], detection_results: List[Dict[str, Any]],
+                                   start_time: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Classify severity and damage type of every detected region.
+
+    The crops of all images go through each classifier as one batch.
+    """
+    if await run_blocking(models.get, "damage_severity") is None:
+        raise HTTPException(status_code=500, detail="Damage severity model not loaded")
+    if await run_blocking(models.get, "damage_type") is None:
+        raise HTTPException(status_code=500, detail="Damage type model not loaded")
+
+    try:
+        start_time = start_time or time.perf_counter()
+        per_image_crops = await asyncio.gather(*[
+            run_blocking(crop_regions, context, result["detections"])
+            for context, result in zip(contexts, detection_results)
+        ])
+        crops = [crop for image_crops in per_image_crops for crop in image_crops]
+
+        severities, damage_types = [], []
+        if crops:
+            severity_predictions, damage_type_results = await asyncio.gather(
+                run_inference("damage_severity", damage_severity_predict, np.stack(crops)),
+                run_inference("damage_type", classify_damage_crops, crops),
+            )
+            severities = [format_severity(p, 0.0) for p in severity_predictions]
+            damage_types = [format_damage_type(r, 0.0) for r in damage_type_results]
+
+        per_image_time = (time.perf_counter() - start_time) / len(contexts)
+        results, offset = [], 0
+        for result, image_crops in zip(detection_results, per_image_crops):
+            end = offset + len(image_crops)
+            results.append(format_regions(result["detections"], severities[offset:end], damage_types[offset:end],
+                                          per_image_time))
+            offset = end
+        return results
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Damage region classification error: {e}")
+        raise HTTPException(status_code=500, detail=f"Damage region classification failed: {str(e)}")
+
+def summarize_claim(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregate per-image complete analyses into a claim-level summary"""
+    severity_order = ["minor", "moderate", "severe"]
+    analyzed = [r for r in results if "error" not in r]
+    detections_by_class: Dict[str, int] = {}
+    damage_types: Dict[str, float] = {}
+    brand_votes: Dict[str, float] = {}
+    worst_severity = None
+
+    for result in analyzed:
+        for detection in result["detection"]["detections"]:
+            detections_by_class[detection["class"]] = detections_by_class.get(detection["class"], 0) + 1
+        for damage in result["damage_types"]["damage_types"]:
+            damage_types[damage["type"]] = max(damage_types.get(damage["type"], 0.0), damage["confidence"])
+        brand = result["brand"]["brand"]
+        brand_votes[brand] = brand_votes.get(brand, 0.0) + result["brand"]["confidence"]
+        severity = result["severity"]["severity"]
+        if severity in severity_order and (
+            worst_severity is None or severity_order.index(severity) > severity_order.index(worst_severity)
+        ):
+            worst_severity = severity
+
+    return {
+        "images_total": len(results),
+        "images_analyzed": len(analyzed),
+        "ai_generated_images": [i for i, r in enumerate(results) if "error" in r],
+        "total_detections": sum(detections_by_class.values()),
+        "detections_by_class": detections_by_class,
+        "damage_types": [
+            {"type": t, "confidence": c}
+            for t, c in sorted(damage_types.items(), key=lambda item: item[1], reverse=True)
+        ],
+        "brand": max(brand_votes, key=brand_votes.get) if brand_votes else "unknown",
+        "severity": worst_severity or "unknown"
+    }
+
+@app.post("/ai-check")
+async def check_ai_generated(request: Request):
+    """Check if image is AI-generated using GNet model"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    return with_timings(await run_stage("gnet", context, start_time), context.options)
+
+@app.post("/yolo-detect")
+async def yolo_detection(request: Request):
+    """Detect car damage using YOLO model"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    return with_timings(await run_stage("yolo", context, start_time), context.options)
+
+@app.post("/damage-regions")
+async def damage_regions(request: Request):
+    """Detect car damage, then classify the severity and damage type of each detection"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    detection = await run_stage(detection_model(context), context)
+    regions = await run_damage_regions(context, {"detection": detection})
+    return with_timings({
+        "detection": detection,
+        "regions": regions["regions"],
+        "processing_time": time.perf_counter() - start_time
+    }, context.options)
+
+@app.post("/damage-segmentation")
+async def damage_segmentation(request: Request):
+    """Segment damaged parts using the Mask R-CNN model"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    mask_format(context.options)
+    return with_timings(await run_stage("damage_segmentation", context, start_time), context.options)
+
+@app.post("/roboflow-detect")
+async def roboflow_detection(request: Request):
+    """Detect car damage using Roboflow model"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    return with_timings(await run_stage("roboflow", context, start_time), context.options)
+
+@app.post("/damage-severity")
+async def damage_severity_analysis(request: Request):
+    """Analyze damage severity using car-damage-model.h5"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    return with_timings(await run_stage("damage_severity", context, start_time), context.options)
+
+@app.post("/brand-detection")
+async def brand_detection(request: Request):
+    """Detect car brand using Hugging Face model"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    return with_timings(await run_stage("car_brand", context, start_time), context.options)
+
+@app.post("/damage-type")
+async def damage_type_detection(request: Request):
+    """Detect damage type using Hugging Face model"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    return with_timings(await run_stage("damage_type", context, start_time), context.options)
+
+def detection_model(context: ImageContext) -> str:
+    """Detector selected by the request's method option"""
+    return "yolo" if context.options.get("method", "yolo") == "yolo" else "roboflow"
+
+def no_detections(results: Dict[str, Dict[str, Any]]) -> Optional[str]:
+    """Skip reason for the damage classifiers when the detector found nothing"""
+    if not results["detection"]["detections"]:
+        return "no detections above the confidence threshold"
+    return None
+
+def skipped_damage_types(reason: str) -> Dict[str, Any]:
+    """/damage-type shaped result for a skipped stage"""
+    return {
+        "damage_types": [],
+        "primary_damage": "no_damage",
+        "skipped": reason,
+        "processing_time": 0.0,
+        "model_used": MODEL_IDS["damage_type"]
+    }
+
+def skipped_severity(reason: str) -> Dict[str, Any]:
+    """/damage-severity shaped result for a skipped stage, "unknown" like an unmapped class"""
+    return {
+        "severity": "unknown",
+        "confidence": 0.0,
+        "all_predictions": {},
+        "skipped": reason,
+        "processing_time": 0.0,
+        "model_used": "car-damage-model.h5"
+    }
+
+async def run_damage_regions(context: ImageContext, results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-detection severity and damage type for one image"""
+    return (await run_damage_regions_batch([context], [results["detection"]]))[0]
+
+def skipped_regions(reason: str) -> Dict[str, Any]:
+    """Per-detection result for a skipped stage"""
+    return {"regions": [], "skipped": reason, "processing_time": 0.0}
+
+# Stages of /complete-analysis. GNet gates everything, the detector starts
+# speculatively alongside it and the damage classifiers wait for detection
+ANALYSIS_GRAPH = StageGraph([
+    Stage("ai_check", lambda context, results: run_stage("gnet", context),
+          abort_if=lambda result: result["is_ai_generated"]),
+    Stage("detection", lambda context, results: run_stage(detection_model(context), context),
+          depends_on=("ai_check",)),
+    Stage("brand", lambda context, results: run_stage("car_brand", context),
+          depends_on=("ai_check",)),
+    Stage("damage_types", lambda context, results: run_stage("damage_type", context),
+          depends_on=("ai_check", "detection"), skip_if=no_detections, placeholder=skipped_damage_types),
+    Stage("severity", lambda context, results: run_stage("damage_severity", context),
+          depends_on=("ai_check", "detection"), skip_if=no_detections, placeholder=skipped_severity),
+    Stage("damage_regions", run_damage_regions,
+          depends_on=("ai_check", "detection"), skip_if=no_detections, placeholder=skipped_regions, optional=True),
+])
+
+def option_enabled(options: Dict[str, Any], key: str, default: bool = False) -> bool:
+    """Boolean request option, from JSON or from a form / query string"""
+    value = options.get(key)
+    if value is None:
+        return default
+    return str(value).lower() not in ("0", "false", "no", "off", "")
+
+def with_timings(result: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the request's per-phase breakdown (ms) when the caller asked for timings=true"""
+    if not option_enabled(options, "timings"):
+        return result
+    return {**result, "timings": metrics.request_timings()}
+
+def requested_stages(options: Dict[str, Any]) -> Optional[List[str]]:
+    """Stage subset from the `stages` option (list or comma-separated), None for the defaults.
+
+    per_detection=true adds the per-detection severity and damage type stage.
+    """
+    stages = options.get("stages")
+    if not stages:
+        if option_enabled(options, "per_detection"):
+            return ANALYSIS_GRAPH.default_names + ["damage_regions"]
+        return None
+    names = stages if isinstance(stages, list) else str(stages).split(",")
+    names = [str(name).strip() for name in names if str(name).strip()]
+    try:
+        ANALYSIS_GRAPH.resolve(names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return names
+
 @app.post("/complete-analysis")
-async def complete_analysis(request: Dict[str, Any]):
-    """Run complete analysis using all models"""
+async def complete_analysis(request: Request):
+    """Run complete analysis using all models, or the requested `stages`"""
+    start_time = time.perf_counter()
+
+    # Decode once and share the image across every stage
+    context = await read_request_image(request)
+    stages = requested_stages(context.options)
+
     try:
-        start_time = time.time()
-        
-        # Run all analyses
-        ai_check = await check_ai_generated(request)
-        
-        # Only proceed if image is authentic
-        if ai_check["is_ai_generated"]:
-            return {
+        run = await ANALYSIS_GRAPH.run(context, stages, option_enabled(context.options, "early_exit", EARLY_EXIT))
+
+        # Only report the other stages if image is authentic
+        if run.aborted_by == "ai_check":
+            return with_timings({
                 "error": "AI-generated image detected",
-                "ai_check": ai_check
-            }
-        
-        # Run detection based on method
-        method = request.get("method", "yolo")
-        if method == "yolo":
-            detection_result = await yolo_detection(request)
-        else:
-            detection_result = await roboflow_detection(request)
-        
-        # Run additional analyses
-        brand_result = await brand_detection(request)
-        damage_type_result = await damage_type_detection(request)
-        severity_result = await damage_severity_analysis(request)
-        
-        total_time = time.time() - start_time
-        
-        return {
-            "ai_check": ai_check,
-            "detection": detection_result,
-            "brand": brand_result,
-            "damage_types": damage_type_result,
-            "severity": severity_result,
+                "ai_check": run.results["ai_check"]
+            }, context.options)
+
+        total_time = time.perf_counter() - start_time
+
+        return with_timings({
+            **run.results,
+            "pipeline": run.summary(),
             "total_processing_time": total_time
-        }
-        
+        }, context.options)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Complete analysis error: {e}")
         raise HTTPException(status_code=500, detail=f"Complete analysis failed: {str(e)}")
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@app.post("/complete-analysis/stream")
+async def complete_analysis_stream(request: Request):
+    """Complete analysis as Server-Sent Events: a `stage` event per finished stage, then `summary`"""
+    start_time = time.perf_counter()
+    context = await read_request_image(request)
+    stages = requested_stages(context.options)
+    early_exit = option_enabled(context.options, "early_exit", EARLY_EXIT)
+    events: asyncio.Queue = asyncio.Queue()
+
+    def publish(stage: str, result: Dict[str, Any]):
+        events.put_nowait(("stage", {"stage": stage, "result": result, "elapsed": time.perf_counter() - start_time}))
+
+    async def analyze():
+        try:
+            run = await ANALYSIS_GRAPH.run(context, stages, early_exit, on_result=publish)
+            summary = {"pipeline": run.summary(), "total_processing_time": time.perf_counter() - start_time}
+            if run.aborted_by == "ai_check":
+                summary["error"] = "AI-generated image detected"
+            events.put_nowait(("summary", with_timings(summary, context.options)))
+        except HTTPException as e:
+            events.put_nowait(("error", {"status_code": e.status_code, "detail": e.detail}))
+        except Exception as e:
+            logger.error(f"Streaming analysis error: {e}")
+            events.put_nowait(("error", {"status_code": 500, "detail": f"Complete analysis failed: {str(e)}"}))
+
+    async def stream():
+        task = asyncio.ensure_future(analyze())
+        try:
+            while True:
+                event, data = await events.get()
+                yield sse_event(event, data)
+                if event != "stage":
+                    return
+        finally:
+            # The client went away: drop the stages that are still queued
+            if not task.done():
+                task.cancel()
+                logger.info(f"🛑 Client disconnected after {time.perf_counter() - start_time:.2f}s, analysis cancelled")
+            await asyncio.gather(task, return_exceptions=True)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def batch_response(results: List[Dict[str, Any]], start_time: float, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Wrap per-image batch results"""
+    return with_timings({
+        "results": results,
+        "count": len(results),
+        "processing_time": time.perf_counter() - start_time
+    }, options)
+
+@app.post("/ai-check/batch")
+async def check_ai_generated_batch(request: Request):
+    """Check a list of images for AI generation in one GNet pass"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+    return batch_response(await run_ai_check_batch(contexts, start_time), start_time, contexts[0].options)
+
+@app.post("/yolo-detect/batch")
+async def yolo_detection_batch(request: Request):
+    """Detect car damage on a list of images in one YOLO pass"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+    results = await run_inference("yolo", run_yolo_detection_batch, contexts, start_time)
+    return batch_response(results, start_time, contexts[0].options)
+
+@app.post("/damage-segmentation/batch")
+async def damage_segmentation_batch(request: Request):
+    """Segment damaged parts on a list of images, batched through Mask R-CNN"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+    mask_format(contexts[0].options)
+    results = await run_inference("damage_segmentation", run_damage_segmentation_batch, contexts, start_time)
+    return batch_response(results, start_time, contexts[0].options)
+
+@app.post("/roboflow-detect/batch")
+async def roboflow_detection_batch(request: Request):
+    """Detect car damage on a list of images using Roboflow"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+    results = await run_inference("roboflow", run_roboflow_detection_batch, contexts, start_time)
+    return batch_response(results, start_time, contexts[0].options)
+
+@app.post("/damage-severity/batch")
+async def damage_severity_analysis_batch(request: Request):
+    """Analyze damage severity on a list of images in one pass"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+    return batch_response(await run_damage_severity_batch(contexts, start_time), start_time, contexts[0].options)
+
+@app.post("/brand-detection/batch")
+async def brand_detection_batch(request: Request):
+    """Detect car brand on a list of images in one pipeline call"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+    results = await run_inference("car_brand", run_brand_detection_batch, contexts, start_time)
+    return batch_response(results, start_time, contexts[0].options)
+
+@app.post("/damage-type/batch")
+async def damage_type_detection_batch(request: Request):
+    """Detect damage type on a list of images in one pipeline call"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+    results = await run_inference("damage_type", run_damage_type_batch, contexts, start_time)
+    return batch_response(results, start_time, contexts[0].options)
+
+DETECTION_BATCH_STAGES = {
+    "yolo": run_yolo_detection_batch,
+    "roboflow": run_roboflow_detection_batch
+}
+
+async def run_detection_batch(contexts: List[ImageContext]) -> List[Dict[str, Any]]:
+    """Detection of a photo set with each photo's own method option, one batch per detector"""
+    groups: Dict[str, List[int]] = {}
+    for i, context in enumerate(contexts):
+        groups.setdefault(detection_model(context), []).append(i)
+    batches = await asyncio.gather(*(
+        run_inference(model, DETECTION_BATCH_STAGES[model], [contexts[i] for i in indices])
+        for model, indices in groups.items()
+    ))
+    detections: List[Dict[str, Any]] = [{}] * len(contexts)
+    for indices, batch in zip(groups.values(), batches):
+        for i, detection in zip(indices, batch):
+            detections[i] = detection
+    return detections
+
+async def run_complete_analysis_batch(contexts: List[ImageContext]) -> List[Dict[str, Any]]:
+    """Complete analysis of a photo set, one pass per model.
+
+    Options are read per photo, not from the first one, so a set gathered
+    from several requests is analysed the way each of them asked.
+    """
+    ai_checks = await run_ai_check_batch(contexts)
+
+    # Only authentic images go through the rest of the models
+    authentic = [i for i, ai_check in enumerate(ai_checks) if not ai_check["is_ai_generated"]]
+    authentic_contexts = [contexts[i] for i in authentic]
+
+    results: List[Dict[str, Any]] = [
+        {"error": "AI-generated image detected", "ai_check": ai_check}
+        for ai_check in ai_checks
+    ]
+
+    if authentic_contexts:
+        detections, brands, damage_types, severities = await asyncio.gather(
+            run_detection_batch(authentic_contexts),
+            run_inference("car_brand", run_brand_detection_batch, authentic_contexts),
+            run_inference("damage_type", run_damage_type_batch, authentic_contexts),
+            run_damage_severity_batch(authentic_contexts),
+        )
+
+        # Crops of the detections of every photo that asks for them, one classifier pass for the set
+        wanted = [j for j, context in enumerate(authentic_contexts) if option_enabled(context.options, "per_detection")]
+        regions: Dict[int, Dict[str, Any]] = {}
+        if wanted:
+            crops = await run_damage_regions_batch([authentic_contexts[j] for j in wanted],
+                                                   [detections[j] for j in wanted])
+            regions = dict(zip(wanted, crops))
+
+        for j, i in enumerate(authentic):
+            results[i] = {
+                "ai_check": ai_checks[i],
+                "detection": detections[j],
+                "brand": brands[j],
+                "damage_types": damage_types[j],
+                "severity": severities[j]
+            }
+            if j in regions:
+                results[i]["damage_regions"] = regions[j]
+    return results
+
+@app.post("/complete-analysis/batch")
+async def complete_analysis_batch(request: Request):
+    """Run complete analysis on a claim's photo set, one pass per model"""
+    start_time = time.perf_counter()
+    contexts = await read_request_images(request)
+
+    try:
+        results = await run_complete_analysis_batch(contexts)
+        return with_timings({
+            "results": results,
+            "summary": summarize_claim(results),
+            "total_processing_time": time.perf_counter() - start_time
+        }, contexts[0].options)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch complete analysis error: {e}")
+        raise HTTPException(status_code=500, detail=f"Complete analysis failed: {str(e)}")
+
+@app.post("/video-analysis")
+async def video_analysis(request: Request):
+    """Track car damage through a walk-around video or frame sequence, each damage reported once"""
+    try:
+        async with video.frame_source(request) as (options, source):
+            result = await video.analyze_frames(
+                source, lambda frames: run_inference("yolo", run_yolo_frames, frames), options)
+        return with_timings({**result, "model_used": "best.pt"}, options)
+    except HTTPException:
+        # Bad uploads (400/413) and admission errors keep their status
+        raise
+    except Exception as e:
+        logger.error(f"Video analysis error: {e}")
+        raise HTTPException(status_code=500, detail=f"Video analysis failed: {str(e)}")
+
+# Tasks a job can run, each turns a batch of images into one result per image
+JOB_TASKS: Dict[str, jobs.Task] = {
+    "complete-analysis": run_complete_analysis_batch,
+    "ai-check": run_ai_check_batch,
+    "yolo-detect": partial(run_inference, "yolo", run_yolo_detection_batch),
+    "damage-segmentation": partial(run_inference, "damage_segmentation", run_damage_segmentation_batch),
+    "roboflow-detect": partial(run_inference, "roboflow", run_roboflow_detection_batch),
+    "damage-severity": run_damage_severity_batch,
+    "brand-detection": partial(run_inference, "car_brand", run_brand_detection_batch),
+    "damage-type": partial(run_inference, "damage_type", run_damage_type_batch)
+}
+# Request options that don't change a job's results
+JOB_TRANSIENT_OPTIONS = ("deadline_ms", "timings")
+
+job_queue = jobs.create_job_queue()
+job_workers = jobs.JobWorkers(job_queue, JOB_TASKS)
+
+def store_job_images(contexts: List[ImageContext], images: List[bytes]):
+    """Write a job's uploads to the queue's image store"""
+    for context, image in zip(contexts, images):
+        job_queue.put_image(context.image_hash, image)
+
+def job_links(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job status with the URLs to poll and subscribe to it"""
+    return {**job, "status_url": f"/jobs/{job['job_id']}", "events_url": f"/jobs/{job['job_id']}/events"}
+
+async def find_job(job_id: str, results: bool = True) -> Dict[str, Any]:
+    """Job status and results, 404 when the job doesn't exist or has expired"""
+    job = await run_blocking(job_queue.get, job_id, results)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if results and job["task"] == "complete-analysis" and job["status"] == "done":
+        job["summary"] = summarize_claim([item["result"] for item in job["results"] if item["status"] == "done"])
+    return job
+
+@app.post("/jobs")
+async def submit_job(request: Request, response: Response):
+    """Queue a photo set for background processing with `task` (default complete-analysis), returns the job id"""
+    with phase("request", "parse"):
+        options, images = await parse_image_request(request)
+    task = options.pop("task", "complete-analysis")
+    if task not in JOB_TASKS:
+        raise HTTPException(status_code=400, detail=f"Unknown task {task}, expected one of {', '.join(JOB_TASKS)}")
+    if not images:
+        raise HTTPException(status_code=400, detail="No images provided")
+    if len(images) > jobs.MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Too many images, the limit is {jobs.MAX_IMAGES}")
+    options = {key: value for key, value in options.items() if key not in JOB_TRANSIENT_OPTIONS}
+    # Results are stored, so previews are off unless asked for, and links would not outlive the process
+    options.setdefault("annotation", "none")
+    if annotation_settings(options)[0] == "url":
+        raise HTTPException(status_code=400, detail="annotation=url is not available for jobs, use inline or none")
+    tiling_settings(options)
+
+    # Bad uploads are rejected now rather than failing in the background
+    contexts = await asyncio.gather(*[run_blocking(image_context_from_bytes, image, options) for image in images])
+    image_hashes = [context.image_hash for context in contexts]
+    key = request.headers.get("idempotency-key") or jobs.idempotency_key(task, options, image_hashes)
+    try:
+        await run_blocking(store_job_images, contexts, images)
+        job, created = await run_blocking(job_queue.submit, task, options, image_hashes, key)
+    except Exception as e:
+        logger.error(f"Job submission error: {e}")
+        raise HTTPException(status_code=500, detail=f"Job submission failed: {str(e)}")
+
+    if created:
+        job_workers.notify()
+        logger.info(f"📮 Job {job['job_id']} queued: {task}, {len(images)} images")
+    response.status_code = 202 if created else 200
+    response.headers["Location"] = f"/jobs/{job['job_id']}"
+    return job_links(job)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, results: bool = True):
+    """Status, progress and per-image results of a job"""
+    return job_links(await find_job(job_id, results))
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events: `progress` whenever more images finish, then `done` with the results"""
+    job = await find_job(job_id, results=False)
+
+    async def stream():
+        progress = None
+        current = job
+        while True:
+            if current["status"] in jobs.FINISHED_STATES:
+                yield sse_event("done", job_links(await find_job(job_id)))
+                return
+            if current["progress"] != progress:
+                progress = current["progress"]
+                yield sse_event("progress", job_links(current))
+            await asyncio.sleep(jobs.POLL_SECONDS)
+            if await request.is_disconnected():
+                return
+            # Read from the store, another worker process may be running the job
+            current = await run_blocking(job_queue.get, job_id, False)
+            if current is None:
+                yield sse_event("error", {"detail": "Job expired"})
+                return
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel the unfinished images of a job, finished ones keep their results"""
+    job = await run_blocking(job_queue.cancel, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_links(job)
+
+@app.get("/annotations/{annotation_id}")
+async def get_annotation(annotation_id: str):
+    """Annotated JPEG returned by a detection call made with annotation=url"""
+    jpeg = annotation_store.get(annotation_id)
+    if jpeg is None:
+        raise HTTPException(status_code=404, detail="Annotation not found or expired")
+    return Response(content=jpeg, media_type="image/jpeg")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit/miss counters and size"""
+    return result_cache.stats()
+
+@app.delete("/cache")
+async def clear_cache():
+    """Drop every cached result"""
+    await run_blocking(result_cache.clear)
+    return {"cleared": True}
+
+def service_gauges() -> List[metrics.Gauge]:
+    """Model and cache state, read at scrape time"""
+    load_seconds = metrics.Gauge("ai_service_model_load_seconds", "Duration of the last model load", ("model",))
+    loaded = metrics.Gauge("ai_service_model_loaded", "1 if the model is in memory", ("model",))
+    for name, status in models.status().items():
+        loaded.set(1.0 if status["loaded"] else 0.0, name)
+        if status["load_time"] is not None:
+            load_seconds.set(status["load_time"], name)
+
+    stats = result_cache.stats()
+    cache_events = metrics.Gauge("ai_service_result_cache_events_total", "Result cache lookups and evictions",
+                                 ("event",), kind="counter")
+    for event in ("hits", "disk_hits", "misses", "evictions", "invalidations"):
+        cache_events.set(stats.get(event, 0), event)
+    cache_bytes = metrics.Gauge("ai_service_result_cache_bytes", "Bytes held by the in-memory result cache")
+    cache_bytes.set(stats.get("bytes", 0))
+    rss = metrics.Gauge("ai_service_process_rss_bytes", "Resident set size of this worker")
+    rss.set(process_rss_bytes())
+    pss = metrics.Gauge("ai_service_process_pss_bytes", "Proportional set size, shared weights split between workers")
+    pss.set(process_memory()["pss"])
+
+    queued = metrics.Gauge("ai_service_queued_calls", "Calls waiting for a model slot or a batch", ("model",))
+    for name, waiting in queued_calls().items():
+        queued.inc(name, amount=waiting)
+    for batcher in (gnet_batcher, damage_severity_batcher):
+        queued.inc(batcher.model_name, amount=batcher.queued)
+    lane_in_flight = metrics.Gauge("ai_service_lane_in_flight", "Admitted requests per priority lane", ("lane",))
+    for lane, count in admission.stats()["in_flight"].items():
+        lane_in_flight.set(count, lane)
+    job_images = metrics.Gauge("ai_service_job_images", "Images of queued jobs by state", ("status",))
+    for status, count in job_queue.stats()["images"].items():
+        job_images.set(count, status)
+    return [load_seconds, loaded, cache_events, cache_bytes, rss, pss, queued, lane_in_flight, job_images]
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Latency histograms, batch sizes and model state in the Prometheus text format"""
+    body = await run_blocking(lambda: metrics.render(service_gauges()))
+    return Response(content=body, media_type="text/plain; version=0.0.4")
+
+def require_profiler():
+    if not metrics.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler disabled, set PROFILER_ENABLED=1")
+
+@app.get("/debug/profiler")
+async def profiler_status():
+    """Whether the sampling profiler is running and how many samples it holds"""
+    require_profiler()
+    return metrics.profiler.status()
+
+@app.post("/debug/profiler/start")
+async def profiler_start(interval_ms: float = 5.0):
+    """Start sampling every thread's stack"""
+    require_profiler()
+    metrics.profiler.start(interval_ms)
+    return metrics.profiler.status()
+
+@app.post("/debug/profiler/stop")
+async def profiler_stop():
+    """Stop sampling, returns collapsed stacks for flamegraph.pl or speedscope"""
+    require_profiler()
+    return Response(content=metrics.profiler.stop(), media_type="text/plain")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "models_loaded": {
-            "gnet": gnet_model is not None,
-            "yolo": yolo_model is not None,
-            "damage_severity": damage_severity_model is not None,
-            "roboflow": roboflow_model is not None,
-            "car_brand": car_brand_pipeline is not None,
-            "damage_type": damage_type_pipeline is not None
-        }
+        "models_loaded": {name: models.is_loaded(name) for name in models.names},
+        "loading_mode": LOADING_MODE,
+        "models": models.status(),
+        "admission": {**admission.stats(), "queued": queued_calls()},
+        "jobs": {"workers": jobs.WORKERS if job_workers.running else 0, "images_processed": job_workers.processed},
+        "process_rss_bytes": process_rss_bytes(),
+        "worker": {"id": os.getenv("SERVE_WORKER_ID"), "pid": os.getpid(), "memory": process_memory()}
     }
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # One process by default, SERVE_WORKERS forks workers that share the weights
+    import serving
+    serving.serve(sys.modules[__name__])
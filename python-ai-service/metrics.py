@@ -0,0 +1,272 @@
+"""Hot-path instrumentation, Prometheus exposition and a sampling profiler.
+
+`phase(model, name)` times a block with `time.perf_counter`. The time goes
+into a per-model, per-phase histogram. It is also added to the current
+request's breakdown, which a client can get back with `timings=true`. The
+breakdown lives in a context variable. Work submitted through `inference`
+runs in a copy of the caller's context, so phases timed on the executor
+still reach the right request.
+
+Metrics are kept in-process and rendered in the Prometheus text format by
+`render()`, without a client library. `SamplingProfiler` samples every
+thread's stack and returns collapsed stacks for flame graphs. It is off
+until started at runtime.
+
+Configuration (environment variables):
+    METRICS_ENABLED   1 (default) to record metrics, 0 to turn the instrumentation into no-ops
+    PROFILER_ENABLED  1 to expose the /debug/profiler endpoints (default 0)
+"""
+import bisect
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+
+# Seconds, from sub-millisecond decodes to multi-second cold inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Labelled cumulative histogram"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: (list(s[0]), s[1], s[2]) for labels, s in self._series.items()}
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """Labelled value that can go up and down"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), kind: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+PHASE_SECONDS = Histogram("ai_service_phase_seconds", "Time spent in each processing phase", ("model", "phase"))
+REQUEST_SECONDS = Histogram("ai_service_request_seconds", "End-to-end request latency", ("endpoint", "status"))
+REQUESTS_IN_FLIGHT = Gauge("ai_service_requests_in_flight", "Requests currently being handled")
+BATCH_SIZE = Histogram("ai_service_batch_size", "Images per model forward pass", ("model",),
+                       buckets=(1, 2, 4, 8, 16, 32, 64))
+ADMISSION_REJECTED = Gauge("ai_service_admission_rejected_total", "Requests refused or dropped by admission control",
+                           ("reason",), kind="counter")
+
+_METRICS = [PHASE_SECONDS, REQUEST_SECONDS, REQUESTS_IN_FLIGHT, BATCH_SIZE, ADMISSION_REJECTED]
+
+
+def start_request_timings() -> contextvars.Token:
+    """Start collecting the phase breakdown of the current request"""
+    return _request_timings.set({})
+
+
+def end_request_timings(token: contextvars.Token):
+    _request_timings.reset(token)
+
+
+def request_timings() -> Dict[str, float]:
+    """Milliseconds per `model.phase` recorded so far in this request"""
+    timings = _request_timings.get() or {}
+    return {key: round(value * 1000, 3) for key, value in timings.items()}
+
+
+def record(model: str, name: str, seconds: float):
+    """Add an already measured phase"""
+    if not METRICS_ENABLED:
+        return
+    PHASE_SECONDS.observe(seconds, model, name)
+    timings = _request_timings.get()
+    if timings is not None:
+        key = f"{model}.{name}"
+        timings[key] = timings.get(key, 0.0) + seconds
+
+
+@contextmanager
+def phase(model: str, name: str) -> Iterator[None]:
+    """Time the enclosed block as `name` of `model`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(model, name, time.perf_counter() - start)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording the phase breakdown, in-flight gauge and latency of every request.
+
+    A request counts as in flight until its response has been sent, so a
+    streamed response is measured to its last event.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = start_request_timings()
+        REQUESTS_IN_FLIGHT.inc()
+        start_time = time.perf_counter()
+        status = "500"
+
+        async def send_with_status(message: Dict[str, Any]):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Label by route template so /annotations/{annotation_id} is one series
+            route = scope.get("route")
+            REQUESTS_IN_FLIGHT.dec()
+            if METRICS_ENABLED:
+                REQUEST_SECONDS.observe(time.perf_counter() - start_time, getattr(route, "path", scope["path"]), status)
+            end_request_timings(token)
+
+
+def render(extra: Iterable[Gauge] = ()) -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in list(_METRICS) + list(extra):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread at a fixed interval"""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._stacks: StackCounter = StackCounter()
+        self._lock = threading.Lock()
+        self.interval = 0.005
+        self.samples = 0
+        self.started_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float = 5.0):
+        if self.running:
+            return
+        self.interval = max(0.001, interval_ms / 1000)
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Stop sampling, returns the collapsed stacks (`frame;frame;frame count` per line)"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+    def status(self) -> Dict[str, Any]:
+        return {"running": self.running, "interval_ms": self.interval * 1000, "samples": self.samples,
+                "started_at": self.started_at}
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    self._stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,223 @@
+"""Model registry with eager, lazy and preload-subset loading.
+
+Models are registered with a loader function and fetched with `get()`.
+Depending on `MODEL_LOADING` they are loaded at startup in parallel
+("eager", the default), on their first request ("lazy"), or lazily except
+for the `MODEL_PRELOAD` subset. Models idle for longer than
+`MODEL_IDLE_TTL` seconds are evicted and reloaded on the next request.
+A model that holds resources garbage collection won't free (threads,
+connection pools) is registered with a `close` function, called when it
+is unloaded.
+
+Configuration (environment variables):
+    MODEL_LOADING         "eager" (default) or "lazy"
+    MODEL_PRELOAD         comma-separated models to load at startup in lazy mode
+    MODEL_IDLE_TTL        seconds before an unused model is evicted (0 = never, default)
+    MODEL_RETRY_SECONDS   minimum delay before retrying a failed load (default 60)
+"""
+import gc
+import logging
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LOADING_MODE = os.getenv("MODEL_LOADING", "eager").lower()
+PRELOAD = [name.strip() for name in os.getenv("MODEL_PRELOAD", "").split(",") if name.strip()]
+IDLE_TTL = float(os.getenv("MODEL_IDLE_TTL", "0"))
+RETRY_SECONDS = float(os.getenv("MODEL_RETRY_SECONDS", "60"))
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak rather than current RSS, kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_memory(pid: str = "self") -> Dict[str, int]:
+    """RSS, PSS and shared/private bytes of a process, from /proc/<pid>/smaps_rollup.
+
+    PSS splits pages shared with other processes (weights inherited through
+    fork) between them, so PSS summed over workers is their real footprint.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    memory = {"rss": 0, "pss": 0, "shared": 0, "private": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    memory[fields[key]] += int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        memory["rss"] = process_rss_bytes() if pid == "self" else 0
+    return memory
+
+
+def model_weight_bytes(model: Any) -> Optional[int]:
+    """Size of a model's weights, for Keras, PyTorch and HF pipelines"""
+    module = getattr(model, "model", model)  # HF pipelines wrap the module
+    try:
+        if hasattr(module, "parameters"):
+            return sum(p.numel() * p.element_size() for p in module.parameters())
+        if hasattr(module, "weights"):
+            return sum(int(w.numpy().nbytes) for w in module.weights)
+    except Exception:
+        pass
+    return None
+
+
+class ModelEntry:
+    """Registration and runtime state of one model"""
+
+    def __init__(self, name: str, loader: Callable[[], Any], close: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.loader = loader
+        self.close = close
+        self.model = None
+        self.lock = threading.Lock()
+        self.load_time: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.last_used: Optional[float] = None
+        self.last_failure: Optional[float] = None
+        self.rss_delta: Optional[int] = None
+        self.weight_bytes: Optional[int] = None
+        self.loads = 0
+        self.evictions = 0
+
+
+class ModelRegistry:
+    """Thread-safe on-demand model loading with idle eviction"""
+
+    def __init__(self, idle_ttl: float = IDLE_TTL, retry_seconds: float = RETRY_SECONDS):
+        self.idle_ttl = idle_ttl
+        self.retry_seconds = retry_seconds
+        self._entries: Dict[str, ModelEntry] = {}
+
+    def register(self, name: str, loader: Callable[[], Any], close: Optional[Callable[[Any], None]] = None):
+        """Register `loader`, which returns the model or None when unavailable, and `close`, called on unload"""
+        self._entries[name] = ModelEntry(name, loader, close)
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._entries)
+
+    def is_loaded(self, name: str) -> bool:
+        return self._entries[name].model is not None
+
+    def get(self, name: str) -> Optional[Any]:
+        """The loaded model, loading it first if needed (blocks during the load)"""
+        entry = self._entries[name]
+        entry.last_used = time.time()
+        if entry.model is not None:
+            return entry.model
+        return self._load(entry)
+
+    def load(self, name: str) -> Optional[Any]:
+        """Load `name` now, ignoring the failure back-off"""
+        entry = self._entries[name]
+        entry.last_failure = None
+        return self._load(entry)
+
+    def load_all(self, names: Optional[Iterable[str]] = None, parallel: bool = True):
+        """Load several models, independent models load concurrently"""
+        names = list(names if names is not None else self._entries)
+        if not parallel or len(names) < 2:
+            for name in names:
+                self.load(name)
+            return
+        with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="model-load") as pool:
+            list(pool.map(self.load, names))
+
+    def startup_models(self) -> List[str]:
+        """Models to load at startup for the configured mode"""
+        if LOADING_MODE == "lazy":
+            return [name for name in PRELOAD if name in self._entries]
+        return self.names
+
+    def unload(self, name: str):
+        """Drop a model, it reloads on its next request.
+
+        Calls already holding a reference finish with the old model.
+        """
+        entry = self._entries[name]
+        with entry.lock:
+            model = entry.model
+            if model is None:
+                return
+            entry.model = None
+            entry.evictions += 1
+        if entry.close is not None:
+            try:
+                entry.close(model)
+            except Exception as e:
+                logger.error(f"❌ Error closing {name}: {e}")
+        del model
+        gc.collect()
+        logger.info(f"💤 Unloaded {name}")
+
+    def evict_idle(self) -> List[str]:
+        """Unload models unused for longer than the idle TTL"""
+        if self.idle_ttl <= 0:
+            return []
+        now = time.time()
+        evicted = []
+        for name, entry in self._entries.items():
+            if entry.model is not None and now - (entry.last_used or entry.loaded_at or now) > self.idle_ttl:
+                self.unload(name)
+                evicted.append(name)
+        return evicted
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Per-model load state, timings and memory"""
+        return {
+            name: {
+                "loaded": entry.model is not None,
+                "load_time": entry.load_time,
+                "loaded_at": entry.loaded_at,
+                "last_used": entry.last_used,
+                "weight_bytes": entry.weight_bytes,
+                "rss_delta_bytes": entry.rss_delta,
+                "loads": entry.loads,
+                "evictions": entry.evictions
+            }
+            for name, entry in self._entries.items()
+        }
+
+    def _load(self, entry: ModelEntry) -> Optional[Any]:
+        with entry.lock:
+            if entry.model is not None:
+                return entry.model
+            if entry.last_failure is not None and time.time() - entry.last_failure < self.retry_seconds:
+                return None
+
+            rss_before = process_rss_bytes()
+            start_time = time.perf_counter()
+            try:
+                model = entry.loader()
+            except Exception as e:
+                logger.error(f"❌ Error loading {entry.name}: {e}")
+                model = None
+
+            if model is None:
+                entry.last_failure = time.time()
+                return None
+
+            entry.load_time = time.perf_counter() - start_time
+            # RSS deltas overlap when models load in parallel, weight_bytes does not
+            entry.rss_delta = process_rss_bytes() - rss_before
+            entry.weight_bytes = model_weight_bytes(model)
+            entry.loaded_at = entry.last_used = time.time()
+            entry.last_failure = None
+            entry.loads += 1
+            entry.model = model
+            logger.info(f"⏱️ {entry.name} loaded in {entry.load_time:.1f}s")
+            return model
@@ -0,0 +1,168 @@
+"""Declarative stage graph for the composite analysis endpoint.
+
+Each stage names the stages it depends on. It can also declare a skip
+condition over their results (with a placeholder result to return
+instead) and an abort condition over its own result, which makes it a
+gate. Stages start as soon as their dependencies finish. A speculative
+stage does not wait for gates it depends on before it starts, but its
+result is only recorded and reported once they pass, and it is cancelled
+if a gate trips. Optional stages only run when requested. Callers can request a
+subset of stages. Dependencies are pulled in automatically. An `on_result`
+callback sees each result, or placeholder, as soon as its stage settles,
+so callers can stream partial results.
+
+Configuration (environment variables):
+    PIPELINE_EARLY_EXIT   1 (default) to honor skip conditions, 0 to always run every stage
+    PIPELINE_SPECULATIVE  comma-separated stages started alongside the gates (default detection)
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+EARLY_EXIT = os.getenv("PIPELINE_EARLY_EXIT", "1") == "1"
+SPECULATIVE_STAGES = {name.strip() for name in os.getenv("PIPELINE_SPECULATIVE", "detection").split(",") if name.strip()}
+
+
+class GateTripped(Exception):
+    """A gate stage's abort condition held, the remaining stages are cancelled"""
+
+    def __init__(self, stage: str):
+        super().__init__(stage)
+        self.stage = stage
+
+
+class Stage:
+    """One node of the graph"""
+
+    def __init__(self, name: str, run: Callable[[Any, Dict[str, Dict[str, Any]]], Awaitable[Dict[str, Any]]],
+                 depends_on: Iterable[str] = (),
+                 skip_if: Optional[Callable[[Dict[str, Dict[str, Any]]], Optional[str]]] = None,
+                 placeholder: Optional[Callable[[str], Dict[str, Any]]] = None,
+                 abort_if: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 speculative: Optional[bool] = None, optional: bool = False):
+        self.name = name
+        self.run = run  # called with the context and the results so far
+        self.depends_on = tuple(depends_on)
+        self.skip_if = skip_if  # returns the skip reason, or None to run
+        self.placeholder = placeholder or (lambda reason: {"skipped": reason})
+        self.abort_if = abort_if
+        self.speculative = name in SPECULATIVE_STAGES if speculative is None else speculative
+        self.optional = optional
+
+
+class PipelineRun:
+    """Outcome of one pass over the graph"""
+
+    def __init__(self):
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.skipped: Dict[str, str] = {}
+        self.cancelled: List[str] = []
+        self.aborted_by: Optional[str] = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "ran": [name for name in self.results if name not in self.skipped],
+            "skipped": self.skipped,
+            "cancelled": self.cancelled,
+            "aborted_by": self.aborted_by
+        }
+
+
+class StageGraph:
+    """Runs a set of stages concurrently in dependency order"""
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            missing = [d for d in stage.depends_on if d not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages: {', '.join(missing)}")
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.stages)
+
+    @property
+    def default_names(self) -> List[str]:
+        """Stages run when the caller does not pick a subset"""
+        return [name for name, stage in self.stages.items() if not stage.optional]
+
+    def resolve(self, requested: Optional[Iterable[str]] = None) -> List[str]:
+        """Requested stages plus their dependencies, in declaration order"""
+        if requested is None:
+            return self.default_names
+        requested = list(requested)
+        unknown = [name for name in requested if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(unknown)}. Available: {', '.join(self.names)}")
+
+        selected = set()
+        pending = list(requested)
+        while pending:
+            name = pending.pop()
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.stages[name].depends_on)
+        return [name for name in self.names if name in selected]
+
+    async def run(self, context: Any, requested: Optional[Iterable[str]] = None,
+                  early_exit: bool = EARLY_EXIT,
+                  on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> PipelineRun:
+        """Run the selected stages on `context`, stopping early if a gate trips.
+
+        Cancelling the call cancels every stage that has not finished.
+        """
+        outcome = PipelineRun()
+        selected = self.resolve(requested)
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> None:
+            gates = [
+                tasks[name] for name in stage.depends_on
+                if stage.speculative and self.stages[name].abort_if is not None
+            ]
+            waits = [tasks[name] for name in stage.depends_on if tasks[name] not in gates]
+            if waits:
+                await asyncio.gather(*waits)
+
+            reason = stage.skip_if(outcome.results) if early_exit and stage.skip_if else None
+            if reason is not None:
+                outcome.skipped[stage.name] = reason
+                outcome.results[stage.name] = stage.placeholder(reason)
+                if on_result is not None:
+                    on_result(stage.name, outcome.results[stage.name])
+                return
+
+            result = await stage.run(context, outcome.results)
+            if gates:
+                # Held back until the gates pass, a tripped gate re-raises here
+                await asyncio.gather(*gates)
+            outcome.results[stage.name] = result
+            if on_result is not None:
+                on_result(stage.name, result)
+            if stage.abort_if is not None and stage.abort_if(result):
+                raise GateTripped(stage.name)
+
+        for name in selected:
+            tasks[name] = asyncio.ensure_future(run_stage(self.stages[name]))
+
+        pending = set(tasks.values())
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if task.exception() is not None:
+                        raise task.exception()
+        except GateTripped as gate:
+            outcome.aborted_by = gate.stage
+        finally:
+            for name, task in tasks.items():
+                if not task.done():
+                    task.cancel()
+                    outcome.cancelled.append(name)
+            # Also retrieves the exceptions of dependents that re-raised a gate
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        # Results in declaration order
+        outcome.results = {name: outcome.results[name] for name in selected if name in outcome.results}
+        return outcome
@@ -0,0 +1,252 @@
+"""Shared image decoding and model input preparation.
+
+`ImageContext` is the single decode path of a request. Every view is built
+lazily, and only once. The full-resolution image is decoded only for the
+stages that report pixel coordinates: detection, segmentation, region
+crops and annotations. The fixed-size classifiers read `reduced` instead.
+For JPEGs it is decoded straight at 1/2, 1/4 or 1/8 scale with the
+decoder's DCT scaling, which is several times faster than a full decode
+and never materializes the 12 MP array.
+
+An `InputSpec` describes a model input: size, scale, mean and std. Models
+with the same spec share the resized uint8 view of an image. Conversion
+to float32 happens once per batch, in place, into a buffer taken from a
+`BufferPool`. The old path made a float64 temporary per request, and the
+framework then cast it again.
+
+Configuration (environment variables):
+    PREPROCESS_REDUCED_DECODE  1 (default) to decode classifier inputs at reduced resolution, 0 for full decodes
+    PREPROCESS_MIN_SIDE        shortest side kept by the reduced decode (default 448)
+"""
+import base64
+import io
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from metrics import phase
+from result_cache import hash_image_bytes
+
+REDUCED_DECODE = os.getenv("PREPROCESS_REDUCED_DECODE", "1") == "1"
+REDUCED_MIN_SIDE = int(os.getenv("PREPROCESS_MIN_SIDE", "448"))
+
+# EXIF orientation is ignored, like the PIL header `size` and the PIL fallback
+# decode, so every view and every box is in stored-pixel coordinates
+DECODE_FLAGS = cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION
+_REDUCED_FLAGS = {factor: flag | cv2.IMREAD_IGNORE_ORIENTATION for factor, flag in
+                  {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}.items()}
+
+
+def pil_to_cv2(pil_image: Image.Image) -> np.ndarray:
+    """Convert PIL image to OpenCV format"""
+    return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+
+
+def reduction_factor(width: int, height: int, min_side: int) -> int:
+    """Largest decoder scale-down (1, 2, 4 or 8) that keeps both sides >= `min_side`"""
+    for factor in (8, 4, 2):
+        if min(width, height) // factor >= min_side:
+            return factor
+    return 1
+
+
+class ImageContext:
+    """Decoded views of one uploaded image, shared by every stage of a request
+
+    Pixel decoding is deferred until a stage first needs the pixels, so a
+    request answered entirely from the result cache never decodes the image.
+    `options` carries the request's non-image fields (method, annotation...).
+    """
+
+    def __init__(self, image_bgr: Optional[np.ndarray] = None, data: Optional[bytes] = None,
+                 image_hash: Optional[str] = None, options: Optional[Dict[str, Any]] = None,
+                 size: Optional[Tuple[int, int]] = None):
+        self._bgr = image_bgr
+        self._data = data
+        self.image_hash = image_hash
+        self.options = options or {}
+        # (width, height) of the full image
+        self.size = size or ((image_bgr.shape[1], image_bgr.shape[0]) if image_bgr is not None else None)
+        self._rgb = None
+        self._reduced = None
+        self._pil = None
+        self._resized = {}
+        self._decode_lock = threading.Lock()
+        self._reduced_lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Locks don't pickle, the copy gets its own
+        state = self.__dict__.copy()
+        del state["_decode_lock"], state["_reduced_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._decode_lock = threading.Lock()
+        self._reduced_lock = threading.Lock()
+
+    @classmethod
+    def from_base64(cls, base64_string: str, options: Optional[Dict[str, Any]] = None) -> "ImageContext":
+        """Wrap a base64 image, pixels decode on first use"""
+        return cls.from_bytes(base64.b64decode(base64_string), options)
+
+    @classmethod
+    def from_bytes(cls, image_data: bytes, options: Optional[Dict[str, Any]] = None) -> "ImageContext":
+        """Wrap encoded image bytes, only the header is parsed here to reject bad uploads"""
+        size = Image.open(io.BytesIO(image_data)).size
+        return cls(data=image_data, image_hash=hash_image_bytes(image_data), options=options, size=size)
+
+    @property
+    def bgr(self) -> np.ndarray:
+        """OpenCV (BGR) array, decoded once straight from the request buffer"""
+        if self._bgr is None:
+            with self._decode_lock:
+                if self._bgr is None:
+                    with phase("image", "decode"):
+                        image = cv2.imdecode(np.frombuffer(self._data, dtype=np.uint8), DECODE_FLAGS)
+                        if image is None:
+                            # Formats OpenCV can't read (e.g. GIF) go through PIL
+                            image = pil_to_cv2(Image.open(io.BytesIO(self._data)).convert("RGB"))
+                    self._bgr = image
+                    self._data = None
+        return self._bgr
+
+    @property
+    def rgb(self) -> np.ndarray:
+        """RGB view of the image"""
+        if self._rgb is None:
+            image = self.bgr
+            with phase("image", "to_rgb"):
+                self._rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    @property
+    def reduced(self) -> np.ndarray:
+        """RGB image with its shortest side at least PREPROCESS_MIN_SIDE, for the classifiers"""
+        if self._reduced is None:
+            with self._reduced_lock:
+                if self._reduced is None:
+                    self._reduced = self._decode_reduced()
+        return self._reduced
+
+    def _decode_reduced(self) -> np.ndarray:
+        width, height = self.size
+        factor = reduction_factor(width, height, REDUCED_MIN_SIDE) if REDUCED_DECODE else 1
+        if factor == 1:
+            return self.rgb
+
+        data = self._data  # cleared by a concurrent full decode
+        image = None
+        if self._bgr is None and data is not None:
+            with phase("image", "decode_reduced"):
+                image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_FLAGS[factor])
+        if image is None:
+            # Already decoded, or a format OpenCV can't read
+            full = self.bgr
+            with phase("image", "resize"):
+                size = (full.shape[1] // factor, full.shape[0] // factor)
+                image = cv2.resize(full, size, interpolation=cv2.INTER_AREA)
+        with phase("image", "to_rgb"):
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    @property
+    def pil(self) -> Image.Image:
+        """PIL view of the image for the Hugging Face pipelines, which resize to 224 anyway"""
+        if self._pil is None:
+            image = self.reduced
+            with phase("image", "to_pil"):
+                self._pil = Image.fromarray(image)
+        return self._pil
+
+    def resized_rgb(self, size=(224, 224)) -> np.ndarray:
+        """RGB image resized to `size`, computed once per size"""
+        if size not in self._resized:
+            image = self.reduced if max(size) <= REDUCED_MIN_SIDE else self.rgb
+            with phase("image", "resize"):
+                self._resized[size] = cv2.resize(image, size)
+        return self._resized[size]
+
+
+class InputSpec:
+    """Size and normalization of a model input: (pixel * scale - mean) / std"""
+
+    def __init__(self, name: str, size: Tuple[int, int], scale: float = 1 / 255,
+                 mean: Optional[Sequence[float]] = None, std: Optional[Sequence[float]] = None,
+                 channels_first: bool = False):
+        self.name = name
+        self.size = size
+        self.channels_first = channels_first
+        mean = np.zeros(3, np.float32) if mean is None else np.asarray(mean, np.float32)
+        std = np.ones(3, np.float32) if std is None else np.asarray(std, np.float32)
+        # Folded into one multiply-add per pixel
+        self._factor = (scale / std).astype(np.float32)
+        self._offset = (mean / std).astype(np.float32)
+        self._uniform = not mean.any() and bool((std == 1).all())
+
+    @property
+    def shape(self) -> Tuple[int, int, int]:
+        """Shape of one normalized image"""
+        width, height = self.size
+        return (3, height, width) if self.channels_first else (height, width, 3)
+
+    def normalize(self, images: Sequence[np.ndarray], out: np.ndarray) -> np.ndarray:
+        """Write a batch of `size` uint8 RGB images into float32 `out`, returns `out`"""
+        factor, offset = self._factor, self._offset
+        if self.channels_first:
+            factor, offset = factor[:, None, None], offset[:, None, None]
+        for image, target in zip(images, out):
+            if self.channels_first:
+                image = image.transpose(2, 0, 1)
+            if self._uniform:
+                np.multiply(image, factor[0], out=target, dtype=np.float32)
+            else:
+                np.multiply(image, factor, out=target, dtype=np.float32)
+                np.subtract(target, offset, out=target)
+        return out
+
+
+class BufferPool:
+    """Reusable float32 batch buffers for one InputSpec"""
+
+    def __init__(self, spec: InputSpec, max_idle: int = 4):
+        self.spec = spec
+        self.max_idle = max_idle
+        self.allocations = 0
+        self._idle: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def _take(self, count: int) -> np.ndarray:
+        with self._lock:
+            for i, buffer in enumerate(self._idle):
+                if len(buffer) >= count:
+                    return self._idle.pop(i)
+        self.allocations += 1
+        # Power-of-two capacity so varying batch sizes reuse the same few buffers
+        capacity = 1 << max(0, count - 1).bit_length()
+        return np.empty((capacity,) + self.spec.shape, dtype=np.float32)
+
+    def _give(self, buffer: np.ndarray):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(buffer)
+
+    @contextmanager
+    def normalized(self, images: Sequence[np.ndarray]) -> Iterator[np.ndarray]:
+        """Normalized float32 batch of `images`, valid until the block exits"""
+        buffer = self._take(len(images))
+        try:
+            with phase(self.spec.name, "normalize"):
+                batch = self.spec.normalize(images, buffer[:len(images)])
+            yield batch
+        finally:
+            self._give(buffer)
+
+
+# Input of both Keras models (GNet and the damage severity classifier)
+KERAS_INPUT = InputSpec("keras", (224, 224))
+keras_buffers = BufferPool(KERAS_INPUT)
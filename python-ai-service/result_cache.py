@@ -0,0 +1,210 @@
+"""Content-addressed cache for model results.
+
+Results are keyed by the hash of the uploaded image bytes plus the model id,
+the model version (a fingerprint of its weights file) and the parameters
+that affect the output, such as thresholds. The in-memory tier is an LRU
+bounded by the serialized size of its entries; an optional on-disk tier of
+JSON files survives restarts.
+
+Configuration (environment variables):
+    RESULT_CACHE_MAX_BYTES          in-memory bound (default 256 MB, 0 disables the cache)
+    RESULT_CACHE_DIR                enables the on-disk tier in this directory
+    RESULT_CACHE_DISK_MAX_ENTRIES   on-disk bound, oldest files pruned first (default 10000)
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def hash_image_bytes(data: bytes) -> str:
+    """Content hash of the raw (undecoded) image bytes"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_fingerprint(path: str) -> Optional[str]:
+    """Cheap version of a model file, changes whenever the file is replaced"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def make_key(image_hash: str, model: str, version: str, params: Dict[str, Any]) -> str:
+    """Cache key for one model's result on one image"""
+    material = json.dumps([image_hash, model, version, params], sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU of JSON-serializable results with an optional disk tier"""
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None, disk_max_entries: int = 10000):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries: "OrderedDict[str, Tuple[str, Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached result for `key`, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry[1]
+
+        stored = self._read_disk(key)
+        with self._lock:
+            if stored is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+        model, result = stored
+        self._insert(key, model, result, len(json.dumps(result)))
+        return result
+
+    def put(self, key: str, model: str, result: Dict[str, Any]):
+        """Store `result` of `model` under `key`"""
+        if not self.enabled:
+            return
+        payload = json.dumps({"model": model, "result": result})
+        self._insert(key, model, result, len(payload))
+        self._write_disk(key, payload)
+
+    def invalidate(self, model: str):
+        """Drop every in-memory result produced by `model`.
+
+        Disk entries need no sweep: their keys embed the old model version,
+        so they can no longer be hit and age out through pruning.
+        """
+        with self._lock:
+            stale = [key for key, (owner, _, _) in self._entries.items() if owner == model]
+            for key in stale:
+                self._bytes -= self._entries.pop(key)[2]
+            self.counters["invalidations"] += len(stale)
+        if stale:
+            logger.info(f"🧹 Invalidated {len(stale)} cached results for {model}")
+
+    def clear(self):
+        """Empty both tiers"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_dir:
+            for path in self._disk_files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir
+            }
+
+    def _insert(self, key: str, model: str, result: Dict[str, Any], size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (model, result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.counters["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def _read_disk(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            return stored["model"], stored["result"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key: str, payload: str):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so readers never see a partial file
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Result cache disk write failed: {e}")
+            return
+
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        files = list(self._disk_files())
+        excess = len(files) - self.disk_max_entries
+        if excess <= 0:
+            return
+        files.sort(key=_mtime)
+        for path in files[:excess]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
+
+
+def create_result_cache() -> ResultCache:
+    """Build the cache from the environment"""
+    return ResultCache(
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+        disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+        disk_max_entries=int(os.getenv("RESULT_CACHE_DISK_MAX_ENTRIES", "10000")),
+    )
@@ -0,0 +1,95 @@
+"""In-memory client for the Roboflow hosted detection API.
+
+Posts the encoded image straight from memory over a pooled keep-alive
+session instead of writing a temp file for the SDK. Calls have a timeout,
+are retried on connection errors and 429/5xx responses, and the number of
+concurrent calls is capped. The API has no batch call, so `predict_many`
+fans a photo set out over the client's own thread pool, sized to that cap.
+
+Configuration (environment variables):
+    ROBOFLOW_API_URL          API base URL (default https://detect.roboflow.com),
+                              point it at a local stand-in server for testing
+    ROBOFLOW_MODEL            model id and version (default car-damage-coco-v9i/1)
+    ROBOFLOW_TIMEOUT          seconds per attempt (default 30)
+    ROBOFLOW_RETRIES          retries after the first attempt (default 2)
+    ROBOFLOW_MAX_CONCURRENCY  concurrent calls and pooled connections (default 4)
+"""
+import base64
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_API_URL = "https://detect.roboflow.com"
+DEFAULT_MODEL = "car-damage-coco-v9i/1"
+
+
+class RoboflowClient:
+    """Pooled, bounded HTTP client for one Roboflow model version"""
+
+    def __init__(self, api_key: str, model: str = DEFAULT_MODEL, api_url: str = DEFAULT_API_URL,
+                 timeout: float = 30.0, retries: int = 2, max_concurrency: int = 4):
+        self.api_key = api_key
+        self.model = model
+        self.url = f"{api_url.rstrip('/')}/{model}"
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,  # Detection is idempotent, retry the POST too
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, max_concurrency), max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Reused by every predict_many call, created threads are kept for the next batch
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="roboflow")
+
+    @classmethod
+    def from_env(cls) -> "RoboflowClient":
+        return cls(
+            api_key=os.getenv("ROBOFLOW_API_KEY", "EJdF3gB2PwrQDNlVhauC"),
+            model=os.getenv("ROBOFLOW_MODEL", DEFAULT_MODEL),
+            api_url=os.getenv("ROBOFLOW_API_URL", DEFAULT_API_URL),
+            timeout=float(os.getenv("ROBOFLOW_TIMEOUT", "30")),
+            retries=int(os.getenv("ROBOFLOW_RETRIES", "2")),
+            max_concurrency=int(os.getenv("ROBOFLOW_MAX_CONCURRENCY", "4")),
+        )
+
+    def predict(self, image_bytes: bytes, confidence: int = 40, overlap: int = 30) -> List[Dict[str, Any]]:
+        """Detect on an encoded image, returns the raw prediction dicts
+
+        Each prediction has center `x`/`y`, `width`, `height`, `class` and
+        `confidence` (0-1), in the pixel coordinates of the posted image.
+        """
+        with self._slots:
+            response = self.session.post(
+                self.url,
+                params={"api_key": self.api_key, "confidence": confidence, "overlap": overlap},
+                data=base64.b64encode(image_bytes),
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=self.timeout,
+            )
+        response.raise_for_status()
+        return response.json().get("predictions", [])
+
+    def predict_many(self, images: List[bytes], confidence: int = 40,
+                     overlap: int = 30) -> List[List[Dict[str, Any]]]:
+        """Detect on several encoded images concurrently, predictions in input order"""
+        return list(self._pool.map(lambda image: self.predict(image, confidence, overlap), images))
+
+    def close(self):
+        """Release the thread pool and the pooled connections, calls already running finish"""
+        self._pool.shutdown(wait=False)
+        self.session.close()
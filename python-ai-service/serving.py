@@ -0,0 +1,241 @@
+"""Multi-process serving with model weights shared copy-on-write.
+
+With SERVE_WORKERS=1 (the default) this is a plain `uvicorn.run`. With
+more workers, the parent process loads the fork-safe models, freezes the
+garbage collector so it never writes to their objects, binds the listening
+socket and forks the workers. The workers inherit the loaded weights as
+shared copy-on-write pages instead of loading their own copies. uvicorn's
+own `workers` option cannot do this, because it spawns fresh interpreters.
+
+Only PyTorch models loaded through their frameworks are loaded in the
+parent. TensorFlow and ONNX Runtime start thread pools that do not
+survive a fork, so the Keras models and any ONNX backend load in each
+worker. Those weights are small next to the YOLO, ViT and Mask R-CNN
+weights.
+
+Each worker gets cores / workers intra-op threads, so the workers together
+use each core once. OpenMP, MKL, OpenBLAS and TensorFlow read their thread
+counts from the environment when they load, so the variables are set
+before `main` is imported: by `serve` when started as `python serving.py`,
+and at the top of main.py when started as `python main.py`. An app that
+imports `main` itself before calling `serve` only gets the runtime
+setters, `cv2.setNumThreads` and `torch.set_num_threads`.
+
+The parent restarts workers that die. Every SERVE_REPORT_SECONDS it logs
+each worker's request rate and its RSS and PSS. PSS divides shared pages
+among the processes that map them, so the PSS total is the real footprint
+of the deployment.
+
+    SERVE_WORKERS=4 python serving.py
+    python main.py                        # same thing, reads the same variables
+
+Configuration (environment variables):
+    SERVE_HOST                  bind address (default 0.0.0.0)
+    SERVE_PORT                  port (default 8000)
+    SERVE_WORKERS               worker processes, "auto" for one per core (default 1)
+    SERVE_THREADS_PER_WORKER    intra-op threads per worker (default cores / workers)
+    SERVE_SHARED_MODELS         models loaded in the parent (default: the fork-safe PyTorch models)
+    SERVE_REPORT_SECONDS        interval of the per-worker memory and throughput log (default 60, 0 = off)
+"""
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from types import ModuleType
+from typing import Dict, List, Optional
+
+import uvicorn
+
+# Nothing that loads numpy or a framework may be imported here, `serve`
+# sets the thread environment before they load
+from model_registry import process_memory
+
+logger = logging.getLogger(__name__)
+
+HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVE_PORT", "8000"))
+REPORT_SECONDS = float(os.getenv("SERVE_REPORT_SECONDS", "60"))
+
+# PyTorch models can be loaded before forking. TensorFlow and ONNX Runtime
+# sessions own thread pools that are lost in the child.
+FORK_SAFE_MODELS = ("yolo", "car_brand", "damage_type", "damage_segmentation")
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS",
+                   "ONNX_INTRA_OP_THREADS")
+
+
+def worker_count() -> int:
+    value = os.getenv("SERVE_WORKERS", "1").strip().lower()
+    return max(1, os.cpu_count() or 1) if value == "auto" else max(1, int(value))
+
+
+def threads_per_worker(workers: int) -> int:
+    override = os.getenv("SERVE_THREADS_PER_WORKER")
+    return max(1, int(override)) if override else max(1, (os.cpu_count() or 1) // workers)
+
+
+def set_thread_env(threads: int):
+    """Thread counts for the frameworks, only effective before they are imported (explicit settings win)"""
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
+
+def configure_worker_threads(threads: int):
+    """Apply the thread count to frameworks already imported by the parent"""
+    import cv2
+    cv2.setNumThreads(threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+def shared_models(service: ModuleType) -> List[str]:
+    """Models to load in the parent"""
+    configured = os.getenv("SERVE_SHARED_MODELS")
+    if configured is not None:
+        names = [name.strip() for name in configured.split(",") if name.strip()]
+    else:
+        names = [name for name in FORK_SAFE_MODELS if service.model_backend(name) == "framework"]
+    startup = set(service.models.startup_models())
+    return [name for name in names if name in service.models.names and name in startup]
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class CountingApp:
+    """ASGI wrapper that counts finished HTTP requests into a slot of a shared array"""
+
+    def __init__(self, app, counters, index: int):
+        self.app = app
+        self.counters = counters
+        self.index = index
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http":
+            self.counters[self.index] += 1
+
+
+class Supervisor:
+    """Forks the workers, restarts them when they die and reports their usage"""
+
+    def __init__(self, service: ModuleType, sock: socket.socket, workers: int, threads: int):
+        self.service = service
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.pids: Dict[int, int] = {}  # pid -> worker index
+        self.counters = multiprocessing.Array("Q", workers, lock=False)
+        self.stopping = False
+
+    def spawn(self, index: int):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = index
+            return
+        # Worker
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        os.environ["SERVE_WORKER_ID"] = str(index)
+        configure_worker_threads(self.threads)
+        config = uvicorn.Config(CountingApp(self.service.app, self.counters, index), lifespan="on")
+        uvicorn.Server(config).run(sockets=[self.sock])
+        os._exit(0)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def report(self, previous: List[int], elapsed: float) -> List[int]:
+        counts = list(self.counters)
+        total_pss = 0
+        lines = []
+        for pid, index in sorted(self.pids.items(), key=lambda item: item[1]):
+            memory = process_memory(str(pid))
+            total_pss += memory["pss"]
+            rate = (counts[index] - previous[index]) / elapsed if elapsed > 0 else 0.0
+            lines.append(f"#{index} pid {pid}: {rate:.1f} req/s, rss {memory['rss'] / 2**20:.0f} MB, "
+                         f"pss {memory['pss'] / 2**20:.0f} MB, shared {memory['shared'] / 2**20:.0f} MB")
+        total_rate = (sum(counts) - sum(previous)) / elapsed if elapsed > 0 else 0.0
+        parent_pss = process_memory()["pss"]
+        logger.info(f"📊 {len(self.pids)} workers: {total_rate:.1f} req/s, "
+                    f"pss {(total_pss + parent_pss) / 2**20:.0f} MB including the parent")
+        for line in lines:
+            logger.info(f"📊   {line}")
+        return counts
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+        logger.info(f"🧵 {self.workers} workers x {self.threads} threads on {self.sock.getsockname()}")
+
+        previous, last_report = list(self.counters), time.monotonic()
+        restarts: Dict[int, float] = {}
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                index = self.pids.pop(pid)
+                if not self.stopping:
+                    logger.error(f"❌ Worker #{index} (pid {pid}) exited with status {status}, restarting")
+                    # Back off if the worker keeps crashing on startup
+                    if time.monotonic() - restarts.get(index, 0.0) < 10:
+                        time.sleep(5)
+                    restarts[index] = time.monotonic()
+                    self.spawn(index)
+                continue
+            time.sleep(0.5)
+            now = time.monotonic()
+            if REPORT_SECONDS > 0 and now - last_report >= REPORT_SECONDS:
+                previous, last_report = self.report(previous, now - last_report), now
+        logger.info("👋 All workers stopped")
+
+
+def serve(service: Optional[ModuleType] = None, host: str = HOST, port: int = PORT):
+    """Run the service with SERVE_WORKERS processes"""
+    workers = worker_count()
+    threads = threads_per_worker(workers)
+    set_thread_env(threads)
+    if service is None:
+        import main as service
+
+    if workers == 1:
+        # No-op when the environment was set in time, corrects an early import otherwise
+        configure_worker_threads(threads)
+        uvicorn.run(service.app, host=host, port=port)
+        return
+
+    shared = shared_models(service)
+    logger.info(f"📦 Loading shared models in the parent: {', '.join(shared) or 'none'}")
+    service.models.load_all(shared)
+    # Objects created so far are never scanned again, so the collector
+    # doesn't write to the pages the workers share
+    gc.collect()
+    gc.freeze()
+
+    Supervisor(service, bind_socket(host, port), workers, threads).run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+import admission
+import metrics
+from batching import MicroBatcher
+
+
+def streaming_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(admission.AdmissionMiddleware, unlimited_paths=("/health",))
+    app.add_middleware(metrics.RequestMetricsMiddleware)
+
+    @app.post("/complete-analysis/stream")
+    async def stream():
+        async def events():
+            # Seen while the body is being generated, after the headers were sent
+            await asyncio.sleep(0)
+            yield f"bulk={admission.stats()['in_flight']['bulk']}\n"
+            yield f"deadline={admission.current_deadline() is not None}\n"
+            yield f"in_flight={metrics.REQUESTS_IN_FLIGHT._values.get((), 0)}\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def test_streamed_response_holds_its_lane_slot_until_the_body_is_sent():
+    with TestClient(streaming_app()) as client:
+        body = client.post("/complete-analysis/stream").text
+
+    assert "bulk=1" in body
+    assert "deadline=True" in body
+    assert "in_flight=1.0" in body
+    assert admission.stats()["in_flight"]["bulk"] == 0
+    assert metrics.REQUESTS_IN_FLIGHT._values.get((), 0) == 0
+
+
+def test_full_lane_is_rejected_with_retry_after(monkeypatch):
+    monkeypatch.setitem(admission.LANE_LIMITS, "bulk", 0)
+    with TestClient(streaming_app()) as client:
+        response = client.post("/complete-analysis/stream")
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == str(admission.RETRY_AFTER_SECONDS)
+    assert admission.stats()["in_flight"]["bulk"] == 0
+
+
+def test_batches_do_not_inherit_the_deadline_of_the_request_that_started_the_collector():
+    batcher = MicroBatcher("deadline_test", lambda items: items.sum(axis=1), max_wait_ms=0)
+    app = FastAPI()
+    app.add_middleware(admission.AdmissionMiddleware)
+
+    @app.post("/ai-check")
+    async def check():
+        return {"sum": float(await batcher.submit(np.ones(3, np.float32)))}
+
+    with TestClient(app) as client:
+        first = client.post("/ai-check", headers={"X-Request-Deadline-Ms": "100"})
+        time.sleep(0.2)
+        second = client.post("/ai-check", headers={"X-Request-Deadline-Ms": "100"})
+
+    assert first.status_code == 200
+    assert second.status_code == 200, second.text
+    assert second.json() == {"sum": 3.0}
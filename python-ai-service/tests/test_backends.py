@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from backends import OnnxYoloModel, letterbox, letterbox_shape
+
+
+def test_letterbox_shape_is_the_smallest_stride_aligned_rectangle():
+    # A 4:3 photo runs at 480x640 like the hub model, not padded to 640x640
+    assert letterbox_shape([(3024, 4032, 3)], 640, 32) == (480, 640)
+    assert letterbox_shape([(4032, 3024, 3)], 640, 32) == (640, 480)
+    # Odd aspect ratios round up to the stride
+    assert letterbox_shape([(1000, 1600, 3)], 640, 32) == (416, 640)
+    # A batch shares the shape that holds every image
+    assert letterbox_shape([(3024, 4032, 3), (4032, 3024, 3)], 640, 32) == (640, 640)
+
+
+def test_letterbox_centres_the_resized_image():
+    image = np.zeros((300, 400, 3), np.uint8)
+    padded, scale, (left, top) = letterbox(image, (480, 640))
+    assert padded.shape == (480, 640, 3)
+    assert scale == pytest.approx(1.6) and (left, top) == (0, 0)
+
+    padded, scale, (left, top) = letterbox(image, (640, 640))
+    assert padded.shape == (640, 640, 3)
+    assert (left, top) == (0, 80)
+    assert (padded[:80] == 114).all() and (padded[80:560] == 0).all()
+
+
+def passthrough_export(tmp_path, height, width):
+    """Model whose output is its input, with fixed or symbolic height and width"""
+    onnx = pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [helper.make_node("Identity", ["images"], ["output0"])], "passthrough",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, height, width])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, ["batch", 3, height, width])]
+    )
+    path = str(tmp_path / "yolo.onnx")
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8), path)
+    return OnnxYoloModel(path, {"names": {"0": "scratch"}, "imgsz": 640})
+
+
+def test_dynamic_export_gets_the_rectangular_letterbox(tmp_path):
+    model = passthrough_export(tmp_path, "height", "width")
+    assert model.dynamic
+    tensor, [(scale, pad, shape)] = model.preprocess([np.zeros((3024, 4032, 3), np.uint8)])
+    assert tensor.shape == (1, 3, 480, 640)
+    assert pad == (0, 0) and shape == (3024, 4032)
+    assert model.preprocess([np.zeros((3024, 4032, 3), np.uint8)], size=1280)[0].shape == (1, 3, 960, 1280)
+
+
+def test_fixed_export_is_padded_to_a_square(tmp_path):
+    model = passthrough_export(tmp_path, 640, 640)
+    assert not model.dynamic
+    tensor, [(scale, pad, shape)] = model.preprocess([np.zeros((3024, 4032, 3), np.uint8)], size=1280)
+    assert tensor.shape == (1, 3, 640, 640)
+    assert pad == (0, 80)
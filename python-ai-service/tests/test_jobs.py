@@ -0,0 +1,98 @@
+import asyncio
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import jobs
+from jobs import JobQueue, JobWorkers, SQLiteJobQueue, idempotency_key
+
+
+class IncompleteQueue(JobQueue):
+    def put_image(self, image_hash, data):
+        pass
+
+
+def test_incomplete_backend_fails_at_instantiation():
+    with pytest.raises(TypeError):
+        IncompleteQueue()
+
+
+def submit(queue: SQLiteJobQueue, hashes):
+    for image_hash in hashes:
+        queue.put_image(image_hash, b"jpeg")
+    return queue.submit("yolo-detect", {}, hashes, idempotency_key("yolo-detect", {}, hashes))
+
+
+def test_sqlite_queue_runs_a_job_to_done(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path))
+    job, created = submit(queue, ["a" * 64, "b" * 64])
+    assert created and job["status"] == "queued"
+    assert submit(queue, ["a" * 64, "b" * 64]) == (job, False)
+
+    claim = queue.claim("worker-1", limit=8)
+    assert [image_hash for _, _, image_hash in claim.items] == ["a" * 64, "b" * 64]
+    assert queue.claim("worker-2", limit=8) is None
+
+    queue.complete(claim, [{"detections": []}, None], [None, "boom"])
+    job = queue.get(job["job_id"])
+    assert job["progress"]["done"] == 1 and job["progress"]["queued"] == 1
+
+    retry = queue.claim("worker-2", limit=8)
+    queue.complete(retry, [{"detections": []}], [None])
+    job = queue.get(job["job_id"])
+    assert job["status"] == "done"
+    assert [item["result"] for item in job["results"]] == [{"detections": []}, {"detections": []}]
+
+
+def test_stale_worker_cannot_complete_a_cancelled_item(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path))
+    job, _ = submit(queue, ["c" * 64])
+    claim = queue.claim("worker-1", limit=8)
+
+    assert queue.cancel(job["job_id"])["status"] == "cancelled"
+    queue.complete(claim, [{"detections": []}], [None])
+    queue.release(claim)
+    assert queue.get(job["job_id"])["results"][0]["status"] == "cancelled"
+
+
+class FlakyQueue(SQLiteJobQueue):
+    """Fails the first completion, like a database locked by another process"""
+
+    def __init__(self, directory):
+        super().__init__(directory, lease_seconds=0.05)
+        self.failures = 1
+
+    def complete(self, claim, results, errors):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        return super().complete(claim, results, errors)
+
+
+def test_worker_survives_a_failed_completion(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "POLL_SECONDS", 0.01)
+    buffer = io.BytesIO()
+    Image.fromarray(np.zeros((32, 32, 3), np.uint8)).save(buffer, "JPEG")
+    queue = FlakyQueue(str(tmp_path))
+    queue.put_image("d" * 64, buffer.getvalue())
+    job, _ = queue.submit("yolo-detect", {}, ["d" * 64], idempotency_key("yolo-detect", {}, ["d" * 64]))
+
+    async def detect(contexts):
+        return [{"detections": []} for _ in contexts]
+
+    async def run():
+        workers = JobWorkers(queue, {"yolo-detect": detect}, workers=1)
+        workers.start()
+        try:
+            for _ in range(200):
+                if queue.get(job["job_id"])["status"] == "done":
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await workers.stop()
+
+    asyncio.run(run())
+    assert queue.failures == 0
+    assert queue.get(job["job_id"])["status"] == "done"
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from pipeline import Stage, StageGraph
+
+
+def recording_stage(name, log, depends_on=(), delay=0.0, result=None, **kwargs):
+    async def run(context, results):
+        log.append(f"start {name}")
+        await asyncio.sleep(delay)
+        log.append(f"end {name}")
+        return result if result is not None else {"name": name, "seen": sorted(results)}
+    return Stage(name, run, depends_on=depends_on, **kwargs)
+
+
+def graph(log, **overrides):
+    stages = {
+        "gate": dict(delay=0.02, result={"tripped": False}, abort_if=lambda result: result["tripped"]),
+        "detection": dict(depends_on=("gate",), delay=0.01),
+        "brand": dict(depends_on=("gate",), delay=0.01),
+        "severity": dict(depends_on=("detection",),
+                         skip_if=lambda results: None if results["detection"].get("found", True) else "nothing found",
+                         placeholder=lambda reason: {"severity": "unknown", "skipped": reason}),
+        "segmentation": dict(depends_on=("gate",), optional=True),
+    }
+    for name, changes in overrides.items():
+        stages[name].update(changes)
+    return StageGraph([recording_stage(name, log, speculative=name == "detection", **kwargs)
+                       for name, kwargs in stages.items()])
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError):
+        StageGraph([Stage("a", None, depends_on=("b",))])
+
+
+def test_resolve_pulls_in_dependencies_and_leaves_out_optional_stages():
+    stages = graph([])
+    assert stages.resolve() == ["gate", "detection", "brand", "severity"]
+    assert stages.resolve(["severity"]) == ["gate", "detection", "severity"]
+    assert stages.resolve(["segmentation"]) == ["gate", "segmentation"]
+    with pytest.raises(ValueError):
+        stages.resolve(["colour"])
+
+
+def test_stages_wait_for_their_dependencies_and_siblings_overlap():
+    log = []
+    outcome = asyncio.run(graph(log).run(None, ["brand", "severity"]))
+
+    assert log.index("end gate") < log.index("start brand")
+    assert log.index("end detection") < log.index("start severity")
+    # The speculative detection starts alongside the gate instead of after it
+    assert log.index("start detection") < log.index("end gate")
+    # A stage is handed the results settled so far, the held detection is recorded after the gate
+    assert {"detection", "gate"} <= set(outcome.results["severity"]["seen"])
+    assert list(outcome.results) == ["gate", "detection", "brand", "severity"]
+    assert outcome.summary()["skipped"] == {}
+
+
+def test_skip_condition_returns_the_placeholder_unless_early_exit_is_off():
+    seen = []
+    stages = graph([], detection=dict(result={"found": False}))
+
+    outcome = asyncio.run(stages.run(None, on_result=lambda name, result: seen.append(name)))
+    assert outcome.skipped == {"severity": "nothing found"}
+    assert outcome.results["severity"] == {"severity": "unknown", "skipped": "nothing found"}
+    assert sorted(seen) == ["brand", "detection", "gate", "severity"]
+
+    outcome = asyncio.run(stages.run(None, early_exit=False))
+    assert outcome.skipped == {}
+    assert outcome.results["severity"]["name"] == "severity"
+
+
+def test_tripped_gate_cancels_the_remaining_stages():
+    log = []
+    outcome = asyncio.run(graph(log, gate=dict(result={"tripped": True}),
+                                detection=dict(delay=1.0)).run(None))
+
+    assert outcome.aborted_by == "gate"
+    assert sorted(outcome.cancelled) == ["brand", "detection", "severity"]
+    assert list(outcome.results) == ["gate"]
+    assert "end detection" not in log
+
+
+def test_stage_errors_propagate():
+    async def broken(context, results):
+        raise RuntimeError("model failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(StageGraph([Stage("only", broken)]).run(None))
+
+
+def test_speculative_result_is_held_until_the_gate_passes():
+    log, seen = [], []
+    stages = graph(log, detection=dict(delay=0.0))
+
+    outcome = asyncio.run(stages.run(None, ["detection"], on_result=lambda name, result: seen.append(name)))
+    assert log.index("end detection") < log.index("end gate")
+    assert seen == ["gate", "detection"]
+    assert list(outcome.results) == ["gate", "detection"]
+
+
+def test_speculative_result_of_a_rejected_image_is_never_reported():
+    seen = []
+    stages = graph([], gate=dict(result={"tripped": True}), detection=dict(delay=0.0))
+
+    outcome = asyncio.run(stages.run(None, ["detection"], on_result=lambda name, result: seen.append(name)))
+    assert seen == ["gate"]
+    assert outcome.aborted_by == "gate"
+    assert list(outcome.results) == ["gate"]
@@ -0,0 +1,52 @@
+import io
+import pickle
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import ImageContext
+
+
+def jpeg(width: int = 320, height: int = 240) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (height, width, 3), np.uint8)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_image_context_pickles_before_decode():
+    context = ImageContext.from_bytes(jpeg(), {"method": "yolo"})
+    copy = pickle.loads(pickle.dumps(context))
+
+    assert copy.image_hash == context.image_hash
+    assert copy.options == {"method": "yolo"}
+    assert copy.size == (320, 240)
+    np.testing.assert_array_equal(copy.bgr, context.bgr)
+
+
+def test_image_context_pickles_decoded_views_with_fresh_locks():
+    context = ImageContext.from_bytes(jpeg())
+    context.rgb
+    copy = pickle.loads(pickle.dumps(context))
+
+    assert copy._decode_lock is not context._decode_lock
+    assert not copy._reduced_lock.locked()
+    np.testing.assert_array_equal(copy.rgb, context.rgb)
+    np.testing.assert_array_equal(copy.reduced, context.reduced)
+
+
+def test_exif_orientation_is_ignored_by_every_view():
+    # Stored 2000x1000, tagged to be displayed rotated 90 degrees
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((1000, 2000, 3), 128, np.uint8)).save(buffer, "JPEG", exif=exif)
+    data = buffer.getvalue()
+
+    context = ImageContext.from_bytes(data)
+    assert context.size == (2000, 1000)
+    assert context.reduced.shape == (500, 1000, 3)  # reduced JPEG decode
+    assert context.bgr.shape == (1000, 2000, 3)
+
+    decoded_first = ImageContext.from_bytes(data)
+    decoded_first.bgr
+    assert decoded_first.reduced.shape == (500, 1000, 3)  # resized from the full decode
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+import requests
+
+from benchmarks.roboflow_stub import serve_in_thread
+from model_registry import ModelRegistry
+from roboflow_client import RoboflowClient
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server, url = serve_in_thread(**kwargs)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def jpeg(width: int, height: int = 120) -> bytes:
+    return cv2.imencode(".jpg", np.full((height, width, 3), 128, np.uint8))[1].tobytes()
+
+
+def test_predict_returns_predictions_in_image_pixels(stub):
+    server, url = stub()
+    client = RoboflowClient("key", model="car-damage/1", api_url=url)
+
+    predictions = client.predict(jpeg(200))
+
+    assert [p["class"] for p in predictions] == ["dent", "scratch"]
+    assert predictions[0]["x"] == pytest.approx(60)
+    client.close()
+
+
+def test_5xx_is_retried_until_the_retries_run_out(stub):
+    server, url = stub(failures=2)
+    client = RoboflowClient("key", model="car-damage/1", api_url=url, retries=2)
+    assert len(client.predict(jpeg(200))) == 2
+    assert server.stats["requests"] == 3
+
+    server, url = stub(failures=3)
+    client = RoboflowClient("key", model="car-damage/1", api_url=url, retries=2)
+    with pytest.raises(requests.HTTPError):
+        client.predict(jpeg(200))
+    assert server.stats["requests"] == 3
+
+
+def test_slow_upstream_times_out_per_attempt(stub):
+    server, url = stub(latency_ms=1000)
+    client = RoboflowClient("key", model="car-damage/1", api_url=url, timeout=0.1, retries=1)
+
+    start = time.perf_counter()
+    with pytest.raises(requests.RequestException):
+        client.predict(jpeg(200))
+
+    assert time.perf_counter() - start < 0.9
+    assert server.stats["requests"] == 2
+
+
+def test_predict_many_is_concurrent_up_to_the_cap_and_keeps_order(stub):
+    server, url = stub(latency_ms=100)
+    client = RoboflowClient("key", model="car-damage/1", api_url=url, max_concurrency=2)
+    widths = [100, 200, 300, 400, 500, 600]
+
+    start = time.perf_counter()
+    results = client.predict_many([jpeg(width) for width in widths])
+    elapsed = time.perf_counter() - start
+
+    assert [r[0]["x"] for r in results] == pytest.approx([width * 0.3 for width in widths])
+    assert server.stats["peak_in_flight"] == 2
+    # Three rounds of two concurrent calls
+    assert 0.25 < elapsed < 0.6
+
+    # The next batch reuses the client's pool instead of starting new threads
+    pool = client._pool
+    client.predict_many([jpeg(100), jpeg(200)])
+    assert client._pool is pool
+    assert sum(t.name.startswith("roboflow") for t in threading.enumerate()) <= 2
+    client.close()
+
+
+def test_evicted_client_releases_its_pool(stub):
+    server, url = stub()
+    models = ModelRegistry(idle_ttl=0.01)
+    models.register("roboflow", lambda: RoboflowClient("key", api_url=url), close=lambda client: client.close())
+
+    client = models.get("roboflow")
+    client.predict_many([jpeg(200), jpeg(200)])
+    time.sleep(0.02)
+
+    assert models.evict_idle() == ["roboflow"]
+    with pytest.raises(RuntimeError):
+        client.predict_many([jpeg(200)])
+    # The next request gets a new client
+    assert models.get("roboflow") is not client
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from tiling import merge_boxes, tile_origins, tile_views, tiled_predict, tiling_settings
+
+
+def test_tile_origins_overlap_and_end_flush_with_the_edge():
+    assert tile_origins(1600, 640, 0.2) == [0, 512, 960]
+    assert tile_origins(640, 640, 0.2) == [0]
+    assert tile_origins(300, 640, 0.2) == [0]
+
+
+def test_tile_views_cover_the_image_without_copying():
+    image = np.zeros((1000, 1500, 3), np.uint8)
+    views, offsets = tile_views(image, 640, 0.25)
+
+    assert offsets == [(0, 0), (480, 0), (860, 0), (0, 360), (480, 360), (860, 360)]
+    assert all(view.shape == (640, 640, 3) for view in views)
+    assert all(np.shares_memory(view, image) for view in views)
+    # The last row and column of tiles end on the image border
+    assert max(x for x, _ in offsets) + 640 == 1500
+    assert max(y for _, y in offsets) + 640 == 1000
+
+
+def test_merge_joins_the_halves_of_a_box_cut_by_a_seam():
+    # One scratch across the seam at x=640, seen partly by two neighbouring tiles
+    boxes = np.array([[600, 100, 640, 110, 0.9, 0],
+                      [610, 100, 680, 110, 0.8, 0]], np.float32)
+    merged = merge_boxes(boxes, np.array([0, 1]), threshold=0.5)
+
+    np.testing.assert_allclose(merged, [[600, 100, 680, 110, 0.9, 0]])
+
+
+def test_merge_keeps_boxes_of_one_view_and_of_other_classes_apart():
+    boxes = np.array([[0, 0, 10, 10, 0.9, 0],
+                      [2, 2, 12, 12, 0.8, 0],
+                      [0, 0, 10, 10, 0.7, 1]], np.float32)
+
+    assert len(merge_boxes(boxes, np.array([0, 0, 1]), threshold=0.5)) == 3
+
+
+def test_merge_chains_pieces_through_a_grown_box():
+    # Two tile pieces of a large dent overlap too little to merge directly; the
+    # full-frame box (lowest confidence) joins them
+    boxes = np.array([[0, 0, 300, 100, 0.9, 0],
+                      [172, 0, 500, 100, 0.8, 0],
+                      [0, 0, 500, 100, 0.6, 0]], np.float32)
+    merged = merge_boxes(boxes, np.array([0, 1, 2]), threshold=0.5)
+
+    np.testing.assert_allclose(merged, [[0, 0, 500, 100, 0.9, 0]])
+
+
+def test_tiled_predict_maps_tile_boxes_back_to_image_coordinates():
+    image = np.zeros((1000, 1500, 3), np.uint8)
+    # A 40x20 box at x 840..880, y 500..520: inside two overlapping tiles of the middle column
+    image[500:520, 840:880] = 255
+    calls = []
+
+    def predict(inputs):
+        calls.append(len(inputs))
+        rows = []
+        for view in inputs:
+            ys, xs = np.nonzero(view[:, :, 0])
+            if view.shape[:2] == image.shape[:2] or not len(xs):
+                # The full frame is "too small to see" at model size
+                rows.append(np.zeros((0, 6), np.float32))
+            else:
+                rows.append(np.array([[xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, 0.9, 0]], np.float32))
+        return rows
+
+    boxes = tiled_predict(predict, [image], (640, 0.25), full_frame=True, max_batch=4)[0]
+
+    np.testing.assert_allclose(boxes, [[840, 500, 880, 520, 0.9, 0]])
+    # Six tiles and the full frame, in chunks of max_batch
+    assert calls == [4, 3]
+
+
+def test_tiled_predict_drops_low_confidence_boxes_before_merging():
+    image = np.zeros((700, 700, 3), np.uint8)
+
+    def predict(inputs):
+        return [np.array([[10, 10, 50, 50, 0.9, 0], [0, 0, 600, 600, 0.1, 0]], np.float32) for _ in inputs]
+
+    boxes = tiled_predict(predict, [image], (640, 0.2), min_confidence=0.3, full_frame=False)[0]
+
+    assert (boxes[:, 4] > 0.3).all()
+    assert len(boxes) == 4  # the 0.9 box of each of the four tiles, at different places
+
+
+def test_tiling_settings_validates_request_options():
+    assert tiling_settings({}) is None
+    assert tiling_settings({"tiled": "true", "tile_size": "512", "tile_overlap": "0.1"}) == (512, 0.1)
+    for options in ({"tiled": "true", "tile_size": "abc"}, {"tiled": "1", "tile_overlap": "1.5"}):
+        with pytest.raises(HTTPException) as error:
+            tiling_settings(options)
+        assert error.value.status_code == 400
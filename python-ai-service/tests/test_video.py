@@ -0,0 +1,148 @@
+import asyncio
+import base64
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import video
+from video import DuplicateFilter, IoUTracker, SequenceFrames, VideoFrames, analyze_frames, box_iou
+
+
+def panel(width: int = 640, height: int = 360, offset: int = 0, seed: int = 0) -> np.ndarray:
+    """Textured frame, `offset` pans the camera right by that many pixels"""
+    # Blotches tens of pixels wide, so a pan changes even a 32x32 thumbnail
+    rng = np.random.default_rng(seed)
+    blotches = rng.integers(0, 255, (height // 24 + 1, (width + 200) // 24 + 1, 3), np.uint8)
+    texture = cv2.resize(blotches, (blotches.shape[1] * 24, blotches.shape[0] * 24), interpolation=cv2.INTER_CUBIC)
+    return np.ascontiguousarray(texture[:height, offset:offset + width])
+
+
+def detection(bbox, cls="dent", confidence=0.8):
+    return {"class": cls, "confidence": confidence, "bbox": list(bbox)}
+
+
+def test_box_iou():
+    iou = box_iou(np.array([[0, 0, 10, 10]], np.float32), np.array([[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]],
+                                                                   np.float32))
+    np.testing.assert_allclose(iou, [[1.0, 1 / 3, 0.0]])
+
+
+def test_tracker_follows_a_damage_through_a_pan_with_the_camera_shift():
+    tracker = IoUTracker(iou_threshold=0.3, max_age=2)
+    for frame in range(6):
+        # The camera pans 40 px per frame, so the damage moves 40 px left, more than its width
+        x = 400 - 40 * frame
+        tracker.update([detection((x, 100, x + 30, 130), confidence=0.5 + frame / 20)], frame, frame / 5, shift=(-40, 0))
+
+    tracks = tracker.tracks(min_hits=2)
+    assert len(tracks) == 1
+    assert tracks[0].hits == 6
+    assert tracks[0].to_dict()["best_frame"] == 5
+    assert tracks[0].to_dict()["first_seen_seconds"] == 0
+
+
+def test_tracker_without_the_shift_fragments_a_fast_pan():
+    tracker = IoUTracker(iou_threshold=0.3, max_age=2)
+    for frame in range(6):
+        x = 400 - 40 * frame
+        tracker.update([detection((x, 100, x + 30, 130))], frame)
+
+    assert tracker.tracks(min_hits=2) == []
+
+
+def test_tracker_keeps_classes_apart_and_ages_out_lost_tracks():
+    tracker = IoUTracker(iou_threshold=0.3, max_age=1)
+    tracker.update([detection((0, 0, 50, 50), "dent"), detection((0, 0, 50, 50), "scratch")], 0)
+    tracker.update([detection((2, 0, 52, 50), "dent")], 1)
+    tracker.update([], 2)
+    tracker.update([], 3)
+
+    assert sorted(track.cls for track in tracker.finished) == ["dent", "scratch"]
+    assert [(track.cls, track.hits) for track in tracker.tracks(min_hits=1)] == [("dent", 2), ("scratch", 1)]
+
+
+def test_duplicate_filter_skips_still_frames_and_measures_the_pan():
+    duplicates = DuplicateFilter(threshold=6)
+    assert duplicates.keep(panel()) == (0.0, 0.0)
+    assert duplicates.keep(panel()) is None
+    assert duplicates.skipped == 1
+
+    dx, dy = duplicates.keep(panel(offset=48))
+    # Content moves left when the camera pans right; measured on a 4x strided image
+    assert dx == pytest.approx(-48, abs=8)
+    assert dy == pytest.approx(0, abs=8)
+
+
+def test_sequence_frames_decode_base64_frames_one_at_a_time():
+    encoded = [base64.b64encode(cv2.imencode(".jpg", panel(seed=i))[1].tobytes()).decode() for i in range(3)]
+    frames = SequenceFrames(encoded + ["not base64!"], max_frames=3)
+    iterator = iter(frames)
+
+    index, timestamp, first = next(iterator)
+    assert (index, timestamp, first.shape) == (0, None, (360, 640, 3))
+    assert frames.images[0] is None
+    assert isinstance(frames.images[1], str)
+    assert len(list(iterator)) == 2
+    assert frames.read == 3
+
+
+def test_sequence_frames_reject_a_bad_frame_when_it_is_reached():
+    frames = iter(SequenceFrames([cv2.imencode(".jpg", panel())[1].tobytes(), "@@@"]))
+    next(frames)
+    with pytest.raises(HTTPException) as error:
+        next(frames)
+    assert error.value.status_code == 400
+
+
+def test_json_frames_are_capped_and_left_encoded(monkeypatch):
+    class JsonRequest:
+        query_params = {"sample_fps": "2"}
+
+        async def json(self):
+            return {"frames": ["a", "b", "c"], "images": ["d"], "diff_threshold": 3}
+
+    monkeypatch.setattr(video, "MAX_FRAMES", 2)
+    options, frames = asyncio.run(video._json_frames(JsonRequest()))
+
+    assert frames == ["a", "b"]
+    assert options == {"sample_fps": "2", "diff_threshold": 3}
+
+
+def test_video_frames_sample_the_requested_rate(tmp_path):
+    path = str(tmp_path / "walk.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (320, 240))
+    for i in range(50):
+        writer.write(panel(320, 240, offset=i))
+    writer.release()
+
+    frames = VideoFrames(path, sample_fps=5)
+    decoded = [(index, timestamp) for index, timestamp, _ in frames]
+    frames.close()
+
+    assert frames.info()["sample_stride"] == 5
+    assert [index for index, _ in decoded] == list(range(0, 50, 5))
+    assert decoded[1][1] == pytest.approx(0.2)
+    assert frames.read == 50
+
+
+def test_analyze_frames_reports_each_damage_once():
+    # Still frames are duplicates; the damage is seen in every kept frame of the pan
+    images = [panel(offset=0)] * 3 + [panel(offset=o) for o in (40, 80, 120)]
+    encoded = [cv2.imencode(".png", image)[1].tobytes() for image in images]
+    # The damage moves left with the content as the camera pans right
+    positions = iter([300, 260, 220, 180])
+    calls = []
+
+    async def detect(frames):
+        calls.append(len(frames))
+        return [[detection((x, 100, x + 40, 140))] for x in (next(positions) for _ in frames)]
+
+    result = asyncio.run(analyze_frames(encoded, detect, {"diff_threshold": "6"}, batch_size=2))
+
+    assert result["frames"]["read"] == 6
+    assert result["frames"]["kept"] == 4
+    assert sum(calls) == 4
+    assert len(result["damages"]) == 1
+    assert result["truncated"] is False
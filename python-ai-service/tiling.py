@@ -0,0 +1,167 @@
+"""Tiled YOLO inference for small damage on high-resolution photos.
+
+YOLO letterboxes its input to the model size, 640 pixels on the long side.
+On a 4000x3000 photo that is a 6x downscale, and a scratch 40 pixels long
+shrinks to 6 pixels, below what the detector resolves. Raising the
+inference size recovers it, but the cost grows with the square of the
+size.
+
+With tiling on, the photo is cut into overlapping YOLO_TILE_SIZE squares.
+The tiles are NumPy views into the decoded image, nothing is copied. They
+go through the model at their own resolution, in one batch together with
+the downscaled full frame, which still catches damage larger than a
+tile. Boxes are shifted back to image coordinates and merged per class:
+boxes from different tiles (or from a tile and the full frame) that
+overlap by more than YOLO_TILE_MERGE_THRESHOLD of the smaller box are the
+same damage, cut by a tile edge or seen twice. They become one box
+covering both, with the higher confidence.
+
+Requests turn tiling on with `tiled=true`, and can override the tile size
+and overlap with `tile_size` and `tile_overlap`.
+
+Configuration (environment variables):
+    YOLO_TILING                1 to tile every YOLO call, 0 (default) to tile only requests with tiled=true
+    YOLO_TILE_SIZE             tile side in image pixels; 640 (default) runs tiles unscaled at the model size
+    YOLO_TILE_OVERLAP          overlap of neighbouring tiles, fraction of the tile side (default 0.2)
+    YOLO_TILE_FULL_FRAME       1 (default) to also run the downscaled full frame, for damage larger than a tile
+    YOLO_TILE_MERGE_THRESHOLD  intersection over the smaller box above which boxes are merged (default 0.5)
+    YOLO_TILE_MAX_BATCH        most tiles per forward pass when several images are tiled (default 64)
+"""
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+from metrics import phase
+
+TILING = os.getenv("YOLO_TILING", "0") == "1"
+TILE_SIZE = int(os.getenv("YOLO_TILE_SIZE", "640"))
+TILE_OVERLAP = float(os.getenv("YOLO_TILE_OVERLAP", "0.2"))
+FULL_FRAME = os.getenv("YOLO_TILE_FULL_FRAME", "1") == "1"
+MERGE_THRESHOLD = float(os.getenv("YOLO_TILE_MERGE_THRESHOLD", "0.5"))
+MAX_BATCH = max(1, int(os.getenv("YOLO_TILE_MAX_BATCH", "64")))
+
+# (tile size, overlap) of a tiled request
+TileSettings = Tuple[int, float]
+# Runs the detector on a list of images, returns xyxy/conf/cls rows per image
+Predict = Callable[[List[np.ndarray]], List[np.ndarray]]
+
+
+def tiling_settings(options: Dict[str, Any]) -> Optional[TileSettings]:
+    """Tile size and overlap of a request, None for full-frame inference"""
+    enabled = options.get("tiled", TILING)
+    if str(enabled).lower() not in ("1", "true", "yes", "on"):
+        return None
+    try:
+        size = int(options.get("tile_size", TILE_SIZE))
+        overlap = float(options.get("tile_overlap", TILE_OVERLAP))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="tile_size must be an integer and tile_overlap a number")
+    if size < 32 or not 0 <= overlap < 1:
+        raise HTTPException(status_code=400, detail="tile_size must be at least 32 and tile_overlap in [0, 1)")
+    return size, overlap
+
+
+def tile_origins(length: int, tile: int, overlap: float) -> List[int]:
+    """Start offsets of tiles covering `length` pixels, the last one flush with the edge"""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+def tile_views(image: np.ndarray, size: int, overlap: float) -> Tuple[List[np.ndarray], List[Tuple[int, int]]]:
+    """Overlapping `size` tiles of `image` as views sharing its memory, with their (x, y) offsets"""
+    height, width = image.shape[:2]
+    views, offsets = [], []
+    for y in tile_origins(height, size, overlap):
+        for x in tile_origins(width, size, overlap):
+            views.append(image[y:y + size, x:x + size])
+            offsets.append((x, y))
+    return views, offsets
+
+
+def merge_boxes(boxes: np.ndarray, sources: np.ndarray, threshold: float = MERGE_THRESHOLD) -> np.ndarray:
+    """Merge boxes of one class found in different views, most confident first.
+
+    `boxes` are xyxy/conf/cls rows in image coordinates and `sources` the
+    view each came from. Boxes from the same view were already separated by
+    the model's own NMS and are kept apart. Merging repeats until nothing
+    changes, since a grown box (a damage's two halves joined through the
+    full frame) can reach pieces it did not overlap before.
+    """
+    order = np.argsort(-boxes[:, 4], kind="stable")
+    merged = [box.copy() for box in boxes[order]]
+    merged_sources = [{source} for source in sources[order]]
+    changed = True
+    while changed:
+        changed = False
+        i = 0
+        while i < len(merged):
+            kept, j = merged[i], i + 1
+            while j < len(merged):
+                box = merged[j]
+                if kept[5] == box[5] and merged_sources[i].isdisjoint(merged_sources[j]) and \
+                        overlap_of_smaller(kept, box) >= threshold:
+                    kept[:4] = [min(kept[0], box[0]), min(kept[1], box[1]),
+                                max(kept[2], box[2]), max(kept[3], box[3])]
+                    merged_sources[i] |= merged_sources.pop(j)
+                    merged.pop(j)
+                    changed = True
+                else:
+                    j += 1
+            i += 1
+    return np.array(merged, dtype=np.float32).reshape(-1, 6)
+
+
+def overlap_of_smaller(a: np.ndarray, b: np.ndarray) -> float:
+    """Intersection of two xyxy boxes over the area of the smaller one"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+    return float(width * height / max(smaller, 1e-9))
+
+
+def tiled_predict(predict: Predict, images: List[np.ndarray], settings: TileSettings, min_confidence: float = 0.0,
+                  full_frame: bool = FULL_FRAME, max_batch: int = MAX_BATCH) -> List[np.ndarray]:
+    """Detections of each image from its tiles (and full frame), merged in image coordinates.
+
+    Boxes at or under `min_confidence` are dropped before merging, so they
+    never widen a confident box.
+    """
+    size, overlap = settings
+    inputs: List[np.ndarray] = []
+    owners: List[Tuple[int, int, int]] = []  # (image, x offset, y offset) of each input
+    with phase("yolo", "tile"):
+        for index, image in enumerate(images):
+            views, offsets = tile_views(image, size, overlap)
+            if full_frame and len(views) > 1:
+                views.append(image)
+                offsets.append((0, 0))
+            inputs.extend(views)
+            owners.extend((index, x, y) for x, y in offsets)
+
+    # All the tiles in one forward pass, in chunks of max_batch for large photo sets
+    outputs: List[np.ndarray] = []
+    for start in range(0, len(inputs), max_batch):
+        outputs.extend(predict(inputs[start:start + max_batch]))
+
+    with phase("yolo", "merge"):
+        per_image: List[List[np.ndarray]] = [[] for _ in images]
+        per_source: List[List[np.ndarray]] = [[] for _ in images]
+        for source, ((index, x, y), rows) in enumerate(zip(owners, outputs)):
+            rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+            rows = rows[rows[:, 4] > min_confidence]
+            rows[:, [0, 2]] += x
+            rows[:, [1, 3]] += y
+            per_image[index].append(rows)
+            per_source[index].append(np.full(len(rows), source))
+        return [
+            merge_boxes(np.concatenate(rows), np.concatenate(sources)) if rows else np.zeros((0, 6), np.float32)
+            for rows, sources in zip(per_image, per_source)
+        ]
@@ -0,0 +1,480 @@
+"""Walk-around video analysis: frame sampling, duplicate skipping and damage tracking.
+
+A walk-around video is hundreds of frames of the same few panels. Running
+the detector on each one is slow and reports the same dent once per
+frame. The pipeline here streams frames from the decoder and keeps only a
+few of them in memory at a time:
+
+1. Sampling. An uploaded video is spooled to a temporary file in chunks,
+   never read into memory whole, and opened with `cv2.VideoCapture`. Only
+   VIDEO_SAMPLE_FPS frames per second are decoded. The other frames are
+   `grab()`bed, which skips them without converting their pixels.
+2. Duplicate skipping. Each sampled frame is reduced to a small grayscale
+   thumbnail and compared with the thumbnail of the last kept frame. Frames
+   whose mean absolute difference is under VIDEO_DIFF_THRESHOLD add nothing
+   and are dropped before they reach the detector. For the frames it keeps,
+   phase correlation of the same small image gives the camera motion since
+   the previous kept frame.
+3. Detection. Kept frames go to the detector VIDEO_BATCH_SIZE at a time.
+   The next batch is decoded while the current one is in the model.
+4. Tracking. `IoUTracker` shifts the open tracks by the camera motion and
+   links each frame's boxes to them by IoU, per class. A damage seen in
+   twenty frames is reported once, with its best detection.
+
+A frame sequence (multipart `frames` / `images` parts, or a JSON `frames` /
+`images` list of base64 strings) goes through the same steps, without the
+sampling. Only the first VIDEO_MAX_FRAMES frames are kept, and each one is
+base64- and pixel-decoded when the pipeline reaches it. If the request
+deadline passes mid-video, the damages found so far are returned with
+`truncated: true` instead of a 504. The `sample_fps` and `diff_threshold`
+options override the defaults per request.
+
+Configuration (environment variables):
+    VIDEO_MAX_BYTES       largest accepted upload (default 256 MB)
+    VIDEO_MAX_FRAMES      frames read per request, the rest is ignored (default 5000)
+    VIDEO_SAMPLE_FPS      frames decoded per second of video (default 5, 0 = every frame)
+    VIDEO_DIFF_THRESHOLD  mean absolute thumbnail difference (0-255) under which a frame is a duplicate (default 6)
+    VIDEO_BATCH_SIZE      kept frames per detector call (default 8)
+    VIDEO_TRACK_IOU       IoU that links a detection to a track (default 0.3)
+    VIDEO_TRACK_MAX_AGE   kept frames a track survives without a match (default 5)
+    VIDEO_MIN_TRACK_HITS  detections before a track is reported (default 2)
+"""
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from fastapi import HTTPException, Request
+from starlette.datastructures import UploadFile
+
+import admission
+from admission import DeadlineExceeded
+from inference import run_blocking
+from metrics import phase
+from preprocessing import DECODE_FLAGS
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = int(os.getenv("VIDEO_MAX_BYTES", str(256 * 2**20)))
+MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "5000"))
+SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "5"))
+DIFF_THRESHOLD = float(os.getenv("VIDEO_DIFF_THRESHOLD", "6"))
+BATCH_SIZE = max(1, int(os.getenv("VIDEO_BATCH_SIZE", "8")))
+TRACK_IOU = float(os.getenv("VIDEO_TRACK_IOU", "0.3"))
+TRACK_MAX_AGE = int(os.getenv("VIDEO_TRACK_MAX_AGE", "5"))
+MIN_TRACK_HITS = max(1, int(os.getenv("VIDEO_MIN_TRACK_HITS", "2")))
+
+VIDEO_CONTENT_TYPES = ("application/octet-stream",)
+FRAME_FIELDS = ("frames", "images", "image")
+CHUNK_BYTES = 1 << 20
+THUMBNAIL_SIZE = (32, 32)
+MOTION_WIDTH = 160  # width of the grayscale image the camera motion is measured on
+MOTION_MIN_RESPONSE = 0.1  # weaker phase correlation peaks are treated as no motion
+
+Frame = Tuple[int, Optional[float], np.ndarray]  # (frame index, timestamp in seconds, BGR pixels)
+
+
+class VideoFrames:
+    """Sampled frames of a video file, decoded one at a time"""
+
+    def __init__(self, path: str, sample_fps: float = SAMPLE_FPS, max_frames: int = MAX_FRAMES):
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise HTTPException(status_code=400, detail="Invalid video: the file could not be opened")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 0.0
+        self.max_frames = max_frames
+        # Decode every `stride`-th frame, grab() the rest
+        self.stride = max(1, round(self.fps / sample_fps)) if sample_fps > 0 and self.fps > 0 else 1
+        self.read = 0
+        self._info = {
+            "fps": self.fps,
+            "frame_count": int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "width": int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "sample_stride": self.stride
+        }
+
+    def info(self) -> Dict[str, Any]:
+        return self._info
+
+    def __iter__(self) -> Iterator[Frame]:
+        while self.read < self.max_frames:
+            index = self.read
+            if not self.capture.grab():
+                return
+            self.read += 1
+            if index % self.stride:
+                continue
+            with phase("video", "decode"):
+                ok, frame = self.capture.retrieve()
+            if ok:
+                yield index, index / self.fps if self.fps else None, frame
+
+    def close(self):
+        self.capture.release()
+
+
+class SequenceFrames:
+    """Frames given as separate encoded images, decoded one at a time"""
+
+    def __init__(self, images: List[Any], max_frames: int = MAX_FRAMES):
+        # Encoded bytes, base64 strings or spooled multipart uploads, read on demand
+        self.images = images[:max_frames]
+        self.read = 0
+
+    def info(self) -> Optional[Dict[str, Any]]:
+        return None
+
+    def __iter__(self) -> Iterator[Frame]:
+        for index, image in enumerate(self.images):
+            data = _frame_bytes(image, index)
+            self.read += 1
+            with phase("video", "decode"):
+                frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), DECODE_FLAGS) if data else None
+            if frame is None:
+                raise HTTPException(status_code=400, detail=f"Invalid image: frame {index} could not be decoded")
+            self.images[index] = None  # Release the encoded bytes once decoded
+            yield index, None, frame
+
+    def close(self):
+        self.images = []
+
+
+def _frame_bytes(image: Any, index: int) -> bytes:
+    if isinstance(image, bytes):
+        return image
+    if isinstance(image, str):
+        try:
+            return base64.b64decode(image)
+        except (binascii.Error, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image: frame {index} is not base64 ({str(e)})")
+    if isinstance(image, UploadFile):
+        return image.file.read()
+    raise HTTPException(status_code=400, detail=f"Invalid image: frame {index} must be a base64 string")
+
+
+class DuplicateFilter:
+    """Drops frames that look like the last kept frame and measures the camera motion between kept frames"""
+
+    def __init__(self, threshold: float = DIFF_THRESHOLD):
+        self.threshold = threshold
+        self.last: Optional[np.ndarray] = None
+        self.last_motion: Optional[np.ndarray] = None
+        self._window: Optional[np.ndarray] = None
+        self.skipped = 0
+
+    def keep(self, frame: np.ndarray) -> Optional[Tuple[float, float]]:
+        """Camera shift in pixels since the last kept frame, None if `frame` is a duplicate"""
+        with phase("video", "dedup"):
+            # Strided view instead of a full-frame resize, the check only needs a rough image
+            step = max(1, frame.shape[1] // MOTION_WIDTH)
+            small = cv2.cvtColor(np.ascontiguousarray(frame[::step, ::step]), cv2.COLOR_BGR2GRAY)
+            thumbnail = cv2.resize(small, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+            if self.last is not None and cv2.absdiff(thumbnail, self.last).mean() < self.threshold:
+                self.skipped += 1
+                return None
+            motion = small.astype(np.float32)
+            shift = (0.0, 0.0)
+            if self.last_motion is not None and self.last_motion.shape == motion.shape:
+                if self._window is None or self._window.shape != motion.shape:
+                    self._window = cv2.createHanningWindow(motion.shape[::-1], cv2.CV_32F)
+                (dx, dy), response = cv2.phaseCorrelate(self.last_motion, motion, self._window)
+                if response >= MOTION_MIN_RESPONSE:
+                    shift = (dx * step, dy * step)
+            self.last, self.last_motion = thumbnail, motion
+            return shift
+
+
+def box_iou(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """IoU matrix between two sets of xyxy boxes"""
+    x1 = np.maximum(boxes[:, None, 0], others[None, :, 0])
+    y1 = np.maximum(boxes[:, None, 1], others[None, :, 1])
+    x2 = np.minimum(boxes[:, None, 2], others[None, :, 2])
+    y2 = np.minimum(boxes[:, None, 3], others[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    other_areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    union = areas[:, None] + other_areas[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0.0)
+
+
+class Track:
+    """One physical damage followed across frames"""
+
+    def __init__(self, track_id: int, detection: Dict[str, Any], frame_index: int, timestamp: Optional[float]):
+        self.track_id = track_id
+        self.cls = detection["class"]
+        self.bbox = detection["bbox"]
+        self.best = detection
+        self.best_frame = frame_index
+        self.first_frame = self.last_frame = frame_index
+        self.first_seen = self.last_seen = timestamp
+        self.hits = 1
+        self.misses = 0
+
+    def update(self, detection: Dict[str, Any], frame_index: int, timestamp: Optional[float]):
+        self.bbox = detection["bbox"]
+        self.last_frame, self.last_seen = frame_index, timestamp
+        self.hits += 1
+        self.misses = 0
+        if detection["confidence"] > self.best["confidence"]:
+            self.best, self.best_frame = detection, frame_index
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "track_id": self.track_id,
+            "class": self.cls,
+            "confidence": self.best["confidence"],
+            "bbox": self.best["bbox"],
+            "best_frame": self.best_frame,
+            "first_frame": self.first_frame,
+            "last_frame": self.last_frame,
+            "first_seen_seconds": self.first_seen,
+            "last_seen_seconds": self.last_seen,
+            "frames_detected": self.hits
+        }
+
+
+class IoUTracker:
+    """Greedy IoU matching of each frame's detections to the open tracks of the same class"""
+
+    def __init__(self, iou_threshold: float = TRACK_IOU, max_age: int = TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.active: List[Track] = []
+        self.finished: List[Track] = []
+        self._next_id = 1
+
+    def update(self, detections: List[Dict[str, Any]], frame_index: int, timestamp: Optional[float] = None,
+               shift: Tuple[float, float] = (0.0, 0.0)):
+        """Match one frame's detections, `shift` is the camera motion since the previous frame"""
+        matched_tracks, matched_detections = set(), set()
+        if self.active and detections:
+            # Where the tracked boxes are expected in this frame
+            predicted = np.array([track.bbox for track in self.active], dtype=np.float32)
+            predicted += np.array([shift[0], shift[1], shift[0], shift[1]], dtype=np.float32)
+            iou = box_iou(predicted, np.array([d["bbox"] for d in detections], dtype=np.float32))
+            same_class = np.array([[track.cls == d["class"] for d in detections] for track in self.active])
+            iou[~same_class] = 0.0
+            # Best pairs first
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                t, d = divmod(int(flat), len(detections))
+                if iou[t, d] < self.iou_threshold:
+                    break
+                if t in matched_tracks or d in matched_detections:
+                    continue
+                self.active[t].update(detections[d], frame_index, timestamp)
+                matched_tracks.add(t)
+                matched_detections.add(d)
+
+        still_active = []
+        for t, track in enumerate(self.active):
+            if t not in matched_tracks:
+                track.misses += 1
+            (self.finished if track.misses > self.max_age else still_active).append(track)
+        for d, detection in enumerate(detections):
+            if d not in matched_detections:
+                still_active.append(Track(self._next_id, detection, frame_index, timestamp))
+                self._next_id += 1
+        self.active = still_active
+
+    def tracks(self, min_hits: int = MIN_TRACK_HITS) -> List[Track]:
+        """Tracks seen in at least `min_hits` frames, by first appearance"""
+        tracks = sorted(self.finished + self.active, key=lambda track: track.track_id)
+        return [track for track in tracks if track.hits >= min_hits]
+
+
+def next_kept_frames(frames: Iterator[Frame], duplicates: DuplicateFilter,
+                     count: int) -> List[Tuple[Frame, Tuple[float, float]]]:
+    """Read frames until `count` of them pass the duplicate filter or the source ends, with their camera shift"""
+    kept = []
+    for frame in frames:
+        shift = duplicates.keep(frame[2])
+        if shift is not None:
+            kept.append((frame, shift))
+            if len(kept) == count:
+                break
+    return kept
+
+
+async def spool_to_file(chunks, suffix: str = "") -> str:
+    """Write an async byte stream to a temporary file, enforcing VIDEO_MAX_BYTES"""
+    spool = tempfile.NamedTemporaryFile(prefix="video-", suffix=suffix, delete=False)
+    written = 0
+    try:
+        async for chunk in chunks:
+            written += len(chunk)
+            if written > MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Video too large, the limit is {MAX_BYTES} bytes")
+            await run_blocking(spool.write, chunk)
+        spool.close()
+        return spool.name
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        raise
+
+
+async def _upload_chunks(upload: UploadFile):
+    while True:
+        chunk = await upload.read(CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+
+@asynccontextmanager
+async def frame_source(request: Request) -> AsyncIterator[Tuple[Dict[str, Any], Any]]:
+    """Options and frames of a video or frame-sequence request, spooled files are removed on exit.
+
+    The frames are a video file path, or a list of encoded images.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Video too large, the limit is {MAX_BYTES} bytes")
+
+    if content_type.startswith("video/") or content_type in VIDEO_CONTENT_TYPES:
+        path = await spool_to_file(request.stream())
+        try:
+            yield dict(request.query_params), path
+        finally:
+            os.unlink(path)
+        return
+
+    if content_type != "multipart/form-data":
+        yield await _json_frames(request)
+        return
+
+    # Starlette spools file parts to disk, they are read one frame at a time
+    form = await request.form()
+    try:
+        options: Dict[str, Any] = dict(request.query_params)
+        video, images = None, []
+        for key, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                if key == "video":
+                    video = value
+                elif key in FRAME_FIELDS:
+                    images.append(value)
+            else:
+                options[key] = value
+        if video is None:
+            yield options, images
+            return
+        path = await spool_to_file(_upload_chunks(video), os.path.splitext(video.filename or "")[1])
+        try:
+            yield options, path
+        finally:
+            os.unlink(path)
+    finally:
+        await form.close()
+
+
+async def _json_frames(request: Request) -> Tuple[Dict[str, Any], List[Any]]:
+    """Options and base64 frames of a JSON body, capped at MAX_FRAMES and left encoded"""
+    try:
+        payload = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON body: {str(e)}")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+    frames: List[Any] = []
+    for key in FRAME_FIELDS:
+        value = payload.pop(key, None)
+        if value:
+            frames.extend(value if isinstance(value, list) else [value])
+    del frames[MAX_FRAMES:]
+    return {**request.query_params, **payload}, frames
+
+
+def _float_option(options: Dict[str, Any], key: str, default: float) -> float:
+    try:
+        value = float(options.get(key, default))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{key} must be a number")
+    if value < 0:
+        raise HTTPException(status_code=400, detail=f"{key} must not be negative")
+    return value
+
+
+async def analyze_frames(source: Any, detect: Callable[[List[np.ndarray]], Awaitable[List[List[Dict[str, Any]]]]],
+                         options: Optional[Dict[str, Any]] = None, batch_size: int = BATCH_SIZE) -> Dict[str, Any]:
+    """Sample, deduplicate, detect and track over `source`, a video path or a list of encoded frames.
+
+    `options` may override VIDEO_SAMPLE_FPS and VIDEO_DIFF_THRESHOLD with
+    `sample_fps` and `diff_threshold`.
+    """
+    options = options or {}
+    sample_fps = _float_option(options, "sample_fps", SAMPLE_FPS)
+    diff_threshold = _float_option(options, "diff_threshold", DIFF_THRESHOLD)
+    start_time = time.perf_counter()
+    if isinstance(source, str):
+        frames = await run_blocking(VideoFrames, source, sample_fps)
+    else:
+        frames = SequenceFrames(source)
+    if not isinstance(frames, VideoFrames) and not frames.images:
+        raise HTTPException(status_code=400, detail="No video or frames provided")
+
+    duplicates = DuplicateFilter(diff_threshold)
+    tracker = IoUTracker()
+    frame_iterator = iter(frames)
+    kept_count, detections_count, truncated = 0, 0, False
+    deadline = admission.current_deadline()
+    pending = None
+    try:
+        pending = asyncio.ensure_future(run_blocking(next_kept_frames, frame_iterator, duplicates, batch_size))
+        while True:
+            batch = await pending
+            if not batch:
+                break
+            left = admission.remaining(deadline)
+            if left is not None and left <= 0:
+                truncated = True
+                break
+            # Decode the next batch while the detector runs on this one
+            pending = asyncio.ensure_future(run_blocking(next_kept_frames, frame_iterator, duplicates, batch_size))
+            try:
+                results = await detect([pixels for (_, _, pixels), _ in batch])
+            except DeadlineExceeded:
+                truncated = True
+                await pending
+                break
+            with phase("video", "track"):
+                for ((index, timestamp, _), shift), detections in zip(batch, results):
+                    tracker.update(detections, index, timestamp, shift)
+                    detections_count += len(detections)
+            kept_count += len(batch)
+    finally:
+        if pending is not None and not pending.done():
+            await asyncio.wait([pending])
+        frames.close()
+
+    elapsed = time.perf_counter() - start_time
+    sampled = kept_count + duplicates.skipped
+    damages = [track.to_dict() for track in tracker.tracks(min(MIN_TRACK_HITS, max(kept_count, 1)))]
+    logger.info(f"🎞️ Video: {frames.read} frames read, {kept_count} kept, {len(damages)} damages "
+                f"in {elapsed:.2f}s ({frames.read / elapsed if elapsed > 0 else 0:.1f} frames/s)")
+    return {
+        "damages": damages,
+        "frames": {
+            "read": frames.read,
+            "sampled": sampled,
+            "kept": kept_count,
+            "skipped_duplicates": duplicates.skipped,
+            "detections": detections_count
+        },
+        "video": frames.info(),
+        "frames_per_second": frames.read / elapsed if elapsed > 0 else 0.0,
+        "kept_frames_per_second": kept_count / elapsed if elapsed > 0 else 0.0,
+        "truncated": truncated,
+        "processing_time": elapsed
+    }